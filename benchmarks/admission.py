@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Usage: python -m benchmarks.admission [--capacity 8] [--latency-ms 200] [--overload 2] [--seconds 20]
+#
+# Drives /generate-workout at `overload` x the provider's saturation rate
+# (stub provider: `capacity` concurrent calls of `latency-ms` each, the rest
+# queue as behind a real rate limit) twice, each in a fresh loadgen process:
+#   unlimited   FMS_ADMIT_LLM_CONCURRENCY=0: every request is admitted and queues at the provider
+#   admission   LLM stage capped at the provider's capacity, short bounded queue, fast 429/503
+# and compares latency of the requests that were served, degraded (fallback)
+# plans, and how quickly the shed requests were turned away.
+
+
+def run_mode(name: str, env_overrides: dict, args) -> dict:
+    out = os.path.join(tempfile.mkdtemp(), f"{name}.json")
+    env = {**os.environ, **env_overrides,
+           "FMS_LLM_BACKEND": "stub", "FMS_STUB_LATENCY_MS": str(args.latency_ms),
+           "FMS_STUB_CAPACITY": str(args.capacity)}
+    rate = args.overload * args.capacity / (args.latency_ms / 1000)
+    cmd = [sys.executable, "-m", "benchmarks.loadgen", "--rate", f"{rate:g}", "--duration", str(args.seconds),
+           "--timeout", "60", "--json", out]
+    print(f"▶️  {name}: {rate:g} rps for {args.seconds:g}s ({args.overload:g}x saturation)", flush=True)
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(out) as f:
+        return json.load(f)["overall"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load shedding vs unbounded queueing at overload.")
+    parser.add_argument("--capacity", type=int, default=8, help="Concurrent calls the stub provider serves")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Stub provider latency per call")
+    parser.add_argument("--overload", type=float, default=2.0, help="Offered load as a multiple of saturation")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--queue", type=int, default=None, help="Admission queue length (default: capacity)")
+    parser.add_argument("--max-wait-s", type=float, default=1.0)
+    args = parser.parse_args()
+
+    saturation = args.capacity / (args.latency_ms / 1000)
+    print(f"Provider saturation: {saturation:g} rps ({args.capacity} x {args.latency_ms:g} ms)")
+    modes = {
+        "unlimited": {"FMS_ADMIT_LLM_CONCURRENCY": "0"},
+        "admission": {"FMS_ADMIT_LLM_CONCURRENCY": str(args.capacity),
+                      "FMS_ADMIT_LLM_QUEUE": str(args.queue if args.queue is not None else args.capacity),
+                      "FMS_ADMIT_LLM_MAX_WAIT_S": str(args.max_wait_s)},
+    }
+    results = {name: run_mode(name, env, args) for name, env in modes.items()}
+
+    rows = [
+        ("offered rps", lambda s: f"{s['offered_rps']:g}"),
+        ("served (2xx)", lambda s: f"{s['ok']}"),
+        ("  with LLM plan", lambda s: f"{s['ok'] - s['fallbacks']}"),
+        ("  fallback plan", lambda s: f"{s['fallbacks']}"),
+        ("shed 429/503", lambda s: f"{s['outcomes'].get('http_429', 0)}/{s['outcomes'].get('http_503', 0)}"),
+        ("served p50 ms", lambda s: f"{s['p50_ms']:g}"),
+        ("served p99 ms", lambda s: f"{s['p99_ms']:g}"),
+        ("served max ms", lambda s: f"{s['max_ms']:g}"),
+        ("shed p99 ms", lambda s: "-" if s["shed_p99_ms"] is None else f"{s['shed_p99_ms']:g}"),
+    ]
+    print(f"\n{'':18s}" + "".join(f"{name:>14s}" for name in results))
+    for label, fmt in rows:
+        print(f"{label:18s}" + "".join(f"{fmt(s):>14s}" for s in results.values()))
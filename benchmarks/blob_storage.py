@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import create_engine
+
+from src.blobs import encode_blob, blob_row, profile_blob, canonical_json, active_codec
+from src.database import Base
+from src.pipeline import FMS_TESTS
+from src.schemas import FMSProfileRequest
+from benchmarks.first_request import SAMPLE_PROFILE
+
+# Usage: python -m benchmarks.blob_storage [--rows 1000000] [--profiles 50000] [--plans 5000]
+#
+# Writes the same synthetic assessments twice into fresh SQLite files:
+#   inline  full profile JSON in assessment_inputs.raw_json_data and the plan in
+#           assessment_scores.generated_workout (the layout before content_blobs)
+#   blobs   content-addressed, compressed rows in content_blobs, referenced by hash
+# and reports insert time, bytes written (/proc/self/io) and per-table size (dbstat).
+#
+# Profiles are drawn Zipf-like from a pool of `profiles` distinct checkbox sets
+# (athlete ids are unique per row and stored in their own column); each profile
+# maps to one of `plans` distinct plans, as a temperature-0 LLM would.
+
+PLAN_TIPS = ["Keep the ribs down.", "Drive the knees out.", "Pause at the bottom.", "Slow the eccentric.",
+             "Heels stay heavy.", "Brace before each rep.", "Own the end range.", "Breathe out at the top."]
+
+
+def synthetic_profile(i: int):
+    rng = random.Random(i)
+    base = FMSProfileRequest(**SAMPLE_PROFILE).model_dump()  # every checkbox present, as stored
+    for test in FMS_TESTS:
+        section = base[test]
+        section["score"] = rng.choice([1, 2, 2, 3, 3])
+        for fields in section.values():
+            if isinstance(fields, dict):
+                for fault in fields:
+                    fields[fault] = 1 if rng.random() < 0.08 else 0
+    return base
+
+
+def synthetic_plan(i: int):
+    rng = random.Random(-i - 1)
+    level = rng.choice([1, 3, 5, 7, 9])
+    return {
+        "session_title": f"Level {level} Corrective Session",
+        "estimated_duration": "20-30 min",
+        "difficulty_color": rng.choice(["Red", "Yellow", "Green"]),
+        "coach_summary": f"Plan {i}: address the flagged faults before progressing load. " * 2,
+        "exercises": [
+            {
+                "name": f"EXERCISE {rng.randrange(144)}",
+                "tag": "CORRECTIVE",
+                "sets_reps": f"{rng.randint(2, 4)} x {rng.choice([6, 8, 10, 12])}",
+                "tempo": "3-1-1",
+                "coach_tip": " ".join(rng.sample(PLAN_TIPS, 3)),
+            }
+            for _ in range(6)
+        ],
+        "calculated_scores": {test: rng.randint(1, 3) for test in FMS_TESTS},
+    }
+
+
+def workload(rows: int, profiles: int, plans: int, seed: int = 1):
+    """(row index, profile index, plan index) with Zipf(1.1)-like profile popularity."""
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / (k + 1) ** 1.1 for k in range(profiles)))
+    for start in range(0, rows, 10_000):
+        picks = rng.choices(range(profiles), cum_weights=cum_weights, k=min(10_000, rows - start))
+        for offset, p in enumerate(picks):
+            yield start + offset, p, p % plans
+
+
+def io_counters():
+    values = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                values[key] = int(value)
+    except OSError:
+        pass
+    return values
+
+
+def table_sizes(conn):
+    try:
+        return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:  # SQLite built without dbstat
+        return {}
+
+
+def run(mode: str, args, profile_cache, plan_cache):
+    path = os.path.join(tempfile.mkdtemp(), f"{mode}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    start_ts = datetime(2020, 1, 1)
+    before, started = io_counters(), time.perf_counter()
+    input_id = 0
+    seen = set()
+    batch_inputs, batch_scores, batch_blobs = [], [], []
+
+    def flush():
+        if batch_blobs:
+            conn.executemany("INSERT OR IGNORE INTO content_blobs (hash, codec, raw_size, data) VALUES (?, ?, ?, ?)",
+                             batch_blobs)
+        if mode == "inline":
+            conn.executemany("INSERT INTO assessment_inputs (id, created_at, athlete_id, raw_json_data) VALUES (?, ?, ?, ?)",
+                             batch_inputs)
+            conn.executemany("INSERT INTO assessment_scores (input_id, created_at, athlete_id, total_score, generated_workout) "
+                             "VALUES (?, ?, ?, ?, ?)", batch_scores)
+        else:
+            conn.executemany("INSERT INTO assessment_inputs (id, created_at, athlete_id, raw_hash) VALUES (?, ?, ?, ?)",
+                             batch_inputs)
+            conn.executemany("INSERT INTO assessment_scores (input_id, created_at, athlete_id, total_score, workout_hash) "
+                             "VALUES (?, ?, ?, ?, ?)", batch_scores)
+        conn.commit()
+        batch_inputs.clear(), batch_scores.clear(), batch_blobs.clear()
+
+    for i, p, q in workload(args.rows, args.profiles, args.plans):
+        if p not in profile_cache:
+            profile_cache[p] = synthetic_profile(p)
+        if q not in plan_cache:
+            plan_cache[q] = synthetic_plan(q)
+        athlete_id = f"athlete_{i}"
+        ts = (start_ts + timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        input_id += 1
+
+        if mode == "inline":
+            # What the JSON column stores: the serialized body, athlete id included
+            raw = json.dumps({**profile_cache[p], "athlete_id": athlete_id})
+            batch_inputs.append((input_id, ts, athlete_id, raw))
+            batch_scores.append((input_id, ts, athlete_id, 14, json.dumps(plan_cache[q])))
+        else:
+            # Per request the app hashes both documents and compresses + inserts
+            # only hashes it has not stored yet (store_blobs / remember_blobs)
+            raw_blob = encode_blob(profile_blob(profile_cache[p]))
+            plan_blob = encode_blob(plan_cache[q])
+            for blob in (raw_blob, plan_blob):
+                if blob["hash"] not in seen:
+                    seen.add(blob["hash"])
+                    row = blob_row(blob)
+                    batch_blobs.append((row["hash"], row["codec"], row["raw_size"], row["data"]))
+            batch_inputs.append((input_id, ts, athlete_id, raw_blob["hash"]))
+            batch_scores.append((input_id, ts, athlete_id, 14, plan_blob["hash"]))
+
+        if len(batch_inputs) >= args.batch:
+            flush()
+    flush()
+
+    elapsed = time.perf_counter() - started
+    after = io_counters()
+    sizes = table_sizes(conn)
+    conn.close()
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "rows_per_s": args.rows / elapsed,
+        "wchar": after.get("wchar", 0) - before.get("wchar", 0),
+        "write_bytes": after.get("write_bytes", 0) - before.get("write_bytes", 0),
+        "file_bytes": os.path.getsize(path),
+        "sizes": sizes,
+        "blobs": len(seen),
+    }
+
+
+def mib(n: float) -> str:
+    return f"{n / 2**20:,.1f} MiB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inline JSON vs content-addressed blob storage.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--profiles", type=int, default=50_000, help="Distinct checkbox sets")
+    parser.add_argument("--plans", type=int, default=5_000, help="Distinct generated plans")
+    parser.add_argument("--batch", type=int, default=5_000)
+    args = parser.parse_args()
+
+    profile_cache, plan_cache = {}, {}
+    sample = synthetic_profile(0)
+    print(f"Codec {active_codec()}; sample profile {len(canonical_json(sample))} B raw, "
+          f"{len(blob_row(encode_blob(sample))['data'])} B compressed; plan {len(canonical_json(synthetic_plan(0)))} B raw, "
+          f"{len(blob_row(encode_blob(synthetic_plan(0)))['data'])} B compressed")
+
+    # Generate the documents up front so neither timed run pays for it
+    for _, p, q in workload(args.rows, args.profiles, args.plans):
+        if p not in profile_cache:
+            profile_cache[p] = synthetic_profile(p)
+            plan_cache.setdefault(q, synthetic_plan(q))
+
+    results = [run(mode, args, profile_cache, plan_cache) for mode in ("inline", "blobs")]
+
+    tables = ["assessment_inputs", "assessment_scores", "content_blobs"]
+    print(f"\n{args.rows:,} assessments, {args.profiles:,} distinct profiles, {args.plans:,} distinct plans")
+    print(f"{'':24s}" + "".join(f"{r['mode']:>16s}" for r in results))
+    print(f"{'insert time':24s}" + "".join(f"{r['seconds']:>15.1f}s" for r in results))
+    print(f"{'rows/s':24s}" + "".join(f"{r['rows_per_s']:>16,.0f}" for r in results))
+    print(f"{'bytes written (wchar)':24s}" + "".join(f"{mib(r['wchar']):>16s}" for r in results))
+    print(f"{'bytes written (disk)':24s}" + "".join(f"{mib(r['write_bytes']):>16s}" for r in results))
+    print(f"{'database file':24s}" + "".join(f"{mib(r['file_bytes']):>16s}" for r in results))
+    for table in tables:
+        print(f"{table:24s}" + "".join(f"{mib(r['sizes'].get(table, 0)):>16s}" for r in results))
+    print(f"{'distinct blobs':24s}" + "".join(f"{r['blobs']:>16,}" for r in results))
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='fms-catalog-')}/catalog.db"
+
+from sqlalchemy import text
+
+from src.database import engine, Base, AsyncSessionLocal
+from src.eval.retrieval_harness import load_golden, percentile, GOLDEN_PATH
+from src.rag import retriever, catalog
+from src.rag.catalog import (import_catalog, read_catalog, rank_in_catalog, rank_query, search_catalog, search_query,
+                             MAX_REACH_HOPS)
+from src.rag.knowledge_base import JSON_KB_PATH
+from src.rag.progression import link_progressions
+from benchmarks.kb_memory import synthetic_kb
+
+# Usage: python -m benchmarks.exercise_catalog [--exercises 0] [--queries 500] [--hops 0,1,2,3]
+#
+# Imports a KB into the exercise catalog of a fresh SQLite file (or DATABASE_URL)
+# and checks that the pushed-down ranking query returns exactly what in-memory
+# rank_exercises returns, for every golden profile and `queries` random tag sets
+# per hop setting (exit 1 on any difference). Then times both miss paths, checks
+# that a catalog edit makes a stale KB fall back, and prints the query plans.
+# --exercises 0 uses the real KB file; N > 0 a synthetic KB of N exercises.
+
+VOCAB = sorted(set(retriever.FAULT_TO_TAG_MAP.values()) | set(retriever.TEST_PATTERN_TAGS.values()))
+
+
+def workload(golden, queries: int, seed: int = 11):
+    rng = random.Random(seed)
+    cases = []
+    for case in golden:
+        level = retriever.analyze_fms_profile(case["profile"], use_manual_scores=case["profile"].get('use_manual_scores', False)).get('target_level', 1)
+        cases.append((level, frozenset(retriever.build_search_tags(level, case["profile"]))))
+    for _ in range(queries):
+        level = rng.choice(retriever.TARGET_LEVELS)
+        cases.append((level, frozenset({f"level_{level}", *rng.sample(VOCAB, rng.randint(0, 5))})))
+    return cases
+
+
+async def compare(kb, cases, hops: int):
+    retriever.PROGRESSION_HOPS = hops  # rank_exercises reads it per call
+    mismatches, mem_us, sql_us = 0, [], []
+    for level, tags in cases:
+        t0 = time.perf_counter()
+        expected = [ex["id"] for ex in retriever.rank_exercises(kb, level, tags)]
+        t1 = time.perf_counter()
+        got = await rank_in_catalog(kb, level, tags, hops, retriever.HOP_PENALTY, retriever.TOP_K)
+        t2 = time.perf_counter()
+        mem_us.append((t1 - t0) * 1e6)
+        sql_us.append((t2 - t1) * 1e6)
+        if got is None or [ex["id"] for ex in got] != expected:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"   ❌ level {level} tags {sorted(tags)}: memory {expected} vs sql {got and [ex['id'] for ex in got]}")
+    return mismatches, mem_us, sql_us
+
+
+async def explain(stmt):
+    async with engine.connect() as conn:
+        if conn.dialect.name != "sqlite":
+            return []
+        compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        return [row[-1] for row in (await conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))).all()]
+
+
+async def main(args):
+    catalog.RANK_IN_DB = True  # what FMS_CATALOG_RANK_IN_DB=1 serves
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    if args.exercises:
+        exercises = synthetic_kb(args.exercises)
+        link_progressions(exercises)
+    else:
+        with open(JSON_KB_PATH, encoding='utf-8') as f:
+            exercises = json.load(f)
+    t0 = time.perf_counter()
+    await import_catalog(exercises)
+    print(f"   import {time.perf_counter() - t0:.2f}s")
+    async with AsyncSessionLocal() as db:
+        kb = await read_catalog(db, "")
+
+    cases = workload(load_golden(args.golden), args.queries)
+    failed = 0
+    for hops in [int(h) for h in args.hops.split(",") if int(h) <= MAX_REACH_HOPS]:
+        mismatches, mem_us, sql_us = await compare(kb, cases, hops)
+        failed += mismatches
+        print(f"🔁 hops={hops}: {len(cases) - mismatches}/{len(cases)} rankings identical | "
+              f"memory p50 {percentile(mem_us, 50):7.1f} µs p99 {percentile(mem_us, 99):7.1f} µs | "
+              f"sql p50 {percentile(sql_us, 50):7.1f} µs p99 {percentile(sql_us, 99):7.1f} µs")
+
+    # An edit bumps the version: the KB read before it must not be ranked from the new rows
+    edited = [dict(ex) for ex in exercises]
+    edited[0]["tags"] = [*edited[0].get("tags", []), "coach_edited"]
+    await import_catalog(edited)
+    level, tags = cases[0]
+    stale = await rank_in_catalog(kb, level, tags, 1, retriever.HOP_PENALTY, retriever.TOP_K)
+    print(f"🧭 Stale KB after an edit: {'falls back to memory' if stale is None else 'RANKED FROM NEW ROWS'}")
+    failed += stale is not None
+
+    async with AsyncSessionLocal() as db:
+        found = await search_catalog(db, ["fix_heels_lift", "ankle_mobility"], level=1)
+        fresh = await read_catalog(db, "")
+    print(f"🔎 Tag search fix_heels_lift|ankle_mobility at level 1: {len(found)} exercises")
+    for line in await explain(rank_query(fresh, level, tags, 1, retriever.HOP_PENALTY, retriever.TOP_K)):
+        print(f"   rank plan   {line}")
+    for line in await explain(search_query(["fix_heels_lift", "ankle_mobility"], level=1)):
+        print(f"   search plan {line}")
+
+    print("✅ SQL ranking matches in-memory ranking." if not failed else f"❌ {failed} mismatches")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise catalog: SQL ranking equivalence and latency.")
+    parser.add_argument("--exercises", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--hops", default="0,1,2,3")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    asyncio.run(main(parser.parse_args()))
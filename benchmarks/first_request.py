@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Usage: python -m benchmarks.first_request [--requests 30]
+#
+# Starts the app in a fresh interpreter twice (FMS_WARMUP=0 and FMS_WARMUP=1),
+# with the stub LLM and a throwaway SQLite file and shared cache, and compares
+# the latency of the first /generate-workout request against the steady-state
+# median. Every request sends a different profile (varied manual scores) and
+# near-duplicate reuse is off, so each one reaches the LLM stage.
+
+SAMPLE_PROFILE = {
+    "overhead_squat": {"score": 2, "trunk_torso": {"upright_torso": 1}, "lower_limb": {"knee_valgus": 1},
+                       "feet": {"heels_lift": 1}, "upper_body_bar_position": {}},
+    "hurdle_step": {"score": 2, "pelvis_core_control": {}, "stance_leg": {}, "stepping_leg": {}},
+    "inline_lunge": {"score": 2, "alignment": {}, "lower_body_control": {}, "balance_stability": {}},
+    "shoulder_mobility": {"score": 3, "reach_quality": {}, "compensation": {}, "pain": {}},
+    "active_straight_leg_raise": {"score": 3, "non_moving_leg": {}, "moving_leg": {}, "pelvic_control": {}},
+    "trunk_stability_pushup": {"score": 3, "body_alignment": {}, "core_control": {}, "upper_body": {}},
+    "rotary_stability": {"score": 2, "diagonal_pattern": {}, "spinal_control": {}, "symmetry": {}},
+}
+
+
+def varied_profiles(seed: int = 1) -> list:
+    """SAMPLE_PROFILE under every combination of manual scores 1-3: one distinct LLM input each."""
+    tests = [test for test in SAMPLE_PROFILE if isinstance(SAMPLE_PROFILE[test], dict)]
+    profiles = []
+    for scores in itertools.product((1, 2, 3), repeat=len(tests)):
+        profile = copy.deepcopy(SAMPLE_PROFILE)
+        profile["use_manual_scores"] = True
+        for test, score in zip(tests, scores):
+            profile[test]["score"] = score
+        profiles.append(profile)
+    random.Random(seed).shuffle(profiles)
+    return profiles
+
+
+async def child(requests_count: int):
+    import httpx
+    import main
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            waited = time.perf_counter()
+            while (await client.get("/readyz")).status_code != 200:
+                await asyncio.sleep(0.01)
+            ready_after_ms = (time.perf_counter() - waited) * 1000
+
+            latencies = []
+            for profile in varied_profiles()[:requests_count]:
+                started = time.perf_counter()
+                response = await client.post("/generate-workout", json=profile)
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    sys.__stdout__.write(json.dumps({"ready_after_ms": ready_after_ms, "latencies_ms": latencies}) + "\n")
+
+
+def run_mode(warmup: bool, requests_count: int) -> dict:
+    # Own DB and shared cache per run: the warm run must not read plans the cold run stored
+    workdir = tempfile.mkdtemp(prefix="fms-first-request-")
+    env = dict(os.environ)
+    env.update({
+        "FMS_WARMUP": "1" if warmup else "0",
+        "FMS_LLM_BACKEND": "stub",
+        "FMS_STUB_LATENCY_MS": env.get("FMS_STUB_LATENCY_MS", "20"),
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "FMS_CACHE_PATH": os.path.join(workdir, "shared_cache.sqlite"),
+        "FMS_PLAN_SIMILAR_REUSE": "0",
+    })
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.first_request", "--child", "--requests", str(requests_count)],
+        capture_output=True, text=True, env=env
+    )
+    shutil.rmtree(workdir, ignore_errors=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.stdout = open(os.devnull, "w")
+        asyncio.run(child(args.requests))
+        sys.exit(0)
+
+    print(f"{'mode':<10}{'ready after':>14}{'first req':>12}{'steady p50':>12}{'steady p95':>12}{'first/p50':>11}")
+    for warmup in (False, True):
+        result = run_mode(warmup, args.requests)
+        first, rest = result["latencies_ms"][0], result["latencies_ms"][1:]
+        p50 = statistics.median(rest)
+        p95 = statistics.quantiles(rest, n=20)[-1]
+        print(f"{'warm' if warmup else 'cold':<10}{result['ready_after_ms']:>12.1f}ms"
+              f"{first:>10.1f}ms{p50:>10.1f}ms{p95:>10.1f}ms{first / p50:>11.2f}")
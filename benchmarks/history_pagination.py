@@ -0,0 +1,98 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import create_engine, select, func
+
+from src.database import Base, AssessmentScore
+from src.pipeline import FMS_TESTS, history_page_query, encode_cursor
+
+# Usage: python -m benchmarks.history_pagination [--rows 1000000] [--heavy-rows 200000]
+#
+# Fills a SQLite stand-in with `rows` assessment_scores (one "heavy" athlete
+# owns `heavy-rows` of them, the rest are spread over many athletes, and every
+# row carries a ~2 KB generated_workout) and times fetching a 20-row page at
+# increasing depths, keyset (the API's query) vs OFFSET.
+
+PLAN_JSON = '{"session_title": "Level 5", "exercises": [' + ",".join(['{"name": "X", "coach_tip": "' + "y" * 150 + '"}'] * 10) + "]}"
+
+
+def populate(path: str, rows: int, heavy_rows: int, athletes: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(1)
+    start = datetime(2020, 1, 1)
+    conn = sqlite3.connect(path)
+    cols = ["input_id", "athlete_id", "created_at", *FMS_TESTS, "total_score", "generated_workout"]
+    sql = f"INSERT INTO assessment_scores ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+
+    def batch(lo, hi):
+        for i in range(lo, hi):
+            athlete = "heavy" if i < heavy_rows else f"athlete_{rng.randrange(athletes)}"
+            ts = (start + timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S.%f")
+            scores = [rng.randint(1, 3) for _ in FMS_TESTS]
+            yield (i + 1, athlete, ts, *scores, sum(scores), PLAN_JSON)
+
+    step = 50_000
+    for lo in range(0, rows, step):
+        conn.executemany(sql, batch(lo, min(rows, lo + step)))
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def time_query(conn, stmt, repeat: int = 20) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(stmt).all()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--heavy-rows", type=int, default=200_000)
+    parser.add_argument("--athletes", type=int, default=20_000)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "history.db")
+    started = time.perf_counter()
+    populate(path, args.rows, args.heavy_rows, args.athletes)
+    print(f"Populated {args.rows:,} rows ({os.path.getsize(path) / 2**20:.0f} MiB) in {time.perf_counter() - started:.1f}s")
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + str(history_page_query("heavy", args.limit, encode_cursor(datetime(2021, 1, 1), 1))
+                                        .compile(engine, compile_kwargs={"literal_binds": True}))
+        ).all()
+        print("Keyset plan:", " | ".join(r[-1] for r in plan))
+
+        ordered = (select(AssessmentScore.created_at, AssessmentScore.id)
+                   .where(AssessmentScore.athlete_id == "heavy")
+                   .order_by(AssessmentScore.created_at.desc(), AssessmentScore.id.desc()))
+        print(f"\n{'depth':>10}{'keyset ms':>12}{'offset ms':>12}")
+        for depth in (0, 1_000, 10_000, 100_000, args.heavy_rows - args.limit - 1):
+            if depth == 0:
+                keyset_stmt = history_page_query("heavy", args.limit)
+            else:
+                # The cursor a client would hold after paging down to `depth`
+                row = conn.execute(ordered.offset(depth - 1).limit(1)).one()
+                keyset_stmt = history_page_query("heavy", args.limit, encode_cursor(row.created_at, row.id))
+            offset_stmt = history_page_query("heavy", args.limit).offset(depth)
+            print(f"{depth:>10,}{time_query(conn, keyset_stmt):>12.3f}{time_query(conn, offset_stmt, repeat=5):>12.3f}")
+
+        total = conn.execute(select(func.count()).select_from(AssessmentScore)).scalar()
+        print(f"\n{total:,} rows total; page size {args.limit}")
@@ -0,0 +1,109 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+
+# Usage: python -m benchmarks.kb_memory [--exercises 100000] [--workers 4]
+#
+# Builds a synthetic KB (JSON + binary snapshot), then starts N worker
+# processes per format that each load the KB and rank every level once.
+# While all workers are alive, each reads /proc/self/smaps_rollup:
+#   RSS      resident pages, shared pages counted in full
+#   PSS      shared pages divided by the number of processes mapping them
+#   Private  pages only this process holds (what actually multiplies with N)
+
+CATEGORIES = ["WALL SQUATS", "GOBLET SQUATS", "SPLIT SQUATS", "BOX SQUATS", "LUNGES", "PLANKS", "CARRIES"]
+TAGS = ["pattern_squat", "pattern_lunge", "fix_heels_lift", "fix_knee_valgus", "fix_forward_lean",
+        "core_stability", "ankle_mobility", "glute_activation", "rnt_correction", "fix_asymmetry"]
+
+
+def synthetic_kb(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    kb = []
+    for i in range(n):
+        level = rng.randint(1, 10)
+        # Workbook-like rows: ~15 exercises spread over LEVEL 1..10, so the
+        # progression graph has a realistic handful of links per exercise
+        base = CATEGORIES[(i // 15) % len(CATEGORIES)]
+        category = f"{base} {i // 15}"
+        kb.append({
+            "id": f"sq_{level}_{i}",
+            "exercise_name": f"{base} VARIATION {i}",
+            "category": category,
+            "difficulty_level": level,
+            "description": f"A Level {level} {base} exercise. Targeting specific movement patterns and corrective strategies. Variant {i}.",
+            "description_source": rng.choice(["Manual", "Auto"]),
+            "tags": sorted({base.lower().replace(" ", "_"), f"level_{level}", *rng.sample(TAGS, 3)}),
+        })
+    return kb
+
+
+def smaps_rollup_kib():
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def worker(kb_format, path, barrier, results):
+    os.environ["FMS_KB_FORMAT"] = kb_format
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    import contextlib, io
+    with contextlib.redirect_stdout(io.StringIO()):
+        from src.rag.knowledge_base import load_knowledge_base
+        from src.rag.retriever import rank_exercises
+        before = smaps_rollup_kib()
+        kb = load_knowledge_base(path)
+        for level in range(1, 11):
+            rank_exercises(kb, level, frozenset({f"level_{level}", "pattern_squat", "fix_heels_lift"}))
+    barrier.wait()  # every worker alive and loaded before measuring sharing
+    after = smaps_rollup_kib()
+    results.put({k: after[k] - before[k] for k in after} | {"total_rss": after["rss"]})
+    barrier.wait()
+
+
+def measure(kb_format, path, workers):
+    ctx = mp.get_context("spawn")
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(kb_format, path, barrier, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exercises", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    from src.rag.kb_snapshot import build_from_json
+
+    tmp = tempfile.mkdtemp()
+    json_path, snap_path = os.path.join(tmp, "kb.json"), os.path.join(tmp, "kb.kbs")
+    with open(json_path, "w") as f:
+        json.dump(synthetic_kb(args.exercises), f)
+    started = time.perf_counter()
+    snap_size = build_from_json(json_path, snap_path)
+    print(f"KB: {args.exercises} exercises | JSON {os.path.getsize(json_path) / 2**20:.1f} MiB | "
+          f"snapshot {snap_size / 2**20:.1f} MiB (built in {time.perf_counter() - started:.1f}s)")
+
+    print(f"\n{'format':<10}{'workers':>8}{'Δ RSS/worker':>15}{'Δ PSS/worker':>15}{'Δ private/worker':>18}{'Σ Δ PSS':>12}")
+    for kb_format, path in (("json", json_path), ("snapshot", snap_path)):
+        rows = measure(kb_format, path, args.workers)
+        avg = lambda key: sum(r[key] for r in rows) / len(rows) / 1024
+        print(f"{kb_format:<10}{args.workers:>8}{avg('rss'):>12.1f}MiB{avg('pss'):>12.1f}MiB"
+              f"{avg('private'):>15.1f}MiB{avg('pss') * len(rows):>9.1f}MiB")
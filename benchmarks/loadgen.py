@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from benchmarks.first_request import varied_profiles
+
+# Usage:
+#   python -m benchmarks.loadgen --rate 20 --duration 30                      # in-process app, stub LLM, SQLite
+#   python -m benchmarks.loadgen --url http://127.0.0.1:8000 --ramp "5@10,5-50@60,50@30"
+#   python -m benchmarks.loadgen --bodies profiles.jsonl --path /generate-workout --rate 10
+#   python -m benchmarks.loadgen --find-saturation --slo-p99-ms 1000 --step-seconds 15
+#
+# Open-loop: arrivals follow the configured schedule (Poisson by default) no
+# matter how slowly the server answers, and latency is measured from each
+# request's *scheduled* send time. A stalled server therefore shows up as
+# queueing latency instead of silently lowering the offered load
+# (coordinated omission).
+#
+# --bodies: JSONL, one request body per line, replayed round-robin. A line may
+# also be {"method": ..., "path": ..., "body": ...} to mix endpoints. Without
+# it, the sample profile is replayed with every combination of manual scores
+# (2187 distinct plans), so the plan cache and near-duplicate reuse do not turn
+# the run into cache hits after the first request.
+# In-process mode runs main.app through httpx's ASGI transport in this event
+# loop (the generator shares the CPU with the app); use --url for real numbers.
+# It also disables near-duplicate reuse and keeps the shared cache in the
+# throwaway directory, never in data/cache.
+
+HISTOGRAM_BOUNDS_MS = [b * 10 ** e for e in range(0, 6) for b in (1, 2, 5)]  # 1ms .. 500s
+REPORT_STREAM = sys.stdout  # in-process mode silences the app's prints, not ours
+
+
+def log(*parts, **kwargs):
+    print(*parts, file=REPORT_STREAM, flush=True, **kwargs)
+
+
+# ── SCHEDULE ──
+def parse_ramp(spec: str) -> List[Tuple[float, float, float]]:
+    """'5@10,5-50@60,50@30' -> [(start_rate, end_rate, seconds), ...]; a-b ramps linearly."""
+    stages = []
+    for part in spec.split(","):
+        rates, seconds = part.strip().split("@")
+        start, _, end = rates.partition("-")
+        stages.append((float(start), float(end or start), float(seconds)))
+    return stages
+
+
+def arrival_times(stages: List[Tuple[float, float, float]], poisson: bool, seed: int) -> List[Tuple[float, int]]:
+    """(offset_s, stage_index) for every request of the run."""
+    rng = random.Random(seed)
+    arrivals = []
+    offset = 0.0
+    for index, (start_rate, end_rate, seconds) in enumerate(stages):
+        t = 0.0
+        while True:
+            rate = start_rate + (end_rate - start_rate) * (t / seconds)
+            if rate <= 0:
+                break
+            t += rng.expovariate(rate) if poisson else 1.0 / rate
+            if t >= seconds:
+                break
+            arrivals.append((offset + t, index))
+        offset += seconds
+    return arrivals
+
+
+def load_requests(path: Optional[str], default_path: str) -> List[Tuple[str, str, Any]]:
+    if not path:
+        return [("POST", default_path, profile) for profile in varied_profiles()]
+    requests_ = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, dict) and "body" in item and ("path" in item or "method" in item):
+                requests_.append((item.get("method", "POST").upper(), item.get("path", default_path), item["body"]))
+            else:
+                requests_.append(("POST", default_path, item))
+    return requests_
+
+
+# ── RUN ──
+async def fire(client, method: str, path: str, body: Any, intended: float, timeout: float, stage: int) -> Dict[str, Any]:
+    sent = time.perf_counter()
+    fallback = False
+    try:
+        response = await asyncio.wait_for(client.request(method, path, json=body), timeout)
+        outcome = "ok" if response.status_code < 400 else f"http_{response.status_code}"
+        fallback = outcome == "ok" and b'"fallback_reason"' in response.content
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+    except Exception as e:
+        outcome = type(e).__name__
+    done = time.perf_counter()
+    return {
+        "stage": stage,
+        "outcome": outcome,
+        "fallback": fallback,  # served, but with the degraded (non-LLM) plan
+        "latency_ms": (done - intended) * 1000,   # includes time spent behind schedule
+        "service_ms": (done - sent) * 1000,
+        "lag_ms": (sent - intended) * 1000,
+        "done": done,
+    }
+
+
+async def run_open_loop(
+    client,
+    requests_: List[Tuple[str, str, Any]],
+    stages: List[Tuple[float, float, float]],
+    timeout: float,
+    max_inflight: int,
+    poisson: bool = True,
+    seed: int = 1
+) -> Dict[str, Any]:
+    schedule = arrival_times(stages, poisson, seed)
+    tasks: List[asyncio.Task] = []
+    dropped = Counter()
+    inflight = 0
+
+    def finished(_task):
+        nonlocal inflight
+        inflight -= 1
+
+    start = time.perf_counter()
+
+    for n, (offset, stage) in enumerate(schedule):
+        intended = start + offset
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if inflight >= max_inflight:
+            dropped[stage] += 1  # client-side protection; counted as an error
+            continue
+        method, path, body = requests_[n % len(requests_)]
+        task = asyncio.create_task(fire(client, method, path, body, intended, timeout, stage))
+        inflight += 1
+        task.add_done_callback(finished)
+        tasks.append(task)
+
+    results = await asyncio.gather(*tasks)
+    return {"started": start, "stages": stages, "results": results, "dropped": dropped,
+            "wall_s": time.perf_counter() - start}
+
+
+# ── REPORT ──
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(results: List[Dict[str, Any]], offered: int, seconds: float, dropped: int = 0) -> Dict[str, Any]:
+    latencies = sorted(r["latency_ms"] for r in results if r["outcome"] == "ok")
+    outcomes = Counter(r["outcome"] for r in results)
+    if dropped:
+        outcomes["client_dropped"] += dropped
+    errors = offered - outcomes.get("ok", 0)
+    shed = sorted(r["latency_ms"] for r in results if r["outcome"] in ("http_429", "http_503"))
+    return {
+        "offered": offered,
+        "offered_rps": round(offered / seconds, 2) if seconds else 0.0,
+        "ok": outcomes.get("ok", 0),
+        "achieved_rps": round(outcomes.get("ok", 0) / seconds, 2) if seconds else 0.0,
+        "error_rate": round(errors / offered, 4) if offered else 0.0,
+        "outcomes": dict(outcomes),
+        "fallbacks": sum(1 for r in results if r.get("fallback")),
+        "shed_p99_ms": round(percentile(shed, 99), 1) if shed else None,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p90_ms": round(percentile(latencies, 90), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "p999_ms": round(percentile(latencies, 99.9), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else float("nan"),
+        "mean_lag_ms": round(sum(r["lag_ms"] for r in results) / len(results), 2) if results else 0.0,
+        "histogram": histogram(latencies),
+    }
+
+
+def histogram(latencies: List[float]) -> List[Tuple[str, int]]:
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for ms in latencies:
+        counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+    buckets = []
+    for i, n in enumerate(counts):
+        label = f"<= {HISTOGRAM_BOUNDS_MS[i]:g} ms" if i < len(HISTOGRAM_BOUNDS_MS) else f"> {HISTOGRAM_BOUNDS_MS[-1]:g} ms"
+        buckets.append((label, n))
+    while buckets and buckets[-1][1] == 0:
+        buckets.pop()
+    first = next((i for i, (_, n) in enumerate(buckets) if n), len(buckets))
+    return buckets[first:]
+
+
+def report_run(run: Dict[str, Any]) -> Dict[str, Any]:
+    stages, results = run["stages"], run["results"]
+    per_stage = []
+    for index, (start_rate, end_rate, seconds) in enumerate(stages):
+        stage_results = [r for r in results if r["stage"] == index]
+        dropped = run["dropped"].get(index, 0)
+        summary = summarize(stage_results, len(stage_results) + dropped, seconds, dropped)
+        summary["target_rps"] = f"{start_rate:g}" if start_rate == end_rate else f"{start_rate:g}-{end_rate:g}"
+        per_stage.append(summary)
+    total_dropped = sum(run["dropped"].values())
+    overall = summarize(results, len(results) + total_dropped, sum(s for _, _, s in stages), total_dropped)
+    return {"stages": per_stage, "overall": overall, "wall_s": round(run["wall_s"], 2)}
+
+
+def print_summary(title: str, s: Dict[str, Any], with_histogram: bool = True):
+    log(f"\n{title}")
+    log(f"   offered {s['offered']} ({s['offered_rps']} rps)  ok {s['ok']} ({s['achieved_rps']} rps)  "
+          f"errors {s['error_rate'] * 100:.2f}%  {s['outcomes']}")
+    log(f"   latency p50 {s['p50_ms']}  p90 {s['p90_ms']}  p99 {s['p99_ms']}  p99.9 {s['p999_ms']}  "
+          f"max {s['max_ms']} ms  (mean schedule lag {s['mean_lag_ms']} ms)")
+    if s["fallbacks"] or s["shed_p99_ms"] is not None:
+        log(f"   degraded (fallback plan) {s['fallbacks']}  shed (429/503) p99 {s['shed_p99_ms']} ms")
+    if with_histogram and s["histogram"]:
+        peak = max(n for _, n in s["histogram"]) or 1
+        for label, n in s["histogram"]:
+            log(f"   {label:>14s} {n:7d} {'#' * max(1 if n else 0, round(40 * n / peak))}")
+
+
+# ── TARGETS ──
+class InProcessTarget:
+    """main.app over httpx.ASGITransport, with the stub LLM and a throwaway SQLite DB and cache."""
+
+    def __init__(self):
+        workdir = tempfile.mkdtemp(prefix="fms-loadgen-")
+        self.db_path = os.path.join(workdir, "loadgen.db")
+        os.environ.setdefault("FMS_LLM_BACKEND", "stub")
+        os.environ.setdefault("FMS_STUB_LATENCY_MS", "200")
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{self.db_path}"
+        # Measure the LLM stage: a near-duplicate hit would answer from an earlier plan
+        os.environ["FMS_PLAN_SIMILAR_REUSE"] = "0"
+        os.environ["FMS_CACHE_PATH"] = os.path.join(workdir, "shared_cache.sqlite")
+
+    async def __aenter__(self):
+        import httpx
+        import main
+
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")  # the app's per-request debug prints
+        self._lifespan = main.lifespan(main.app)
+        await self._lifespan.__aenter__()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadgen")
+        while (await self.client.get("/readyz")).status_code != 200:
+            await asyncio.sleep(0.05)
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await self._lifespan.__aexit__(*exc)
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+class LiveTarget:
+    def __init__(self, url: str, max_connections: int):
+        self.url = url
+        self.max_connections = max_connections
+
+    async def __aenter__(self):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        self.client = httpx.AsyncClient(base_url=self.url, limits=limits, timeout=None)
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+
+# ── SATURATION SEARCH ──
+def within_slo(summary: Dict[str, Any], slo_p99_ms: float, max_error_rate: float) -> bool:
+    return (
+        summary["ok"] > 0
+        and summary["p99_ms"] <= slo_p99_ms
+        and summary["error_rate"] <= max_error_rate
+        and summary["achieved_rps"] >= 0.95 * summary["offered_rps"]
+    )
+
+
+async def find_saturation(client, requests_, args) -> Dict[str, Any]:
+    """Doubles the rate until the SLO breaks, then bisects between the last good and first bad rate."""
+    steps = []
+
+    async def probe(rate: float) -> bool:
+        run = await run_open_loop(client, requests_, [(rate, rate, args.step_seconds)], args.timeout,
+                                  args.max_inflight, poisson=not args.uniform, seed=args.seed + len(steps))
+        summary = report_run(run)["overall"]
+        ok = within_slo(summary, args.slo_p99_ms, args.max_error_rate)
+        steps.append({"rate": rate, "ok": ok, **{k: summary[k] for k in
+                      ("achieved_rps", "error_rate", "p50_ms", "p99_ms")}})
+        log(f"   {rate:8.2f} rps -> achieved {summary['achieved_rps']:8.2f}  p99 {summary['p99_ms']:9.1f} ms  "
+              f"errors {summary['error_rate'] * 100:5.2f}%  {'✅' if ok else '❌'}")
+        return ok
+
+    good, bad, rate = None, None, args.rate
+    while rate <= args.max_rate:
+        if await probe(rate):
+            good, rate = rate, rate * 2
+        else:
+            bad = rate
+            break
+    if good is not None and bad is not None:
+        for _ in range(args.search_steps):
+            mid = (good + bad) / 2
+            if await probe(mid):
+                good = mid
+            else:
+                bad = mid
+    return {"saturation_rps": good, "first_failing_rps": bad, "steps": steps}
+
+
+async def main_async(args) -> Dict[str, Any]:
+    requests_ = load_requests(args.bodies, args.path)
+    target = LiveTarget(args.url, args.max_inflight) if args.url else InProcessTarget()
+    stages = parse_ramp(args.ramp) if args.ramp else [(args.rate, args.rate, args.duration)]
+
+    async with target as client:
+        if args.find_saturation:
+            log(f"🔎 Saturation search: SLO p99 <= {args.slo_p99_ms} ms, errors <= {args.max_error_rate * 100:g}%, "
+                  f"{args.step_seconds}s per step")
+            result = await find_saturation(client, requests_, args)
+            log(f"\n✅ Highest rate within SLO: {result['saturation_rps']} rps "
+                  f"(first failing: {result['first_failing_rps']})")
+            return result
+
+        log(f"🚦 Open-loop run: {len(stages)} stage(s), {len(requests_)} distinct request(s), "
+              f"target {'in-process app' if not args.url else args.url}")
+        result = report_run(await run_open_loop(
+            client, requests_, stages, args.timeout, args.max_inflight, poisson=not args.uniform, seed=args.seed
+        ))
+    if len(stages) > 1:
+        for index, stage in enumerate(result["stages"]):
+            print_summary(f"Stage {index + 1}: {stage['target_rps']} rps for {stages[index][2]:g}s", stage, with_histogram=False)
+    print_summary(f"Overall ({result['wall_s']}s wall)", result["overall"])
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the FMS API.")
+    parser.add_argument("--url", default=None, help="Live server base URL; default: in-process app with the stub LLM")
+    parser.add_argument("--bodies", default=None, help="JSONL of request bodies (default: sample profile, varied scores)")
+    parser.add_argument("--path", default="/generate-workout")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests/s (constant run, or saturation start)")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--ramp", default=None, help="Stages 'rate@s' or 'from-to@s', comma separated")
+    parser.add_argument("--uniform", action="store_true", help="Fixed inter-arrival times instead of Poisson")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-inflight", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--find-saturation", action="store_true")
+    parser.add_argument("--slo-p99-ms", type=float, default=1000.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--step-seconds", type=float, default=15.0)
+    parser.add_argument("--max-rate", type=float, default=2000.0)
+    parser.add_argument("--search-steps", type=int, default=4)
+    parser.add_argument("--json", default=None, help="Write the full result here")
+    args = parser.parse_args()
+
+    outcome = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(outcome, f, indent=2)
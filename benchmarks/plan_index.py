@@ -0,0 +1,158 @@
+import argparse
+import copy
+import os
+import resource
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.pipeline import FMS_TESTS
+from src.plan_index import PlanIndex, plan_partition, plan_tokens, SIMILARITY_THRESHOLD
+from src.rag.knowledge_base import load_knowledge_base
+from src.rag.retriever import build_search_tags, cached_rank
+from src.eval.retrieval_harness import GOLDEN_PATH, load_golden, recall_at_k, ndcg_at_k, percentile
+from benchmarks.blob_storage import synthetic_profile
+
+# Usage: python -m benchmarks.plan_index [--plans 300000] [--queries 20000] [--threshold 0.8] [--golden ...]
+#
+# scale    indexes `plans` distinct synthetic inputs (real analysis + retrieval,
+#          so partitions are realistic), then times lookups for one-checkbox
+#          variants of indexed inputs and for unseen inputs; reports p50/p99,
+#          reuse rate, candidates compared and the RSS the index added
+# golden   indexes one plan per golden case, then looks up every one-checkbox
+#          variant of each case. A served plan must have been generated from
+#          exactly the exercises the variant retrieves; recall/nDCG of served
+#          plans against the golden labels is compared with fresh retrieval.
+#          Leave-one-out: each case against an index of the other cases.
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def retrieve(kb, profile):
+    analysis = analyze_fms_profile(profile, use_manual_scores=profile.get('use_manual_scores', False))
+    level = analysis.get("target_level", 1)
+    return analysis, list(cached_rank(kb, level, build_search_tags(level, profile))[0])
+
+
+def fault_paths(profile):
+    return [(test, category, fault) for test in FMS_TESTS
+            for category, fields in profile[test].items() if isinstance(fields, dict) for fault in fields]
+
+
+def flip(profile, path):
+    test, category, fault = path
+    variant = copy.deepcopy(profile)
+    variant[test][category][fault] = 0 if variant[test][category][fault] else 1
+    return variant
+
+
+def variants(profile):
+    """Every input that differs from `profile` by one fault checkbox."""
+    for path in fault_paths(profile):
+        yield flip(profile, path)
+
+
+def run_scale(kb, plans: int, queries: int, threshold: float):
+    index = PlanIndex(threshold=threshold, max_entries=plans)
+    profiles = []
+    rss_before, started = rss_mib(), time.perf_counter()
+    for i in range(plans):
+        profile = synthetic_profile(i)
+        analysis, exercises = retrieve(kb, profile)
+        index.add(plan_partition(profile, analysis, exercises), plan_tokens(profile, analysis), f"{i:032x}", i)
+        if i < queries:
+            profiles.append(profile)
+    build_s, rss_after = time.perf_counter() - started, rss_mib()
+
+    results = {}
+    for label, source in (("one-checkbox variants", "variant"), ("unseen inputs", "unseen")):
+        timings, hits, candidates_before = [], 0, index.counters["candidates"]
+        for i in range(queries):
+            if source == "variant":
+                paths = fault_paths(profiles[i])
+                profile = flip(profiles[i], paths[i % len(paths)])
+            else:
+                profile = synthetic_profile(plans + i)
+            analysis, exercises = retrieve(kb, profile)
+            t0 = time.perf_counter()
+            found = index.lookup(plan_partition(profile, analysis, exercises), plan_tokens(profile, analysis))
+            timings.append((time.perf_counter() - t0) * 1e6)
+            hits += found is not None
+        results[label] = (timings, hits, (index.counters["candidates"] - candidates_before) / queries)
+
+    print(f"📇 Scale: {len(index):,} plans indexed in {build_s:.1f}s, {index.snapshot()['buckets']:,} LSH buckets, "
+          f"+{rss_after - rss_before:.0f} MiB RSS (bands {index.bands} x rows {index.rows}, threshold {threshold})")
+    print(f"   {'queries':24s}{'p50 µs':>9s}{'p99 µs':>9s}{'max µs':>9s}{'reused':>9s}{'cand/q':>8s}")
+    for label, (timings, hits, candidates) in results.items():
+        print(f"   {label:24s}{percentile(timings, 50):9.1f}{percentile(timings, 99):9.1f}{max(timings):9.1f}"
+              f"{hits / queries:9.1%}{candidates:8.1f}")
+
+
+def run_golden(kb, golden_path: str, threshold: float):
+    cases = [c for c in load_golden(golden_path) if not c.get("expect_empty")]
+    index = PlanIndex(threshold=threshold)
+    served = {}  # workout "hash" -> the exercises that plan was generated from
+    for case in cases:
+        analysis, exercises = retrieve(kb, case["profile"])
+        index.add(plan_partition(case["profile"], analysis, exercises), plan_tokens(case["profile"], analysis), case["id"])
+        served[case["id"]] = exercises
+
+    total = reused = wrong = 0
+    fresh_recall, reused_recall, fresh_ndcg, reused_ndcg = [], [], [], []
+    for case in cases:
+        for variant in variants(case["profile"]):
+            analysis, exercises = retrieve(kb, variant)
+            total += 1
+            found = index.lookup(plan_partition(variant, analysis, exercises), plan_tokens(variant, analysis))
+            if found is None:
+                continue
+            reused += 1
+            plan_exercises = served[found[0].workout_hash]
+            ids, plan_ids = [ex["id"] for ex in exercises], [ex["id"] for ex in plan_exercises]
+            wrong += ids != plan_ids
+            if case["relevance"]:
+                fresh_recall.append(recall_at_k(ids, case["relevance"], len(ids) or 1))
+                reused_recall.append(recall_at_k(plan_ids, case["relevance"], len(plan_ids) or 1))
+                fresh_ndcg.append(ndcg_at_k(ids, case["relevance"], len(ids) or 1))
+                reused_ndcg.append(ndcg_at_k(plan_ids, case["relevance"], len(plan_ids) or 1))
+
+    cross = 0
+    for case in cases:
+        others = PlanIndex(threshold=threshold)
+        for other in cases:
+            if other is not case:
+                a, ex = retrieve(kb, other["profile"])
+                others.add(plan_partition(other["profile"], a, ex), plan_tokens(other["profile"], a), other["id"])
+        analysis, exercises = retrieve(kb, case["profile"])
+        cross += others.lookup(plan_partition(case["profile"], analysis, exercises), plan_tokens(case["profile"], analysis)) is not None
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return statistics.fmean(values) if values else float("nan")
+
+    print(f"\n🧪 Golden set: {len(cases)} cases, {total} one-checkbox variants, threshold {threshold}")
+    print(f"   reused {reused} ({reused / total:.1%}); served with other exercises than retrieval: {wrong}")
+    print(f"   recall  fresh {mean(fresh_recall):.4f}  reused {mean(reused_recall):.4f}")
+    print(f"   nDCG    fresh {mean(fresh_ndcg):.4f}  reused {mean(reused_ndcg):.4f}")
+    print(f"   leave-one-out: {cross} of {len(cases)} cases would reuse another case's plan")
+    return wrong
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate plan index: lookup latency at scale and golden-set quality.")
+    parser.add_argument("--plans", type=int, default=300_000)
+    parser.add_argument("--queries", type=int, default=20_000)
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    args = parser.parse_args()
+
+    kb = load_knowledge_base()
+    run_scale(kb, args.plans, args.queries, args.threshold)
+    wrong = run_golden(kb, args.golden, args.threshold)
+    if wrong:
+        raise SystemExit(1)
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.serialization import FastJSONResponse, BACKEND, dumps, loads
+from src.rag.knowledge_base import JSON_KB_PATH
+from benchmarks.blob_storage import synthetic_plan, synthetic_profile
+from benchmarks.kb_memory import synthetic_kb
+
+# Usage: python -m benchmarks.serialization [--kb-exercises 100000] [--seconds 0.5]
+#
+# Times stdlib json against src.serialization (orjson when installed) on the
+# payloads the service actually moves:
+#   plan response     one generated plan (/generate-workout)
+#   jobs summary      a 100-athlete job with results (/jobs/{id})
+#   profile column    a stored profile through the engine's JSON serializer/deserializer
+#   KB parse          the shipped JSON KB and a synthetic large one
+# and, per response, FastAPI's default path (jsonable_encoder + JSONResponse)
+# against returning FastJSONResponse directly.
+
+
+def per_call_us(fn, seconds: float) -> float:
+    """Best-of-3 mean time per call, each round running for about `seconds`."""
+    fn()
+    best = float("inf")
+    for _ in range(3):
+        calls, started = 0, time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                break
+        best = min(best, elapsed / calls)
+    return best * 1e6
+
+
+def row(label: str, size: int, baseline_us: float, fast_us: float):
+    print(f"{label:40s}{size / 1024:>9.1f} KiB{baseline_us:>13.1f}{fast_us:>13.1f}{baseline_us / fast_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stdlib json vs the fast serialization layer.")
+    parser.add_argument("--kb-exercises", type=int, default=100_000, help="Size of the synthetic KB")
+    parser.add_argument("--seconds", type=float, default=0.5, help="Time per measurement round")
+    args = parser.parse_args()
+
+    plan = {**synthetic_plan(0), "reused_previous_plan": False}
+    summary = {"job_id": "0" * 32, "status": "DONE", "total": 100, "completed": 100, "failed": 0,
+               "created_at": time.time(), "finished_at": time.time(),
+               "results": [{"index": i, "athlete_id": f"athlete_{i}", "status": "ok", "plan": synthetic_plan(i)}
+                           for i in range(100)]}
+    profile = synthetic_profile(0)
+    with open(JSON_KB_PATH, 'rb') as f:
+        kb_raw = f.read()
+    big_kb_raw = json.dumps(synthetic_kb(args.kb_exercises)).encode('utf-8')
+
+    def stdlib_dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+    def fastapi_default(obj):
+        return JSONResponse(jsonable_encoder(obj)).body
+
+    s = args.seconds
+    print(f"Fast backend: {BACKEND}\n")
+    print(f"{'':40s}{'size':>13s}{'stdlib µs':>13s}{'fast µs':>13s}{'speedup':>9s}")
+    for label, payload in (("plan response", plan), ("jobs summary (100 plans)", summary)):
+        size = len(dumps(payload))
+        row(f"{label}: encode", size, per_call_us(lambda: stdlib_dumps(payload), s),
+            per_call_us(lambda: dumps(payload), s))
+        row(f"{label}: FastAPI response", size, per_call_us(lambda: fastapi_default(payload), s),
+            per_call_us(lambda: FastJSONResponse(payload).body, s))
+
+    # What SQLAlchemy calls for a JSON column: serializer -> str, deserializer <- str
+    text = dumps(profile).decode('utf-8')
+    row("profile column: write", len(text), per_call_us(lambda: json.dumps(profile), s),
+        per_call_us(lambda: dumps(profile).decode('utf-8'), s))
+    row("profile column: read", len(text), per_call_us(lambda: json.loads(text), s),
+        per_call_us(lambda: loads(text), s))
+
+    row("KB parse (shipped JSON)", len(kb_raw), per_call_us(lambda: json.loads(kb_raw), s),
+        per_call_us(lambda: loads(kb_raw), s))
+    row(f"KB parse ({args.kb_exercises:,} exercises)", len(big_kb_raw), per_call_us(lambda: json.loads(big_kb_raw), s),
+        per_call_us(lambda: loads(big_kb_raw), s))
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from src.eval.retrieval_harness import percentile
+
+# Usage: python -m benchmarks.shared_cache [--workers 4] [--concurrency 32] [--keys 20] [--compute-ms 200]
+#
+# stampede  `workers` processes (uvicorn workers stand-in) each fire `concurrency`
+#           concurrent requests per key at a cold cache whose compute takes
+#           `compute-ms` (the LLM call). Without stampede protection every request
+#           would compute; with it each key is computed once across all processes.
+# latency   L1 hit, and L2 hit (L1 cleared, value read back from the shared store).
+# restart   a fresh process (new deploy) reads every key from L2 without computing.
+#
+# Runs against the local SQLite stand-in in a temp dir unless FMS_CACHE_PATH /
+# FMS_CACHE_BACKEND point elsewhere.
+
+
+def worker(path: str, backend: str, keys: int, concurrency: int, compute_ms: float, start_at: float, out):
+    os.environ["FMS_CACHE_PATH"], os.environ["FMS_CACHE_BACKEND"] = path, backend
+    from src.cache import TwoLevelCache, cache_key
+
+    async def run():
+        cache = TwoLevelCache(backend=backend)
+        computed = 0
+
+        async def compute(k):
+            nonlocal computed
+            computed += 1
+            await asyncio.sleep(compute_ms / 1000)
+            return {"key": k, "exercises": [{"name": f"exercise {i}", "sets_reps": "3 x 10"} for i in range(6)]}
+
+        async def request(k):
+            t0 = time.perf_counter()
+            _, source = await cache.get_or_compute(cache_key("bench", ("v1",), str(k)), lambda: compute(k), 3600)
+            return source, (time.perf_counter() - t0) * 1e6
+
+        cache.l2()  # open the backend before the synchronized start
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(request(k) for k in range(keys) for _ in range(concurrency)))
+        wall_s = time.perf_counter() - started
+        # Steady state: every key again, now from L1
+        l1 = [(await request(k))[1] for _ in range(50) for k in range(keys)]
+        l2 = []
+        for _ in range(10):
+            cache.clear_l1()
+            l2 += [(await request(k))[1] for k in range(keys)]
+        await cache.close()
+        out.put({"computed": computed, "wall_s": wall_s, "sources": [s for s, _ in results], "l1": l1, "l2": l2,
+                 "counters": cache.counters})
+
+    asyncio.run(run())
+
+
+def spawn(path, backend, workers, keys, concurrency, compute_ms):
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    start_at = time.time() + 2.0
+    procs = [ctx.Process(target=worker, args=(path, backend, keys, concurrency, compute_ms, start_at, out))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return results
+
+
+def main(args):
+    path = os.getenv("FMS_CACHE_PATH") or os.path.join(tempfile.mkdtemp(prefix="fms-cache-"), "bench.sqlite")
+    backend = os.getenv("FMS_CACHE_BACKEND", "sqlite")
+    requests = args.workers * args.keys * args.concurrency
+
+    results = spawn(path, backend, args.workers, args.keys, args.concurrency, args.compute_ms)
+    computed = sum(r["computed"] for r in results)
+    sources = [s for r in results for s in r["sources"]]
+    print(f"🐎 Stampede: {args.workers} processes x {args.keys} keys x {args.concurrency} concurrent requests "
+          f"= {requests} requests on a cold {backend} cache, compute {args.compute_ms:.0f} ms")
+    print(f"   computed {computed} times for {args.keys} keys (unprotected: {requests}); "
+          f"wall {max(r['wall_s'] for r in results):.2f}s")
+    print("   served from: " + ", ".join(f"{s} {sources.count(s)}" for s in ("computed", "shared", "l2", "l1")))
+    print(f"   lease waits {sum(r['counters']['lease_waits'] for r in results)}, "
+          f"timeouts {sum(r['counters']['lease_timeouts'] for r in results)}, "
+          f"L2 errors {sum(r['counters']['l2_errors'] for r in results)}")
+    for label, field in (("L1 hit", "l1"), ("L2 hit", "l2")):
+        timings = [t for r in results for t in r[field]]
+        print(f"   {label:8s} p50 {percentile(timings, 50):8.1f} µs   p99 {percentile(timings, 99):8.1f} µs")
+
+    # New deploy: nothing in any L1, everything already in L2
+    restarted = spawn(path, backend, 1, args.keys, 1, args.compute_ms)[0]
+    print(f"🔁 Restart: {restarted['computed']} of {args.keys} keys recomputed by a fresh process")
+    if computed != args.keys or restarted["computed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared cache: stampede protection across processes and hit latency.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--keys", type=int, default=20)
+    parser.add_argument("--compute-ms", type=float, default=200)
+    main(parser.parse_args())
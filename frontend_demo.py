@@ -1,11 +1,38 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
 
 # ── CONFIGURATION ──
 # Defaults to localhost for testing, but respects Render/Cloud env vars
 API_URL = os.getenv("BACKEND_API_URL", "http://127.0.0.1:8000/generate-workout")
+# The live preview endpoints sit next to /generate-workout on the same backend
+API_BASE = API_URL.rsplit("/generate-workout", 1)[0]
+PREVIEW_TIMEOUT_S = float(os.getenv("PREVIEW_TIMEOUT_S", "2"))
+
+
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One pooled keep-alive session per Streamlit server, shared by every rerun."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=256)
+def fetch_preview(payload_json: str):
+    """/analyze and /retrieve for one form state; reruns with unchanged inputs hit the cache."""
+    session = http_session()
+    headers = {"Content-Type": "application/json"}
+    analysis = session.post(f"{API_BASE}/analyze", data=payload_json, headers=headers, timeout=PREVIEW_TIMEOUT_S)
+    analysis.raise_for_status()
+    candidates = session.post(f"{API_BASE}/retrieve", data=payload_json, headers=headers, timeout=PREVIEW_TIMEOUT_S)
+    candidates.raise_for_status()
+    return analysis.json(), candidates.json().get("exercises", [])
+
 
 # Initialize session state for manual override
 if 'use_manual_scores' not in st.session_state:
@@ -21,7 +48,7 @@ st.markdown(f"**Backend Status:** Connecting to `{API_URL}`")
 st.markdown("---")
 
 # ── MAIN INPUT FORM ──
-with st.form("fms_input_form"):
+with st.container():
     st.subheader("📝 Athlete Scorecard & Fault Analysis")
     st.info("Enter Raw Scores (0-3) for Left/Right sides where applicable. Rate specific faults (0-1) to trigger corrective logic.")
 
@@ -205,75 +232,101 @@ with st.form("fms_input_form"):
             rs_rd = st.number_input("Right deficit", 0, 1, key="rs_rd")
 
     st.markdown("---")
-    submit_btn = st.form_submit_button("🚀 Generate Workout Plan", type="primary", use_container_width=True)
+    submit_btn = st.button("🚀 Generate Workout Plan", type="primary", use_container_width=True)
 
-# ── SUBMISSION LOGIC ──
-if submit_btn:
-    # 1. Build Payload (Matching Backend Pydantic Models Exactly)
-    payload = {
-        "use_manual_scores": use_manual_scores,
-        "overhead_squat": {
-            "score": int(ds_score),
-            "trunk_torso": {"upright_torso": int(ds_tu), "excessive_forward_lean": int(ds_tefl), "rib_flare": int(ds_trf), "lumbar_flexion": int(ds_tlf), "lumbar_extension_sway_back": int(ds_tlesb)},
-            "lower_limb": {"knees_track_over_toes": int(ds_lktt), "knee_valgus": int(ds_lkv), "knee_varus": int(ds_lkvar), "uneven_depth": int(ds_lud)},
-            "feet": {"heels_stay_down": int(ds_fhsd), "heels_lift": int(ds_fhl), "excessive_pronation": int(ds_fep), "excessive_supination": int(ds_fes)},
-            "upper_body_bar_position": {"bar_aligned_over_mid_foot": int(ds_uba), "bar_drifts_forward": int(ds_ubdf), "arms_fall_forward": int(ds_uaff), "shoulder_mobility_restriction_suspected": int(ds_usr)}
-        },
-        "hurdle_step": {
-            "score": int(hs_score),
-            "l_score": int(hs_l_score), 
-            "r_score": int(hs_r_score),
-            "pelvis_core_control": {"pelvis_stable": int(hs_pps), "pelvic_drop_trendelenburg": int(hs_ppd), "excessive_rotation": int(hs_per), "loss_of_balance": int(hs_plob)},
-            "stance_leg": {"knee_stable": int(hs_sks), "knee_valgus": int(hs_skv), "knee_varus": int(hs_skvar), "ankle_instability": int(hs_sai)},
-            "stepping_leg": {"clears_hurdle_smoothly": int(hs_stc), "toe_drag": int(hs_sttd), "hip_flexion_restriction": int(hs_sthr), "asymmetrical_movement": int(hs_stam)}
-        },
-        "inline_lunge": {
-            "score": int(il_score),
-            "l_score": int(il_l_score),
-            "r_score": int(il_r_score),
-            "alignment": {"head_neutral": int(il_hn), "forward_head": int(il_fh), "trunk_upright": int(il_tu), "excessive_forward_lean": int(il_fl), "lateral_shift": int(il_ls)},
-            "lower_body_control": {"knee_tracks_over_foot": int(il_kt), "knee_valgus": int(il_kv), "knee_instability": int(il_ki), "heel_lift": int(il_hl)},
-            "balance_stability": {"stable_throughout": int(il_st), "wobbling": int(il_wb), "loss_of_balance": int(il_lob), "unequal_weight_distribution": int(il_uw)}
-        },
-        "shoulder_mobility": {
-            "score": int(sm_score),
-            "l_score": int(sm_l_score),
-            "r_score": int(sm_r_score),
-            "clearing_pain": bool(sm_clearing),
-            "reach_quality": {"hands_within_fist_distance": int(sm_fd), "hands_within_hand_length": int(sm_hl), "excessive_gap": int(sm_eg), "asymmetry_present": int(sm_as)},
-            "compensation": {"no_compensation": int(sm_nc), "spine_flexion": int(sm_sf), "rib_flare": int(sm_rf), "scapular_winging": int(sm_sw)},
-            "pain": {"no_pain": int(sm_np), "pain_reported": int(sm_pr)}
-        },
-        "active_straight_leg_raise": {
-            "score": int(aslr_score),
-            "l_score": int(aslr_l_score),
-            "r_score": int(aslr_r_score),
-            "non_moving_leg": {"remains_flat": int(aslr_rf), "knee_bends": int(aslr_kb), "hip_externally_rotates": int(aslr_er), "foot_lifts_off_floor": int(aslr_fl)},
-            "moving_leg": {"gt_80_hip_flexion": int(aslr_g80), "between_60_80_hip_flexion": int(aslr_6080), "lt_60_hip_flexion": int(aslr_l60), "hamstring_restriction": int(aslr_hr)},
-            "pelvic_control": {"pelvis_stable": int(aslr_ps), "anterior_tilt": int(aslr_at), "posterior_tilt": int(aslr_pt)}
-        },
-        "trunk_stability_pushup": {
-            "score": int(tsp_score),
-            "clearing_pain": bool(ts_clearing),
-            "body_alignment": {"neutral_spine_maintained": int(tsp_ns), "sagging_hips": int(tsp_sh), "pike_position": int(tsp_pk)},
-            "core_control": {"initiates_as_one_unit": int(tsp_ou), "hips_lag": int(tsp_hl), "excessive_lumbar_extension": int(tsp_le)},
-            "upper_body": {"elbows_aligned": int(tsp_ea), "uneven_arm_push": int(tsp_up), "shoulder_instability": int(tsp_si)}
-        },
-        "rotary_stability": {
-            "score": int(rs_score),
-            "l_score": int(rs_l_score),
-            "r_score": int(rs_r_score),
-            "clearing_pain": bool(rs_clearing),
-            "diagonal_pattern": {"smooth_controlled": int(rs_sm), "loss_of_balance": int(rs_lob), "unable_to_complete": int(rs_utc)},
-            "spinal_control": {"neutral_maintained": int(rs_nm), "excessive_rotation": int(rs_er), "lumbar_shift": int(rs_ls)},
-            "symmetry": {"symmetrical": int(rs_sy), "left_side_deficit": int(rs_ld), "right_side_deficit": int(rs_rd)}
-        }
+# ── PAYLOAD (Matching Backend Pydantic Models Exactly) ──
+# 1. Build Payload (Matching Backend Pydantic Models Exactly)
+payload = {
+    "use_manual_scores": use_manual_scores,
+    "overhead_squat": {
+        "score": int(ds_score),
+        "trunk_torso": {"upright_torso": int(ds_tu), "excessive_forward_lean": int(ds_tefl), "rib_flare": int(ds_trf), "lumbar_flexion": int(ds_tlf), "lumbar_extension_sway_back": int(ds_tlesb)},
+        "lower_limb": {"knees_track_over_toes": int(ds_lktt), "knee_valgus": int(ds_lkv), "knee_varus": int(ds_lkvar), "uneven_depth": int(ds_lud)},
+        "feet": {"heels_stay_down": int(ds_fhsd), "heels_lift": int(ds_fhl), "excessive_pronation": int(ds_fep), "excessive_supination": int(ds_fes)},
+        "upper_body_bar_position": {"bar_aligned_over_mid_foot": int(ds_uba), "bar_drifts_forward": int(ds_ubdf), "arms_fall_forward": int(ds_uaff), "shoulder_mobility_restriction_suspected": int(ds_usr)}
+    },
+    "hurdle_step": {
+        "score": int(hs_score),
+        "l_score": int(hs_l_score), 
+        "r_score": int(hs_r_score),
+        "pelvis_core_control": {"pelvis_stable": int(hs_pps), "pelvic_drop_trendelenburg": int(hs_ppd), "excessive_rotation": int(hs_per), "loss_of_balance": int(hs_plob)},
+        "stance_leg": {"knee_stable": int(hs_sks), "knee_valgus": int(hs_skv), "knee_varus": int(hs_skvar), "ankle_instability": int(hs_sai)},
+        "stepping_leg": {"clears_hurdle_smoothly": int(hs_stc), "toe_drag": int(hs_sttd), "hip_flexion_restriction": int(hs_sthr), "asymmetrical_movement": int(hs_stam)}
+    },
+    "inline_lunge": {
+        "score": int(il_score),
+        "l_score": int(il_l_score),
+        "r_score": int(il_r_score),
+        "alignment": {"head_neutral": int(il_hn), "forward_head": int(il_fh), "trunk_upright": int(il_tu), "excessive_forward_lean": int(il_fl), "lateral_shift": int(il_ls)},
+        "lower_body_control": {"knee_tracks_over_foot": int(il_kt), "knee_valgus": int(il_kv), "knee_instability": int(il_ki), "heel_lift": int(il_hl)},
+        "balance_stability": {"stable_throughout": int(il_st), "wobbling": int(il_wb), "loss_of_balance": int(il_lob), "unequal_weight_distribution": int(il_uw)}
+    },
+    "shoulder_mobility": {
+        "score": int(sm_score),
+        "l_score": int(sm_l_score),
+        "r_score": int(sm_r_score),
+        "clearing_pain": bool(sm_clearing),
+        "reach_quality": {"hands_within_fist_distance": int(sm_fd), "hands_within_hand_length": int(sm_hl), "excessive_gap": int(sm_eg), "asymmetry_present": int(sm_as)},
+        "compensation": {"no_compensation": int(sm_nc), "spine_flexion": int(sm_sf), "rib_flare": int(sm_rf), "scapular_winging": int(sm_sw)},
+        "pain": {"no_pain": int(sm_np), "pain_reported": int(sm_pr)}
+    },
+    "active_straight_leg_raise": {
+        "score": int(aslr_score),
+        "l_score": int(aslr_l_score),
+        "r_score": int(aslr_r_score),
+        "non_moving_leg": {"remains_flat": int(aslr_rf), "knee_bends": int(aslr_kb), "hip_externally_rotates": int(aslr_er), "foot_lifts_off_floor": int(aslr_fl)},
+        "moving_leg": {"gt_80_hip_flexion": int(aslr_g80), "between_60_80_hip_flexion": int(aslr_6080), "lt_60_hip_flexion": int(aslr_l60), "hamstring_restriction": int(aslr_hr)},
+        "pelvic_control": {"pelvis_stable": int(aslr_ps), "anterior_tilt": int(aslr_at), "posterior_tilt": int(aslr_pt)}
+    },
+    "trunk_stability_pushup": {
+        "score": int(tsp_score),
+        "clearing_pain": bool(ts_clearing),
+        "body_alignment": {"neutral_spine_maintained": int(tsp_ns), "sagging_hips": int(tsp_sh), "pike_position": int(tsp_pk)},
+        "core_control": {"initiates_as_one_unit": int(tsp_ou), "hips_lag": int(tsp_hl), "excessive_lumbar_extension": int(tsp_le)},
+        "upper_body": {"elbows_aligned": int(tsp_ea), "uneven_arm_push": int(tsp_up), "shoulder_instability": int(tsp_si)}
+    },
+    "rotary_stability": {
+        "score": int(rs_score),
+        "l_score": int(rs_l_score),
+        "r_score": int(rs_r_score),
+        "clearing_pain": bool(rs_clearing),
+        "diagonal_pattern": {"smooth_controlled": int(rs_sm), "loss_of_balance": int(rs_lob), "unable_to_complete": int(rs_utc)},
+        "spinal_control": {"neutral_maintained": int(rs_nm), "excessive_rotation": int(rs_er), "lumbar_shift": int(rs_ls)},
+        "symmetry": {"symmetrical": int(rs_sy), "left_side_deficit": int(rs_ld), "right_side_deficit": int(rs_rd)}
     }
+}
+
+# ── LIVE PREVIEW ──
+# Inputs are outside a form, so every edit reruns the script; the preview only
+# calls the fast endpoints (no DB, no LLM). The LLM runs on the button below.
+STATUS_LIGHTS = {"STOP": "⚫", "MOBILITY": "🔴", "STABILITY": "🟡", "PATTERN": "🟢", "STRENGTH": "🟢", "POWER": "🟢"}
+
+with st.sidebar:
+    st.subheader("⚡ Live Preview")
+    try:
+        preview, candidates = fetch_preview(json.dumps(payload, sort_keys=True))
+        st.markdown(f"### {STATUS_LIGHTS.get(preview['status'], '⚪')} {preview['status']}")
+        st.caption(preview.get("reason", ""))
+        m1, m2 = st.columns(2)
+        m1.metric("Target Level", preview.get("target_level"))
+        m2.metric("Total Score", f"{preview.get('total_score', 0)}/21")
+        st.markdown("**Effective Scores**")
+        for test_name, score in preview.get("effective_scores", {}).items():
+            st.text(f"{test_name.replace('_', ' ').title():<28}{score}")
+        st.markdown("**Candidate Exercises**")
+        for ex in candidates:
+            st.markdown(f"- {ex.get('exercise_name')} (L{ex.get('difficulty_level')})")
+        if not candidates:
+            st.caption("No candidates at this level.")
+    except requests.exceptions.RequestException as e:
+        st.caption(f"Preview unavailable: {e}")
 
-    # 2. Call API
+# ── SUBMISSION LOGIC ──
+if submit_btn:
+    # Full generation (LLM) only on submit
     with st.spinner("🤖 AI Coach is analyzing faults and querying NeonDB..."):
         try:
-            response = requests.post(API_URL, json=payload, timeout=120)
+            response = http_session().post(API_URL, json=payload, timeout=120)
             
             if response.status_code == 200:
                 data = response.json()
@@ -317,6 +370,8 @@ if submit_btn:
                 with st.expander("🔍 Debug Data"):
                     st.json(data)
 
+            elif response.status_code in (429, 503):
+                st.warning(f"⏳ Coach is busy, retry in {response.headers.get('Retry-After', 'a few')} seconds.")
             else:
                 st.error(f"API Error ({response.status_code}): {response.text}")
 
@@ -1,25 +1,68 @@
 import os
 import asyncio
-from groq import Groq
+from groq import Groq, AsyncGroq
 from deepeval.models.base_model import DeepEvalBaseLLM
 
+from src.rag.resilience import TokenBucket
+
+# --- CONFIGURATION ---
+JUDGE_RPM = float(os.getenv("FMS_JUDGE_RPM", "30"))  # Groq requests-per-minute quota
+JUDGE_BURST = float(os.getenv("FMS_JUDGE_BURST", "5"))
+JUDGE_CONCURRENCY = int(os.getenv("FMS_JUDGE_CONCURRENCY", "4"))
+# USD per 1M tokens (llama-3.3-70b-versatile list price); used for the run cost report
+JUDGE_PRICE_IN_PER_M = float(os.getenv("FMS_JUDGE_PRICE_IN_PER_M", "0.59"))
+JUDGE_PRICE_OUT_PER_M = float(os.getenv("FMS_JUDGE_PRICE_OUT_PER_M", "0.79"))
+
+
 class GroqJudge(DeepEvalBaseLLM):
-    def __init__(self, model="llama-3.3-70b-versatile"):
+    """
+    DeepEval judge backed by Groq. `a_generate` uses the async client behind a
+    token bucket + semaphore, so DeepEval's async metrics really run
+    concurrently without blowing the rate limit. Token usage is accumulated
+    for the cost report.
+    """
+
+    def __init__(self, model="llama-3.3-70b-versatile", rpm: float = JUDGE_RPM, concurrency: int = JUDGE_CONCURRENCY):
         self.model = model
         self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.async_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+        self.rate_limiter = TokenBucket(rate_per_s=rpm / 60.0, capacity=JUDGE_BURST)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
 
     def load_model(self):
         return self.client
 
+    def _record_usage(self, chat_completion):
+        self.calls += 1
+        usage = getattr(chat_completion, "usage", None)
+        if usage:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
     def generate(self, prompt: str) -> str:
         chat_completion = self.client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model=self.model,
         )
+        self._record_usage(chat_completion)
         return chat_completion.choices[0].message.content
 
     async def a_generate(self, prompt: str) -> str:
-        return self.generate(prompt)
+        # Token first: waiting for the rate limit must not hold a concurrency slot
+        await self.rate_limiter.acquire()
+        async with self.slots:
+            chat_completion = await self.async_client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.model,
+            )
+        self._record_usage(chat_completion)
+        return chat_completion.choices[0].message.content
+
+    def cost_usd(self) -> float:
+        return (self.prompt_tokens * JUDGE_PRICE_IN_PER_M + self.completion_tokens * JUDGE_PRICE_OUT_PER_M) / 1e6
 
     def get_model_name(self):
-        return "Groq Llama-3.3-70b-versatile"
\ No newline at end of file
+        return "Groq Llama-3.3-70b-versatile"
@@ -1,11 +1,13 @@
 import asyncio
-from src.database import engine, Base
+from src.database import engine, Base, upgrade_schema
 
 async def init_db():
     print("⏳ Connecting to Database...")
     async with engine.begin() as conn:
         # This checks your blueprints and creates any missing tables
         await conn.run_sync(Base.metadata.create_all)
+        # Adds columns/indexes introduced since the tables were first created
+        await conn.run_sync(upgrade_schema)
     print("✅ Success! Tables created.")
 
 if __name__ == "__main__":
@@ -1,19 +1,34 @@
-import json
 import uvicorn
 import os
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends
+from datetime import date
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 # ── IMPORTS ──
 from src.logic.fms_analyzer import analyze_fms_profile
 from src.rag.retriever import get_exercises_by_profile
-from src.rag.generator import generate_workout_plan
-from src.database import AsyncSessionLocal, AssessmentInput, AssessmentScore, engine, Base
+from src.rag.knowledge_base import UnknownTenant
+from src.rag.generator import generate_workout_plan, llm_breaker, llm_admission, LLM_RESERVE_S, LLM_MIN_TIMEOUT_S
+from src.rag.resilience import Deadline, Overloaded, StageLimiter
+from src.schemas import FMSProfileRequest, BulkGenerateRequest
+from src.database import AsyncSessionLocal, engine, Base, upgrade_schema
+from src.pipeline import save_assessment, fetch_athlete_history, plan_fingerprint, find_reusable_plan, plan_cache_key, plan_cacheable
+from src.cache import shared_cache, PLAN_TTL_S
+from src.plan_warmer import run_daily as run_plan_warmer_daily, WARM_AT
+from src.plan_index import find_similar_plan, remember_plan
+from src.analytics import date_window, status_mix, score_distribution, top_faults
+from src.jobs import job_manager, JOB_MAX_PROFILES
+from src.warmup import readiness, run_warmup
+from src.serialization import FastJSONResponse, dumps
+from src.tracing import TraceMiddleware
+from src.profiling import ProfileMiddleware, profiling_enabled, adopt_session
+from src.metrics import metrics_text, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # ────────────────────────────────────────────────
 # Lifecycle (Startup)
@@ -23,10 +38,27 @@ async def lifespan(app: FastAPI):
     print("🚀 Starting up: Connecting to NeonDB...")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
     print("✅ Neon DB Connection Verified & Tables Ready.")
+    job_manager.start()
+    # Warm KB, DB pool and LLM connection off the critical path; the port is
+    # bound meanwhile and /readyz flips to 200 when the required parts are warm
+    warmup_task = asyncio.create_task(run_warmup())
+    # Off-peak plan cache warming (FMS_PLAN_WARM_AT=HH:MM); one worker per day runs it
+    background = [warmup_task]
+    if WARM_AT:
+        background.append(asyncio.create_task(run_plan_warmer_daily(WARM_AT)))
     yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await job_manager.stop()
+    await shared_cache.close()
 
-app = FastAPI(title="FMS Smart Coach API", version="3.3", lifespan=lifespan)
+# Plain dict/list payloads are encoded by orjson (stdlib json fallback); the hot
+# endpoints below return FastJSONResponse directly and also skip jsonable_encoder.
+app = FastAPI(title="FMS Smart Coach API", version="3.3", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,209 +66,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
-
-# ────────────────────────────────────────────────
-# Pydantic Models (Validation)
-# ────────────────────────────────────────────────
-
-# --- 1. DEEP SQUAT ---
-class OS_TrunkTorso(BaseModel):
-    upright_torso: int = 0
-    excessive_forward_lean: int = 0
-    rib_flare: int = 0
-    lumbar_flexion: int = 0
-    lumbar_extension_sway_back: int = 0
-
-class OS_LowerLimb(BaseModel):
-    knees_track_over_toes: int = 0
-    knee_valgus: int = 0
-    knee_varus: int = 0
-    uneven_depth: int = 0
-
-class OS_Feet(BaseModel):
-    heels_stay_down: int = 0
-    heels_lift: int = 0
-    excessive_pronation: int = 0
-    excessive_supination: int = 0
-
-class OS_UpperBodyBarPosition(BaseModel):
-    bar_aligned_over_mid_foot: int = 0
-    bar_drifts_forward: int = 0
-    arms_fall_forward: int = 0
-    shoulder_mobility_restriction_suspected: int = 0
-
-class OverheadSquatData(BaseModel):
-    score: int
-    trunk_torso: OS_TrunkTorso
-    lower_limb: OS_LowerLimb
-    feet: OS_Feet
-    upper_body_bar_position: OS_UpperBodyBarPosition
-
-# --- 2. HURDLE STEP ---
-class HS_PelvisCoreControl(BaseModel):
-    pelvis_stable: int = 0
-    pelvic_drop_trendelenburg: int = 0
-    excessive_rotation: int = 0
-    loss_of_balance: int = 0
-
-class HS_StanceLeg(BaseModel):
-    knee_stable: int = 0
-    knee_valgus: int = 0
-    knee_varus: int = 0
-    ankle_instability: int = 0
-
-class HS_SteppingLeg(BaseModel):
-    clears_hurdle_smoothly: int = 0
-    toe_drag: int = 0
-    hip_flexion_restriction: int = 0
-    asymmetrical_movement: int = 0
-
-class HurdleStepData(BaseModel):
-    score: int
-    l_score: int = 0
-    r_score: int = 0
-    pelvis_core_control: HS_PelvisCoreControl
-    stance_leg: HS_StanceLeg
-    stepping_leg: HS_SteppingLeg
-
-# --- 3. INLINE LUNGE ---
-class IL_Alignment(BaseModel):
-    head_neutral: int = 0
-    forward_head: int = 0
-    trunk_upright: int = 0
-    excessive_forward_lean: int = 0
-    lateral_shift: int = 0
-
-class IL_LowerBodyControl(BaseModel):
-    knee_tracks_over_foot: int = 0
-    knee_valgus: int = 0
-    knee_instability: int = 0
-    heel_lift: int = 0
-
-class IL_BalanceStability(BaseModel):
-    stable_throughout: int = 0
-    wobbling: int = 0
-    loss_of_balance: int = 0
-    unequal_weight_distribution: int = 0
-
-class InlineLungeData(BaseModel):
-    score: int
-    l_score: int = 0
-    r_score: int = 0
-    alignment: IL_Alignment
-    lower_body_control: IL_LowerBodyControl
-    balance_stability: IL_BalanceStability
-
-# --- 4. SHOULDER MOBILITY ---
-class SM_ReachQuality(BaseModel):
-    hands_within_fist_distance: int = 0
-    hands_within_hand_length: int = 0
-    excessive_gap: int = 0
-    asymmetry_present: int = 0
-
-class SM_Compensation(BaseModel):
-    no_compensation: int = 0
-    spine_flexion: int = 0
-    rib_flare: int = 0
-    scapular_winging: int = 0
-
-class SM_Pain(BaseModel):
-    no_pain: int = 0
-    pain_reported: int = 0
-
-class ShoulderMobilityData(BaseModel):
-    score: int
-    l_score: int = 0
-    r_score: int = 0
-    clearing_pain: bool = False
-    reach_quality: SM_ReachQuality
-    compensation: SM_Compensation
-    pain: SM_Pain
-
-# --- 5. ASLR ---
-class ASLR_NonMovingLeg(BaseModel):
-    remains_flat: int = 0
-    knee_bends: int = 0
-    hip_externally_rotates: int = 0
-    foot_lifts_off_floor: int = 0
-
-class ASLR_MovingLeg(BaseModel):
-    gt_80_hip_flexion: int = 0
-    between_60_80_hip_flexion: int = 0
-    lt_60_hip_flexion: int = 0
-    hamstring_restriction: int = 0
-
-class ASLR_PelvicControl(BaseModel):
-    pelvis_stable: int = 0
-    anterior_tilt: int = 0
-    posterior_tilt: int = 0
-
-class ASLRData(BaseModel):
-    score: int
-    l_score: int = 0
-    r_score: int = 0
-    non_moving_leg: ASLR_NonMovingLeg
-    moving_leg: ASLR_MovingLeg
-    pelvic_control: ASLR_PelvicControl
-
-# --- 6. TRUNK STABILITY ---
-class TSP_BodyAlignment(BaseModel):
-    neutral_spine_maintained: int = 0
-    sagging_hips: int = 0
-    pike_position: int = 0
-
-class TSP_CoreControl(BaseModel):
-    initiates_as_one_unit: int = 0
-    hips_lag: int = 0
-    excessive_lumbar_extension: int = 0
-
-class TSP_UpperBody(BaseModel):
-    elbows_aligned: int = 0
-    uneven_arm_push: int = 0
-    shoulder_instability: int = 0
-
-class TSPData(BaseModel):
-    score: int
-    clearing_pain: bool = False
-    body_alignment: TSP_BodyAlignment
-    core_control: TSP_CoreControl
-    upper_body: TSP_UpperBody
-
-# --- 7. ROTARY STABILITY ---
-class RS_DiagonalPattern(BaseModel):
-    smooth_controlled: int = 0
-    loss_of_balance: int = 0
-    unable_to_complete: int = 0
-
-class RS_SpinalControl(BaseModel):
-    neutral_maintained: int = 0
-    excessive_rotation: int = 0
-    lumbar_shift: int = 0
-
-class RS_Symmetry(BaseModel):
-    symmetrical: int = 0
-    left_side_deficit: int = 0
-    right_side_deficit: int = 0
-
-class RSData(BaseModel):
-    score: int
-    l_score: int = 0
-    r_score: int = 0
-    clearing_pain: bool = False
-    diagonal_pattern: RS_DiagonalPattern
-    spinal_control: RS_SpinalControl
-    symmetry: RS_Symmetry
-
-class FMSProfileRequest(BaseModel):
-    overhead_squat: OverheadSquatData
-    hurdle_step: HurdleStepData
-    inline_lunge: InlineLungeData
-    shoulder_mobility: ShoulderMobilityData
-    active_straight_leg_raise: ASLRData
-    trunk_stability_pushup: TSPData
-    rotary_stability: RSData
-    use_manual_scores: bool = False
+# Opt-in per-request profiler (FMS_PROFILE_TOKEN); not in the stack at all otherwise
+if profiling_enabled():
+    app.add_middleware(ProfileMiddleware)
+# Outermost: the request id and root span cover everything below
+app.add_middleware(TraceMiddleware)
 
 # ────────────────────────────────────────────────
 # API Endpoints
@@ -246,15 +82,57 @@ async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+# ────────────────────────────────────────────────
+# LOAD SHEDDING
+# ────────────────────────────────────────────────
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    """Queue full -> 429 (back off now); waited too long for a slot -> 503."""
+    status = 429 if exc.reason == StageLimiter.QUEUE_FULL else 503
+    print(f"🚦 SHED [{exc.stage}] {exc.reason} → {status}, retry after {exc.retry_after_s}s")
+    return FastJSONResponse(
+        status_code=status,
+        content={"detail": str(exc), "stage": exc.stage, "reason": exc.reason, "retry_after_s": exc.retry_after_s},
+        headers={"Retry-After": str(exc.retry_after_s)},
+    )
+
+@app.exception_handler(UnknownTenant)
+async def unknown_tenant_handler(request, exc: UnknownTenant):
+    return FastJSONResponse(status_code=404, content={"detail": str(exc)})
+
+# ────────────────────────────────────────────────
+# PROBES
+# ────────────────────────────────────────────────
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving the event loop."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: KB indexed and DB pool open (LLM priming is reported but optional)."""
+    body = readiness.snapshot()
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: tenant KB registry, retrieval cache, plan index and shared cache."""
+    return Response(metrics_text(), media_type=METRICS_CONTENT_TYPE)
+
 # ────────────────────────────────────────────────
 # MAIN ENDPOINT
 # ────────────────────────────────────────────────
 @app.post("/generate-workout")
-async def generate_workout(
-    profile: FMSProfileRequest,
-    db: AsyncSession = Depends(get_db)
-):
+async def generate_workout(profile: FMSProfileRequest):
+    """
+    Analysis and retrieval are in-process and never wait. DB sessions are opened
+    only around the plan lookup and the save, not across the LLM call, and the
+    LLM call itself goes through the `llm_admission` limiter (429/503 when full).
+    """
     full_data = profile.dict()
+    deadline = Deadline()
 
     # ─────────────────────────────────────────────────
     # 1. Analyze FMS profile
@@ -295,6 +173,8 @@ async def generate_workout(
         else:
             print("⚠️ WARNING: No exercises found for this profile!")
 
+    except UnknownTenant:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Retrieval Error: {str(e)}")
 
@@ -302,42 +182,194 @@ async def generate_workout(
     # 3. Generate workout plan
     # ─────────────────────────────────────────────────
     try:
-        final_plan = generate_workout_plan(analysis, exercises)
+        # Unchanged reassessment: reuse the athlete's latest plan, skip the LLM
+        fingerprint = plan_fingerprint(full_data, analysis, exercises)
+        async with AsyncSessionLocal() as db:
+            try:
+                previous = await find_reusable_plan(db, full_data.get("athlete_id"), fingerprint)
+                # Otherwise any athlete's plan for a near-identical input and the same exercises
+                if previous is None:
+                    previous = await find_similar_plan(db, full_data, analysis, exercises)
+            except Exception as e:
+                await db.rollback()
+                print(f"⚠️ WARNING: Previous plan lookup failed: {str(e)}")
+                previous = None
+
+        if previous:
+            reused_id, final_plan = previous
+            final_plan["reused_previous_plan"] = True
+            final_plan["reused_assessment_id"] = reused_id
+            if "reuse_similarity" in final_plan:
+                print(f"♻️ DEBUG: Near-duplicate of assessment {reused_id} "
+                      f"(similarity {final_plan['reuse_similarity']}), LLM skipped")
+            else:
+                print(f"♻️ DEBUG: Profile unchanged since assessment {reused_id}, LLM skipped")
+        else:
+            async def generate():
+                # Waiting for a slot must leave the LLM its minimum timeout within the budget
+                max_wait_s = deadline.remaining() - LLM_RESERVE_S - LLM_MIN_TIMEOUT_S
+                async with llm_admission.slot(max_wait_s):
+                    return await generate_workout_plan(analysis, exercises, deadline=deadline)
+
+            # Same input generated by any worker (or before a restart): shared cache, one LLM call per key
+            final_plan, source = await shared_cache.get_or_compute(
+                plan_cache_key(fingerprint, retrieval_result.get("kb_version")), generate, PLAN_TTL_S,
+                cacheable=plan_cacheable, max_wait_s=deadline.remaining() - LLM_RESERVE_S - LLM_MIN_TIMEOUT_S
+            )
+            if source != "computed":
+                final_plan["plan_cache"] = source
+                print(f"📦 DEBUG: Plan served from shared cache ({source}), LLM skipped")
+            final_plan["reused_previous_plan"] = False
         final_plan["calculated_scores"] = effective_scores
+        print(f"🧐 DEBUG: LLM CIRCUIT {llm_breaker.snapshot()} | ADMISSION {llm_admission.snapshot()} | "
+              f"request took {deadline.elapsed():.2f}s")
 
         # ─────────────────────────────────────────────────
         # 4. Save to database (non-blocking)
         # ─────────────────────────────────────────────────
-        try:
-            input_entry = AssessmentInput(raw_json_data=full_data)
-            db.add(input_entry)
-            await db.flush()
-
-            score_entry = AssessmentScore(
-                input_id=input_entry.id,
-                overhead_squat=effective_scores.get('overhead_squat', 0),
-                hurdle_step=effective_scores.get('hurdle_step', 0),
-                inline_lunge=effective_scores.get('inline_lunge', 0),
-                shoulder_mobility=effective_scores.get('shoulder_mobility', 0),
-                active_straight_leg_raise=effective_scores.get('active_straight_leg_raise', 0),
-                trunk_stability_pushup=effective_scores.get('trunk_stability_pushup', 0),
-                rotary_stability=effective_scores.get('rotary_stability', 0),
-                total_score=analysis.get("total_score", 0),
-                generated_workout=final_plan
-            )
-            db.add(score_entry)
-            await db.commit()
-        except Exception as e:
-            await db.rollback()
-            print(f"❌ DB Save Error (non-blocking): {str(e)}")
-
-        return final_plan
-
+        async with AsyncSessionLocal() as db:
+            try:
+                score_entry = await save_assessment(db, full_data, analysis, final_plan, fingerprint=fingerprint)
+                if not previous:
+                    remember_plan(full_data, analysis, exercises, score_entry)
+            except Exception as e:
+                await db.rollback()
+                print(f"❌ DB Save Error (non-blocking): {str(e)}")
+
+        return FastJSONResponse(final_plan)
+
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Generation Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Generation Error: {str(e)}")
 
 
+# ────────────────────────────────────────────────
+# LIVE PREVIEW (no DB session, no LLM)
+# ────────────────────────────────────────────────
+# Stages 1-2 of /generate-workout on their own, for UIs that re-score as the
+# coach edits the form. Both are in-process and answer in a few milliseconds,
+# so they bypass the LLM admission limiter.
+PREVIEW_FIELDS = ("id", "exercise_name", "difficulty_level", "category", "tags")
+
+
+def preview_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    effective_scores = analysis.get("effective_scores", {})
+    return {
+        "status": analysis.get("status"),
+        "target_level": analysis.get("target_level"),
+        "reason": analysis.get("reason"),
+        "effective_scores": effective_scores,
+        "total_score": sum(effective_scores.values()),
+    }
+
+
+@app.post("/analyze")
+async def analyze(profile: FMSProfileRequest):
+    """Effective scores, traffic-light status and target level."""
+    full_data = profile.dict()
+    try:
+        analysis = analyze_fms_profile(full_data, use_manual_scores=full_data.get('use_manual_scores', False))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analyzer Error: {str(e)}")
+    return FastJSONResponse(preview_analysis(analysis))
+
+
+@app.post("/retrieve")
+async def retrieve(profile: FMSProfileRequest):
+    """The analysis plus the candidate exercises the generator would be given."""
+    full_data = profile.dict()
+    try:
+        retrieval_result = await get_exercises_by_profile(simple_scores={}, detailed_faults=full_data)
+    except UnknownTenant:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Retrieval Error: {str(e)}")
+    exercises = [{k: ex.get(k) for k in PREVIEW_FIELDS} for ex in retrieval_result.get("data", [])]
+    return FastJSONResponse({**preview_analysis(retrieval_result["analysis"]), "exercises": exercises})
+
+
+# ────────────────────────────────────────────────
+# ATHLETE HISTORY
+# ────────────────────────────────────────────────
+@app.get("/athletes/{athlete_id}/assessments")
+async def athlete_history(
+    athlete_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Newest-first scores for one athlete. Pass `next_cursor` back as `cursor` for the next page."""
+    try:
+        return FastJSONResponse(await fetch_athlete_history(db, athlete_id, limit, cursor))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+# ────────────────────────────────────────────────
+# ANALYTICS (SERVED FROM DAILY ROLLUPS)
+# ────────────────────────────────────────────────
+def analytics_window(start: Optional[date], end: Optional[date]):
+    try:
+        return date_window(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/status")
+async def analytics_status(start: Optional[date] = None, end: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    """Assessments per day by status (MOBILITY/STABILITY/...). Defaults to the last 30 days."""
+    return await status_mix(db, *analytics_window(start, end))
+
+@app.get("/analytics/scores")
+async def analytics_scores(start: Optional[date] = None, end: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    """Score distribution (0-3) per FMS test over the window."""
+    return await score_distribution(db, *analytics_window(start, end))
+
+@app.get("/analytics/faults")
+async def analytics_faults(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    top: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """Most frequent faults over the window and per day."""
+    return await top_faults(db, *analytics_window(start, end), top)
+
+# ────────────────────────────────────────────────
+# BULK JOBS (ROSTER UPLOADS)
+# ────────────────────────────────────────────────
+@app.post("/jobs/generate-workout", status_code=202)
+async def submit_bulk_job(request: BulkGenerateRequest):
+    if not request.profiles:
+        raise HTTPException(status_code=400, detail="No profiles submitted")
+    if len(request.profiles) > JOB_MAX_PROFILES:
+        raise HTTPException(status_code=413, detail=f"At most {JOB_MAX_PROFILES} profiles per job")
+
+    # A profiled submission profiles the whole job; the file is written when it completes
+    job = job_manager.submit([p.dict() for p in request.profiles], profile=adopt_session())
+    return {"job_id": job.id, "status": job.status, "total": job.total}
+
+@app.get("/jobs/{job_id}")
+async def get_bulk_job(job_id: str, include_results: bool = True):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(job.summary(include_results=include_results))
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_bulk_job(job_id: str):
+    """Newline-delimited JSON, one line per athlete as soon as their plan is ready."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def lines():
+        async for result in job.stream():
+            yield dumps(result) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
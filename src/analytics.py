@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Iterable
+
+from sqlalchemy import select, delete, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import (
+    engine, AssessmentInput, AssessmentScore,
+    DailyStatusCount, DailyScoreCount, DailyFaultCount,
+)
+
+# Usage: python -m src.analytics --rebuild [--since 2024-01-01]
+#
+# Rollups are kept current by save_assessment(); the rebuild recomputes them
+# from assessment_scores + raw inputs (backfill after upgrading, or repair).
+
+# --- CONFIGURATION ---
+DEFAULT_WINDOW_DAYS = 30
+REBUILD_BATCH_SIZE = 1000
+
+ROLLUP_TABLES = [DailyStatusCount, DailyScoreCount, DailyFaultCount]
+
+
+def rollup_rows(
+    day: date,
+    status: Optional[str],
+    effective_scores: Dict[str, Any],
+    faults: Iterable[str],
+    n: int = 1
+) -> Dict[Any, List[Dict[str, Any]]]:
+    """The counter increments one assessment contributes, per rollup table."""
+    return {
+        DailyStatusCount: [{"day": day, "status": status or "UNKNOWN", "count": n}],
+        DailyScoreCount: [
+            {"day": day, "test": test, "score": int(score), "count": n}
+            for test, score in sorted(effective_scores.items()) if isinstance(score, int)
+        ],
+        DailyFaultCount: [{"day": day, "fault": fault, "count": n} for fault in sorted(set(faults))],
+    }
+
+
+async def _upsert_counts(db: AsyncSession, model, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    table = model.__table__
+    keys = [c.name for c in table.primary_key.columns]
+    dialect = db.bind.dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        # executemany form: one cached statement whatever the batch size
+        # (a multi-row .values(rows) would be recompiled for every new row count)
+        module = postgresql if dialect == "postgresql" else sqlite
+        stmt = module.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        await db.execute(stmt, rows)
+        return
+
+    # Other backends: update-then-insert per key
+    for row in rows:
+        match = [table.c[k] == row[k] for k in keys]
+        result = await db.execute(update(table).where(*match).values(count=table.c.count + row["count"]))
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(row))
+
+
+def count_rollups(
+    counters: Dict[Any, Counter],
+    created_at: datetime,
+    status: Optional[str],
+    effective_scores: Dict[str, Any],
+    faults: Iterable[str]
+):
+    """Accumulates one assessment into per-table counters (batch import / rebuild)."""
+    day = created_at.astimezone(timezone.utc).date()
+    for model, rows in rollup_rows(day, status, effective_scores, faults).items():
+        for r in rows:
+            counters[model][tuple(v for k, v in r.items() if k != "count")] += 1
+
+
+def new_rollup_counters() -> Dict[Any, Counter]:
+    return {model: Counter() for model in ROLLUP_TABLES}
+
+
+def counters_to_rows(model, counts: Counter) -> List[Dict[str, Any]]:
+    keys = [c.name for c in model.__table__.primary_key.columns]
+    return [dict(zip(keys, key), count=n) for key, n in sorted(counts.items())]
+
+
+async def add_rollup_counts(db: AsyncSession, counters: Dict[Any, Counter]):
+    """Upserts a whole batch of accumulated counters in one statement per table."""
+    for model in ROLLUP_TABLES:
+        await _upsert_counts(db, model, counters_to_rows(model, counters[model]))
+
+
+async def record_rollups(
+    db: AsyncSession,
+    created_at: datetime,
+    status: Optional[str],
+    effective_scores: Dict[str, Any],
+    faults: Iterable[str]
+):
+    """
+    Adds one assessment to the daily rollups inside the caller's transaction.
+    Tables and keys are always touched in the same sorted order, so concurrent
+    inserts on Postgres queue on the hot rows instead of deadlocking.
+    """
+    day = created_at.astimezone(timezone.utc).date()
+    for model, rows in rollup_rows(day, status, effective_scores, faults).items():
+        await _upsert_counts(db, model, rows)
+
+
+# ────────────────────────────────────────────────
+# DASHBOARD READS
+# ────────────────────────────────────────────────
+def date_window(start: Optional[date], end: Optional[date]):
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=DEFAULT_WINDOW_DAYS - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    return start, end
+
+
+async def status_mix(db: AsyncSession, start: date, end: date) -> Dict[str, Any]:
+    rows = (await db.execute(
+        select(DailyStatusCount.day, DailyStatusCount.status, DailyStatusCount.count)
+        .where(DailyStatusCount.day.between(start, end))
+        .order_by(DailyStatusCount.day, DailyStatusCount.status)
+    )).all()
+    days: Dict[str, Dict[str, int]] = defaultdict(dict)
+    totals: Counter = Counter()
+    for row in rows:
+        days[row.day.isoformat()][row.status] = row.count
+        totals[row.status] += row.count
+    return {"start": start.isoformat(), "end": end.isoformat(), "totals": dict(totals), "days": days}
+
+
+async def score_distribution(db: AsyncSession, start: date, end: date) -> Dict[str, Any]:
+    rows = (await db.execute(
+        select(DailyScoreCount.test, DailyScoreCount.score, DailyScoreCount.count)
+        .where(DailyScoreCount.day.between(start, end))
+    )).all()
+    tests: Dict[str, Counter] = defaultdict(Counter)
+    for row in rows:
+        tests[row.test][row.score] += row.count
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "tests": {test: {str(score): n for score, n in sorted(dist.items())} for test, dist in sorted(tests.items())},
+    }
+
+
+async def top_faults(db: AsyncSession, start: date, end: date, top: int) -> Dict[str, Any]:
+    rows = (await db.execute(
+        select(DailyFaultCount.day, DailyFaultCount.fault, DailyFaultCount.count)
+        .where(DailyFaultCount.day.between(start, end))
+    )).all()
+    per_day: Dict[str, Counter] = defaultdict(Counter)
+    totals: Counter = Counter()
+    for row in rows:
+        per_day[row.day.isoformat()][row.fault] += row.count
+        totals[row.fault] += row.count
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "top": [{"fault": f, "count": n} for f, n in totals.most_common(top)],
+        "days": {
+            day: [{"fault": f, "count": n} for f, n in counts.most_common(top)]
+            for day, counts in sorted(per_day.items())
+        },
+    }
+
+
+# ────────────────────────────────────────────────
+# REBUILD / BACKFILL
+# ────────────────────────────────────────────────
+async def rebuild_rollups(since: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Recomputes the rollups from the stored assessments in one transaction.
+    Memory stays proportional to days x distinct keys: rows are streamed and
+    only the counters are kept. Rows saved before `status` existed are
+    re-analyzed from their raw input.
+    """
+    from src.logic.fms_analyzer import analyze_fms_profile
+    from src.pipeline import FMS_TESTS, active_faults
+    from src.blobs import with_blob, read_blob
+
+    started = time.perf_counter()
+    counters = new_rollup_counters()
+    scanned = 0
+
+    stmt = (
+        with_blob(
+            select(
+                AssessmentScore.created_at, AssessmentScore.status,
+                *[getattr(AssessmentScore, test) for test in FMS_TESTS],
+                AssessmentInput.raw_json_data,
+            )
+            .join(AssessmentInput, AssessmentInput.id == AssessmentScore.input_id),
+            AssessmentInput.raw_hash, "raw"
+        )
+        .execution_options(yield_per=REBUILD_BATCH_SIZE)
+    )
+    if since:
+        stmt = stmt.where(AssessmentScore.created_at >= datetime.combine(since, datetime.min.time(), timezone.utc))
+
+    async with engine.begin() as conn:
+        for model in ROLLUP_TABLES:
+            clear = delete(model)
+            if since:
+                clear = clear.where(model.day >= since)
+            await conn.execute(clear)
+
+        result = await conn.stream(stmt)
+        async for row in result:
+            scanned += 1
+            raw = read_blob(row, "raw", row.raw_json_data) or {}
+            created_at = row.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            status = row.status
+            if status is None:
+                status = analyze_fms_profile(raw, use_manual_scores=raw.get('use_manual_scores', False)).get("status")
+            scores = {test: getattr(row, test) for test in FMS_TESTS}
+            count_rollups(counters, created_at, status, scores, active_faults(raw))
+
+        written = 0
+        for model, counts in counters.items():
+            rows = counters_to_rows(model, counts)
+            for i in range(0, len(rows), REBUILD_BATCH_SIZE):
+                await conn.execute(insert(model.__table__), rows[i:i + REBUILD_BATCH_SIZE])
+            written += len(rows)
+
+    return {"assessments": scanned, "rollup_rows": written, "seconds": round(time.perf_counter() - started, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily analytics rollup tables.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute rollups from stored assessments")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="Only rebuild days >= YYYY-MM-DD")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+    else:
+        stats = asyncio.run(rebuild_rollups(args.since))
+        print(f"✅ Rollups rebuilt: {stats['assessments']} assessments -> {stats['rollup_rows']} rows in {stats['seconds']}s")
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable
+
+from sqlalchemy import select, update, insert, func, bindparam, null
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from src.database import AsyncSessionLocal, AssessmentInput, AssessmentScore, ContentBlob
+from src.serialization import dumps, loads
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+# Usage: python -m src.blobs --migrate [--batch 2000]    move legacy JSON columns into content_blobs
+#        python -m src.blobs --stats                      blob count, raw vs stored bytes, references
+#
+# Raw profiles and generated plans are stored once per distinct content in
+# content_blobs, compressed, and referenced by hash from assessment_inputs.raw_hash
+# and assessment_scores.workout_hash. Rows written before that keep their JSON
+# columns; readers go through read_blob(), which handles both.
+
+# --- CONFIGURATION ---
+# "zstd" needs the optional `zstandard` package and falls back to zlib without it
+BLOB_CODEC = os.getenv("FMS_BLOB_CODEC", "zstd")
+ZLIB_LEVEL = int(os.getenv("FMS_BLOB_ZLIB_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("FMS_BLOB_ZSTD_LEVEL", "3"))
+# Hashes this process has seen committed; repeats skip compression and the INSERT
+KNOWN_BLOBS_CACHE_SIZE = int(os.getenv("FMS_BLOB_KNOWN_CACHE", "50000"))
+MIGRATE_BATCH_SIZE = 2000
+
+# Per-athlete and per-request fields live in their own columns; keeping them
+# out of the blob lets identical checkbox sets share one row.
+PROFILE_ROW_FIELDS = ("athlete_id",)
+
+_zstd = {"c": None, "d": None}
+_known: "OrderedDict[str, None]" = OrderedDict()
+
+
+def active_codec() -> str:
+    return "zstd" if BLOB_CODEC == "zstd" and zstandard is not None else "zlib"
+
+
+def canonical_json(obj: Any) -> bytes:
+    return dumps(obj, sort_keys=True)
+
+
+def blob_hash(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def compress(raw: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if _zstd["c"] is None:
+            _zstd["c"] = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return _zstd["c"].compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd blob found but the `zstandard` package is not installed")
+        if _zstd["d"] is None:
+            _zstd["d"] = zstandard.ZstdDecompressor()
+        return _zstd["d"].decompress(data)
+    return zlib.decompress(data)
+
+
+def encode_blob(obj: Any) -> Dict[str, Any]:
+    """Hash + canonical bytes of `obj`; compression is deferred to store_blobs()."""
+    raw = canonical_json(obj)
+    return {"hash": blob_hash(raw), "raw": raw}
+
+
+def blob_row(blob: Dict[str, Any]) -> Dict[str, Any]:
+    """The content_blobs row (hash, codec, raw_size, compressed data) for an encoded blob."""
+    codec = active_codec()
+    return {"hash": blob["hash"], "codec": codec, "raw_size": len(blob["raw"]), "data": compress(blob["raw"], codec)}
+
+
+def decode_blob(codec: str, data: bytes) -> Any:
+    return loads(decompress(data, codec))
+
+
+def profile_blob(full_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in full_data.items() if k not in PROFILE_ROW_FIELDS}
+
+
+# ── WRITE ──
+async def store_blobs(db: AsyncSession, blobs: Iterable[Dict[str, Any]]):
+    """
+    Inserts encoded blobs that are not stored yet, in the caller's transaction
+    (before the rows that reference them). Call remember_blobs() after commit.
+    """
+    unique = [blob_row(blob) for h, blob in {b["hash"]: b for b in blobs}.items() if h not in _known]
+    if not unique:
+        return
+    table = ContentBlob.__table__
+    dialect = db.bind.dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        module = postgresql if dialect == "postgresql" else sqlite
+        await db.execute(module.insert(table).on_conflict_do_nothing(index_elements=["hash"]), unique)
+        return
+
+    # Other backends: skip the hashes that already exist
+    existing = set((await db.execute(
+        select(table.c.hash).where(table.c.hash.in_([row["hash"] for row in unique]))
+    )).scalars())
+    missing = [row for row in unique if row["hash"] not in existing]
+    if missing:
+        await db.execute(insert(table), missing)
+
+
+def remember_blobs(blobs: Iterable[Dict[str, Any]]):
+    """Marks committed hashes as stored. Only after commit: a rolled-back blob must be written again."""
+    for blob in blobs:
+        _known[blob["hash"]] = None
+        _known.move_to_end(blob["hash"])
+    while len(_known) > KNOWN_BLOBS_CACHE_SIZE:
+        _known.popitem(last=False)
+
+
+# ── READ ──
+def with_blob(stmt, hash_column, name: str):
+    """
+    Adds `<name>_codec` / `<name>_data` columns to a SELECT by outer-joining the
+    blob that `hash_column` references; pass the row to read_blob().
+    """
+    blob = aliased(ContentBlob, name=f"{name}_blob")
+    return (stmt.add_columns(blob.codec.label(f"{name}_codec"), blob.data.label(f"{name}_data"))
+            .outerjoin(blob, blob.hash == hash_column))
+
+
+def read_blob(row, name: str, legacy: Any = None) -> Any:
+    """The decoded blob joined by with_blob(), or the legacy JSON column value for old rows."""
+    data = getattr(row, f"{name}_data", None)
+    if data is not None:
+        return decode_blob(getattr(row, f"{name}_codec"), data)
+    if isinstance(legacy, str):
+        return loads(legacy)
+    return legacy
+
+
+async def load_blob(db: AsyncSession, blob_hash: str) -> Any:
+    """One blob by hash (a primary-key lookup), or None if it is not stored."""
+    row = (await db.execute(
+        select(ContentBlob.codec, ContentBlob.data).where(ContentBlob.hash == blob_hash)
+    )).first()
+    return decode_blob(row.codec, row.data) if row is not None else None
+
+
+def read_profile(row, name: str = "raw", legacy: Any = None, athlete_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    profile = read_blob(row, name, legacy)
+    if profile is not None and athlete_id is not None and "athlete_id" not in profile:
+        profile = {**profile, "athlete_id": athlete_id}
+    return profile
+
+
+# ── MAINTENANCE ──
+async def migrate_legacy(batch_size: int = MIGRATE_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Moves legacy raw_json_data / generated_workout values into content_blobs,
+    one committed batch at a time, and clears the JSON columns. Safe to rerun.
+    """
+    started = time.perf_counter()
+    moved = {"inputs": 0, "plans": 0}
+    targets = [
+        ("inputs", AssessmentInput, AssessmentInput.raw_json_data, "raw_json_data", "raw_hash", profile_blob),
+        ("plans", AssessmentScore, AssessmentScore.generated_workout, "generated_workout", "workout_hash", None),
+    ]
+    for label, model, column, legacy_name, hash_name, transform in targets:
+        while True:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(model.id, column)
+                    .where(getattr(model, hash_name).is_(None), column.is_not(None))
+                    .order_by(model.id).limit(batch_size)
+                )).all()
+                if not rows:
+                    break
+                updates, blobs = [], []
+                for row_id, value in rows:
+                    value = loads(value) if isinstance(value, str) else value
+                    if value is None:  # JSON null: nothing to keep, just clear it
+                        updates.append({"row_id": row_id, "h": None})
+                        continue
+                    blob = encode_blob(transform(value) if transform else value)
+                    blobs.append(blob)
+                    updates.append({"row_id": row_id, "h": blob["hash"]})
+                await store_blobs(db, blobs)
+                table = model.__table__
+                # null(): SQL NULL, not the JSON 'null' a plain None would write
+                await db.execute(
+                    update(table).where(table.c.id == bindparam("row_id"))
+                    .values({hash_name: bindparam("h"), legacy_name: null()}),
+                    updates
+                )
+                await db.commit()
+                remember_blobs(blobs)
+                moved[label] += len(rows)
+                print(f"--- DEBUG: migrated {moved[label]} {label} ---")
+    moved["seconds"] = round(time.perf_counter() - started, 2)
+    return moved
+
+
+async def blob_stats() -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        blobs, raw, stored = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(ContentBlob.raw_size), 0),
+                   func.coalesce(func.sum(func.length(ContentBlob.data)), 0))
+        )).one()
+        input_refs = (await db.execute(select(func.count()).where(AssessmentInput.raw_hash.is_not(None)))).scalar()
+        plan_refs = (await db.execute(select(func.count()).where(AssessmentScore.workout_hash.is_not(None)))).scalar()
+        legacy = (await db.execute(
+            select(func.count()).where(AssessmentInput.raw_json_data.is_not(None))
+        )).scalar()
+    return {"blobs": blobs, "raw_bytes": raw, "stored_bytes": stored,
+            "input_refs": input_refs, "plan_refs": plan_refs, "legacy_inputs": legacy}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed blob storage maintenance.")
+    parser.add_argument("--migrate", action="store_true", help="Move legacy JSON columns into content_blobs")
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument("--stats", action="store_true")
+    args = parser.parse_args()
+
+    if args.migrate:
+        result = asyncio.run(migrate_legacy(args.batch))
+        print(f"✅ Migrated {result['inputs']} inputs and {result['plans']} plans in {result['seconds']}s "
+              f"(run VACUUM to return the freed space to the OS)")
+    if args.stats or not args.migrate:
+        s = asyncio.run(blob_stats())
+        ratio = s["raw_bytes"] / s["stored_bytes"] if s["stored_bytes"] else 0
+        print(f"📦 {s['blobs']} blobs: {s['raw_bytes'] / 2**20:.1f} MiB raw -> {s['stored_bytes'] / 2**20:.1f} MiB "
+              f"stored ({ratio:.1f}x, codec {active_codec()}); referenced by {s['input_refs']} inputs and "
+              f"{s['plan_refs']} plans; {s['legacy_inputs']} legacy inputs not migrated")
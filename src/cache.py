@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from src.serialization import dumps, loads
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional; the local SQLite stand-in is always available
+    aioredis = None
+
+# Usage: python -m src.cache --stats      L2 backend, live entries per namespace
+#        python -m src.cache --purge      drop expired L2 entries
+#        python -m src.cache --clear      drop every L2 entry under FMS_CACHE_PREFIX
+#
+# Two-level cache shared by all workers and pods:
+#   L1  per-process LRU of encoded values (bounded by FMS_CACHE_L1_MAX)
+#   L2  shared key/value store with TTLs. "redis" speaks the Redis protocol
+#       (Redis, Valkey, KeyDB, ...); "sqlite" is a local file with the same
+#       semantics, for single-host deploys, dev and offline runs.
+# Keys carry the versions their value depends on (KB version, prompt version),
+# so a new KB or prompt simply misses; nothing has to be invalidated.
+# On an L2 miss one caller per key takes a short lease and computes; the others
+# poll L2 for its result instead of computing the same value again.
+
+# --- CONFIGURATION ---
+# "redis" needs the optional `redis` package and falls back to "sqlite" without it
+CACHE_BACKEND = os.getenv("FMS_CACHE_BACKEND", "sqlite")  # "sqlite", "redis" or "none" (L1 only)
+CACHE_URL = os.getenv("FMS_CACHE_URL", "redis://localhost:6379/0")
+CACHE_PATH = os.getenv("FMS_CACHE_PATH", "data/cache/shared_cache.sqlite")
+CACHE_PREFIX = os.getenv("FMS_CACHE_PREFIX", "fms")
+L1_MAX_ENTRIES = int(os.getenv("FMS_CACHE_L1_MAX", "2048"))
+L1_TTL_S = float(os.getenv("FMS_CACHE_L1_TTL_S", "300"))  # caps the L1 lifetime of any entry
+PLAN_TTL_S = float(os.getenv("FMS_CACHE_PLAN_TTL_S", "604800"))
+# The lease must outlive one computation (an LLM call); waiters give up after LOCK_WAIT_S
+LOCK_TTL_S = float(os.getenv("FMS_CACHE_LOCK_S", "30"))
+LOCK_WAIT_S = float(os.getenv("FMS_CACHE_LOCK_WAIT_S", "20"))
+# After an L2 error, skip L2 for this long instead of paying its timeout on every request
+L2_RETRY_S = float(os.getenv("FMS_CACHE_L2_RETRY_S", "5"))
+L2_TIMEOUT_S = float(os.getenv("FMS_CACHE_L2_TIMEOUT_S", "0.25"))
+POLL_MIN_S, POLL_MAX_S = 0.02, 0.5
+PURGE_EVERY_SETS = 1000
+
+
+# ── L2 BACKENDS ──
+# Both expose the same four async operations, mirroring the Redis commands used:
+#   get(key)                    GET
+#   set(key, value, ttl_s)      SET key value PX ttl
+#   add(key, value, ttl_s)      SET key value NX PX ttl  -> True if it was set
+#   delete_if(key, value)       compare-and-delete (releases a lease only if still ours)
+class SQLiteBackend:
+    """
+    One WAL-mode SQLite file shared by every process on the host. Expiry is
+    checked on read and swept every PURGE_EVERY_SETS writes. Calls run in a
+    thread so a busy writer never blocks the event loop.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._sets = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            " WITHOUT ROWID"
+        )
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self.conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        return bytes(row[0]) if row and row[1] > time.time() else None
+
+    def _set(self, key: str, value: bytes, ttl_s: float):
+        self.conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, time.time() + ttl_s))
+        self._sets += 1
+        if self._sets % PURGE_EVERY_SETS == 0:
+            self._purge()
+
+    def _add(self, key: str, value: bytes, ttl_s: float) -> bool:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+            added = self.conn.execute("INSERT OR IGNORE INTO kv VALUES (?, ?, ?)", (key, value, now + ttl_s)).rowcount
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return added == 1
+
+    def _delete_if(self, key: str, value: bytes):
+        self.conn.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, value))
+
+    def _purge(self) -> int:
+        return self.conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    @staticmethod
+    def _range(prefix: str) -> Tuple[str, str]:
+        """Key range covering everything that starts with `prefix` (an index range scan)."""
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def _clear(self, prefix: str) -> int:
+        return self.conn.execute("DELETE FROM kv WHERE key >= ? AND key < ?", self._range(prefix)).rowcount
+
+    def _namespaces(self, prefix: str) -> Dict[str, int]:
+        rows = self.conn.execute(
+            "SELECT key FROM kv WHERE key >= ? AND key < ? AND expires_at > ?", (*self._range(prefix), time.time())
+        )
+        counts: Dict[str, int] = {}
+        for (key,) in rows:
+            namespace = key.split(":")[1]
+            counts[namespace] = counts.get(namespace, 0) + 1
+        return counts
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._run, self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl_s: float):
+        await asyncio.to_thread(self._run, self._set, key, value, ttl_s)
+
+    async def add(self, key: str, value: bytes, ttl_s: float) -> bool:
+        return await asyncio.to_thread(self._run, self._add, key, value, ttl_s)
+
+    async def delete_if(self, key: str, value: bytes):
+        await asyncio.to_thread(self._run, self._delete_if, key, value)
+
+    async def ping(self) -> bool:
+        await asyncio.to_thread(self._run, self._purge)
+        return True
+
+    async def purge(self) -> int:
+        return await asyncio.to_thread(self._run, self._purge)
+
+    async def clear(self, prefix: str) -> int:
+        return await asyncio.to_thread(self._run, self._clear, prefix)
+
+    async def namespaces(self, prefix: str) -> Dict[str, int]:
+        return await asyncio.to_thread(self._run, self._namespaces, prefix)
+
+    async def close(self):
+        self.conn.close()
+
+
+class RedisBackend:
+    """Any server speaking the Redis protocol. Expiry is the server's (PX)."""
+
+    name = "redis"
+    # Lua keeps compare-and-delete atomic; a plain GET + DEL could drop another worker's lease
+    _DELETE_IF = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+    def __init__(self, url: str = CACHE_URL):
+        self.url = url
+        self.client = aioredis.from_url(url, socket_timeout=L2_TIMEOUT_S, socket_connect_timeout=L2_TIMEOUT_S)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl_s: float):
+        await self.client.set(key, value, px=max(1, int(ttl_s * 1000)))
+
+    async def add(self, key: str, value: bytes, ttl_s: float) -> bool:
+        return bool(await self.client.set(key, value, px=max(1, int(ttl_s * 1000)), nx=True))
+
+    async def delete_if(self, key: str, value: bytes):
+        await self.client.eval(self._DELETE_IF, 1, key, value)
+
+    async def ping(self) -> bool:
+        return bool(await self.client.ping())
+
+    async def purge(self) -> int:
+        return 0  # the server expires keys itself
+
+    async def clear(self, prefix: str) -> int:
+        deleted = 0
+        async for key in self.client.scan_iter(match=f"{prefix}*", count=1000):
+            deleted += await self.client.delete(key)
+        return deleted
+
+    async def namespaces(self, prefix: str) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        async for key in self.client.scan_iter(match=f"{prefix}*", count=1000):
+            namespace = key.decode().split(":")[1]
+            counts[namespace] = counts.get(namespace, 0) + 1
+        return counts
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def open_backend(backend: str = CACHE_BACKEND):
+    if backend == "none":
+        return None
+    if backend == "redis":
+        if aioredis is not None:
+            return RedisBackend()
+        print("⚠️ WARNING: FMS_CACHE_BACKEND=redis but the `redis` package is missing; using the local SQLite cache")
+    return SQLiteBackend()
+
+
+# ── TWO-LEVEL CACHE ──
+def cache_key(namespace: str, versions: Iterable[Any], *parts: str) -> str:
+    """`<prefix>:<namespace>:<v1>|<v2>...:<digest of parts>`"""
+    digest = hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).hexdigest()
+    version = "|".join(str(v) for v in versions)
+    return f"{CACHE_PREFIX}:{namespace}:{version}:{digest}"
+
+
+class TwoLevelCache:
+    """
+    get_or_compute() returns (value, source) with source one of:
+      "l1"        this process had it
+      "l2"        another worker (or an earlier deploy) computed it
+      "shared"    a concurrent call in this process computed it
+      "computed"  this call computed it
+    Values are stored JSON-encoded, so every caller gets its own copy.
+    L2 failures never fail a request: the value is computed locally and L2 is
+    skipped for L2_RETRY_S.
+    """
+
+    def __init__(self, backend: str = CACHE_BACKEND, l1_max: int = L1_MAX_ENTRIES, l1_ttl_s: float = L1_TTL_S):
+        self.backend_name = backend
+        self.l1_max = l1_max
+        self.l1_ttl_s = l1_ttl_s
+        self._l1: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()  # key -> (expires monotonic, value)
+        self._l2 = None
+        self._l2_opened = False
+        self._l2_down_until = 0.0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"l1_hits": 0, "l2_hits": 0, "shared": 0, "misses": 0, "computed": 0, "not_stored": 0,
+                         "lease_waits": 0, "lease_timeouts": 0, "l2_errors": 0}
+
+    # L2 access: opened on first use, bypassed while marked down
+    def l2(self):
+        if not self._l2_opened:
+            self._l2_opened = True
+            try:
+                self._l2 = open_backend(self.backend_name)
+            except Exception as e:
+                print(f"⚠️ WARNING: Shared cache unavailable, using L1 only: {e}")
+        if self._l2 is None or time.monotonic() < self._l2_down_until:
+            return None
+        return self._l2
+
+    async def _l2_call(self, op: str, *args):
+        """Runs one L2 operation; returns None (and marks L2 down) on any error."""
+        l2 = self.l2()
+        if l2 is None:
+            return None
+        try:
+            return await asyncio.wait_for(getattr(l2, op)(*args), L2_TIMEOUT_S * 4)
+        except Exception as e:
+            self.counters["l2_errors"] += 1
+            self._l2_down_until = time.monotonic() + L2_RETRY_S
+            print(f"⚠️ WARNING: Shared cache {op} failed ({type(e).__name__}: {e}); L1 only for {L2_RETRY_S:.0f}s")
+            return None
+
+    def _l1_get(self, key: str) -> Optional[bytes]:
+        entry = self._l1.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._l1[key]
+            return None
+        self._l1.move_to_end(key)
+        return entry[1]
+
+    def _l1_put(self, key: str, raw: bytes, ttl_s: float):
+        self._l1[key] = (time.monotonic() + min(ttl_s, self.l1_ttl_s), raw)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_max:
+            self._l1.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl_s: float,
+        cacheable: Callable[[Any], bool] = lambda value: True,
+        max_wait_s: float = LOCK_WAIT_S
+    ) -> Tuple[Any, str]:
+        raw = self._l1_get(key)
+        if raw is not None:
+            self.counters["l1_hits"] += 1
+            return loads(raw), "l1"
+
+        if key in self._inflight:
+            self.counters["shared"] += 1
+            raw = await asyncio.shield(self._inflight[key])
+            if raw is not None:
+                return loads(raw), "shared"
+            # The first caller's value was not cacheable (e.g. a fallback); compute our own
+            value = await compute()
+            self.counters["computed"] += 1
+            return value, "computed"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, raw, source = await self._fill(key, compute, ttl_s, cacheable, max_wait_s)
+            future.set_result(raw)
+            return value, source
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; the waiters re-raise it
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _fill(self, key, compute, ttl_s, cacheable, max_wait_s) -> Tuple[Any, Optional[bytes], str]:
+        raw = await self._l2_call("get", key)
+        if raw is not None:
+            self.counters["l2_hits"] += 1
+            self._l1_put(key, raw, ttl_s)
+            return loads(raw), raw, "l2"
+        self.counters["misses"] += 1
+
+        # Stampede protection: one lease holder computes, everyone else polls L2
+        lease_key, token = f"{key}:lease", uuid.uuid4().bytes
+        leased = await self._l2_call("add", lease_key, token, LOCK_TTL_S)
+        if leased is False:
+            self.counters["lease_waits"] += 1
+            give_up, pause = time.monotonic() + max_wait_s, POLL_MIN_S
+            while time.monotonic() < give_up:
+                await asyncio.sleep(min(pause, max(0.0, give_up - time.monotonic())))
+                pause = min(pause * 2, POLL_MAX_S)
+                raw = await self._l2_call("get", key)
+                if raw is not None:
+                    self.counters["l2_hits"] += 1
+                    self._l1_put(key, raw, ttl_s)
+                    return loads(raw), raw, "l2"
+                # Holder finished without storing (or died): take the lease over
+                leased = await self._l2_call("add", lease_key, token, LOCK_TTL_S)
+                if leased is not False:
+                    break
+            else:
+                self.counters["lease_timeouts"] += 1
+
+        try:
+            value = await compute()
+            self.counters["computed"] += 1
+            if not cacheable(value):
+                self.counters["not_stored"] += 1
+                return value, None, "computed"
+            raw = dumps(value)
+            self._l1_put(key, raw, ttl_s)
+            await self._l2_call("set", key, raw, ttl_s)
+            return value, raw, "computed"
+        finally:
+            if leased:
+                await self._l2_call("delete_if", lease_key, token)
+
+    async def contains(self, key: str) -> bool:
+        """Whether a lookup would hit, without counting as one (reports, warmers)."""
+        if self._l1_get(key) is not None:
+            return True
+        return await self._l2_call("get", key) is not None
+
+    async def acquire_lease(self, key: str, ttl_s: float) -> Optional[bytes]:
+        """
+        A cross-worker lease on `key` for periodic work only one worker should do.
+        Returns a token to pass to release_lease(), or None if another worker holds
+        it. Without a reachable L2 there is nobody to coordinate with: always granted.
+        """
+        token = uuid.uuid4().bytes
+        return None if await self._l2_call("add", key, token, ttl_s) is False else token
+
+    async def release_lease(self, key: str, token: bytes):
+        await self._l2_call("delete_if", key, token)
+
+    def clear_l1(self):
+        self._l1.clear()
+
+    async def ping(self) -> bool:
+        """Opens L2 (warmup); False if the cache runs L1 only."""
+        l2 = self.l2()
+        if l2 is None:
+            return False
+        return bool(await l2.ping())
+
+    async def close(self):
+        if self._l2 is not None:
+            await self._l2.close()
+        self._l2, self._l2_opened = None, False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.counters, "backend": self._l2.name if self._l2 is not None else "none",
+                "l1_entries": len(self._l1),
+                "l1_bytes": sum(len(raw) for _, raw in self._l1.values()),
+                "l2_down": time.monotonic() < self._l2_down_until}
+
+
+shared_cache = TwoLevelCache()
+
+
+async def main(args):
+    backend = open_backend()
+    if backend is None:
+        print("FMS_CACHE_BACKEND=none: no shared cache configured")
+        return
+    where = getattr(backend, "path", None) or getattr(backend, "url", "")
+    try:
+        if args.purge:
+            print(f"🧹 Purged {await backend.purge()} expired entries from {backend.name} ({where})")
+        if args.clear:
+            print(f"🗑️ Deleted {await backend.clear(CACHE_PREFIX + ':')} entries from {backend.name} ({where})")
+        if args.stats or not (args.purge or args.clear):
+            counts = await backend.namespaces(CACHE_PREFIX + ':')
+            print(f"📦 Shared cache: {backend.name} ({where}), {sum(counts.values())} live entries")
+            for namespace, count in sorted(counts.items()):
+                print(f"   {namespace:12s}{count:>10,}")
+    finally:
+        await backend.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or empty the shared (L2) cache.")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--purge", action="store_true")
+    parser.add_argument("--clear", action="store_true")
+    asyncio.run(main(parser.parse_args()))
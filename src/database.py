@@ -1,11 +1,16 @@
 import os
+import time
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, JSON, LargeBinary, Index, inspect, text, event
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 
+from src.serialization import dumps_str, loads
+from src.tracing import is_recording, record_span, KIND_CLIENT
+
 load_dotenv()
 
 # --- CONNECTION SETUP ---
@@ -17,8 +22,33 @@ if not DATABASE_URL:
 if DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# Pool sizing: DB_POOL_MIN connections are opened by the startup warmup
+DB_POOL_SIZE = int(os.environ.get("FMS_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("FMS_DB_MAX_OVERFLOW", "10"))
+DB_POOL_MIN = int(os.environ.get("FMS_DB_POOL_MIN", "2"))
+
+# JSON columns (legacy raw_json_data / generated_workout, analytics) use the fast codec
+engine_kwargs = {"echo": False, "json_serializer": dumps_str, "json_deserializer": loads}
+if not DATABASE_URL.startswith("sqlite"):
+    engine_kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+engine = create_async_engine(DATABASE_URL, **engine_kwargs)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# One "db.query" span per statement while a request trace is recording
+# (SQLAlchemy runs these hooks in the request's context)
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if is_recording():
+        context._trace_started = (time.time_ns(), time.perf_counter_ns())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_trace_started", None)
+    if started is not None:
+        record_span("db.query", started[0], time.perf_counter_ns() - started[1], KIND_CLIENT,
+                    **{"db.system": conn.dialect.name, "db.statement": statement[:200],
+                       "db.rows": cursor.rowcount, "db.executemany": executemany})
 Base = declarative_base()
 
 # TABLE 1: RAW SUB-INPUTS
@@ -29,12 +59,23 @@ class AssessmentInput(Base):
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Who was screened (optional; set by the client, e.g. a roster/athlete uuid)
+    athlete_id = Column(String(64), nullable=True)
+
     # Stores the full nested dictionary of checkboxes (e.g., {"overhead_squat": {"heels_lift": true...}})
+    # Legacy rows only: new rows keep it NULL and reference a compressed,
+    # deduplicated copy in content_blobs via raw_hash (see src/blobs.py)
     raw_json_data = Column(JSON) 
+    raw_hash = Column(String(32), ForeignKey("content_blobs.hash"), nullable=True)
 
     # Relationship to link to the scores
     scores = relationship("AssessmentScore", back_populates="input_data", uselist=False)
 
+    __table_args__ = (
+        # "Latest N inputs" (test_pipeline.get_latest_inputs) walks this backwards instead of sorting
+        Index("ix_assessment_inputs_created_at_id", "created_at", "id"),
+    )
+
 
 # TABLE 2: MAIN FMS SCORES
 # This table strictly stores "What the system calculated"
@@ -45,6 +86,10 @@ class AssessmentScore(Base):
     
     # Foreign Key: This links the score back to the specific raw inputs in Table 1
     input_id = Column(Integer, ForeignKey("assessment_inputs.id"))
+
+    # Copied from the input so athlete history never has to join or touch the JSON columns
+    athlete_id = Column(String(64), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # The 7 Calculated Scores (0-3)
     overhead_squat = Column(Integer)
@@ -56,8 +101,156 @@ class AssessmentScore(Base):
     rotary_stability = Column(Integer)
     
     total_score = Column(Integer)
-    generated_workout = Column(JSON, nullable=True)
+    # Analyzer outcome (STOP/MOBILITY/.../POWER), kept for analytics rollups
+    status = Column(String(16), nullable=True)
+    target_level = Column(Integer, nullable=True)
+    generated_workout = Column(JSON, nullable=True)  # legacy rows; new plans live in content_blobs
+    workout_hash = Column(String(32), ForeignKey("content_blobs.hash"), nullable=True)
+    # Hash of what the plan was generated from (scores, active faults, exercise ids);
+    # an unchanged reassessment reuses the plan instead of calling the LLM again
+    plan_fingerprint = Column(String(40), nullable=True)
 
     # Relationship
     input_data = relationship("AssessmentInput", back_populates="scores")
 
+    # Athlete history is paged by keyset (created_at, id) DESC. The index carries
+    # the seven scores too, so a page is an index-only scan that never reads the
+    # large generated_workout column. Postgres gets the narrow key + INCLUDE form.
+    __table_args__ = (
+        Index(
+            "ix_assessment_scores_athlete_history",
+            "athlete_id", "created_at", "id",
+            postgresql_include=[
+                "overhead_squat", "hurdle_step", "inline_lunge", "shoulder_mobility",
+                "active_straight_leg_raise", "trunk_stability_pushup", "rotary_stability", "total_score",
+            ],
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_assessment_scores_athlete_history_cov",
+            "athlete_id", "created_at", "id",
+            "overhead_squat", "hurdle_step", "inline_lunge", "shoulder_mobility",
+            "active_straight_leg_raise", "trunk_stability_pushup", "rotary_stability", "total_score",
+        ).ddl_if(callable_=lambda ddl, target, bind, compiler=None, **kw: bind.dialect.name != "postgresql"),
+    )
+
+
+# TABLES 3-5: DAILY ANALYTICS ROLLUPS
+# Counters per UTC day, bumped in the same transaction as every assessment
+# insert (src/analytics.py), so dashboards read a few hundred rows instead of
+# scanning assessment_scores / raw_json_data.
+class DailyStatusCount(Base):
+    __tablename__ = "rollup_daily_status"
+
+    day = Column(Date, primary_key=True)
+    status = Column(String(16), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyScoreCount(Base):
+    __tablename__ = "rollup_daily_scores"
+
+    day = Column(Date, primary_key=True)
+    test = Column(String(32), primary_key=True)
+    score = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyFaultCount(Base):
+    __tablename__ = "rollup_daily_faults"
+
+    day = Column(Date, primary_key=True)
+    fault = Column(String(128), primary_key=True)  # "test.category.fault"
+    count = Column(Integer, nullable=False, default=0)
+
+
+# TABLE 6: CONTENT-ADDRESSED BLOBS
+# Raw profiles and generated plans, stored once per distinct content and
+# compressed. The key is a hash of the canonical JSON, so identical plans
+# (temperature 0, same inputs) and identical checkbox sets share one row.
+class ContentBlob(Base):
+    __tablename__ = "content_blobs"
+
+    hash = Column(String(32), primary_key=True)  # blake2b-128 of the canonical JSON, hex
+    codec = Column(String(8), nullable=False)    # "zstd" | "zlib"
+    raw_size = Column(Integer, nullable=False)   # uncompressed bytes, for reporting
+    data = Column(LargeBinary, nullable=False)
+
+
+# TABLES 7-10: EXERCISE CATALOG (optional, FMS_KB_SOURCE=db; see src/rag/catalog.py)
+# The exercise library in the database, so coaches can edit it without a
+# redeploy. `catalog` is "" for the shared library or a tenant id. Tags and
+# reach rows are derived from `data` on every write; catalog_versions.version
+# is bumped in the same transaction and workers poll it to reload.
+class Exercise(Base):
+    __tablename__ = "exercises"
+
+    catalog = Column(String(64), primary_key=True)
+    id = Column(String(64), primary_key=True)
+    position = Column(Integer, nullable=False)  # KB order; ranking ties keep it
+    difficulty_level = Column(Integer, nullable=False)
+    # Lower-cased, de-duplicated; text[] with a GIN index on Postgres (tag-overlap search)
+    tags = Column(JSON().with_variant(ARRAY(String(64)), "postgresql"), nullable=False)
+    data = Column(JSON, nullable=False)  # the full exercise dict, as in the JSON KB
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_exercises_tags_gin", "tags", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+
+class ExerciseTag(Base):
+    __tablename__ = "exercise_tags"
+
+    catalog = Column(String(64), primary_key=True)
+    exercise_id = Column(String(64), primary_key=True)
+    tag = Column(String(64), primary_key=True)
+    difficulty_level = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # Tag search within a level (covering); the primary key serves the per-exercise overlap count in ranking
+        Index("ix_exercise_tags_level_tag", "catalog", "difficulty_level", "tag", "exercise_id"),
+    )
+
+
+class ExerciseReach(Base):
+    """Candidate rows per target level: the level's exercises plus those a few progression links away."""
+    __tablename__ = "exercise_reach"
+
+    catalog = Column(String(64), primary_key=True)
+    target_level = Column(Integer, primary_key=True)
+    exercise_id = Column(String(64), primary_key=True)
+    hops = Column(Integer, nullable=False)
+    position = Column(Integer, nullable=False)
+
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_versions"
+
+    catalog = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# --- ADDITIVE MIGRATIONS ---
+# create_all only creates missing tables; it never adds columns or indexes to
+# tables created by an older version. This fills those gaps idempotently.
+def upgrade_schema(sync_conn):
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            print(f"🛠️ Added column {table.name}.{column.name}")
+            if table.name == "assessment_scores" and column.name == "created_at":
+                sync_conn.execute(text(
+                    "UPDATE assessment_scores SET created_at = "
+                    "(SELECT created_at FROM assessment_inputs WHERE assessment_inputs.id = assessment_scores.input_id)"
+                ))
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
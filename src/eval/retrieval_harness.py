@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import statistics
+import sys
+import time
+from typing import Dict, Any, List, Optional
+
+from src.rag.knowledge_base import load_knowledge_base
+from src.rag.retriever import TOP_K, PROGRESSION_HOPS, get_exercises_by_profile, clear_retrieval_cache
+
+# Usage: python -m src.eval.retrieval_harness [--golden data/eval/retrieval_golden.jsonl] [--kb path.json|.kbs]
+#                                             [--thresholds data/eval/retrieval_thresholds.json]
+#                                             [--baseline last_report.json] [--report out.json]
+#
+# Offline gate for retriever / FAULT_TO_TAG_MAP / TAG_RULES / ingestion changes:
+# no network, no LLM, no database. Runs every golden profile through
+# get_exercises_by_profile and scores the top-k against the labels:
+#
+#   recall@k          share of the grade-2 ids (or all labelled ids) found in the top k,
+#                     normalised by min(#relevant, k)
+#   nDCG@k            graded relevance (2 = fault-specific, 1 = related pattern)
+#   level correctness analyzer target level matches, and every returned exercise is within
+#                     PROGRESSION_HOPS levels of it (STOP cases must return nothing)
+#   on-level share    returned exercises exactly at the expected level; gated too, so
+#                     the hop window cannot drift further off-level unnoticed
+#   tag coverage      required tags present in at least one returned exercise
+#   latency           cold (retrieval cache cleared) and warm per-call times
+#
+# Exit code 1 when an aggregate falls below the thresholds file, or, with
+# --baseline, when any single case scores lower than in the baseline report.
+
+# --- CONFIGURATION ---
+GOLDEN_PATH = 'data/eval/retrieval_golden.jsonl'
+THRESHOLDS_PATH = 'data/eval/retrieval_thresholds.json'
+WARM_REPEATS = 20
+BASELINE_TOLERANCE = 1e-9
+
+
+# ── METRICS ──
+def recall_at_k(returned_ids: List[str], relevance: Dict[str, int], k: int) -> Optional[float]:
+    relevant = {i for i, grade in relevance.items() if grade >= 2} or set(relevance)
+    if not relevant:
+        return None
+    return len(relevant & set(returned_ids[:k])) / min(len(relevant), k)
+
+
+def ndcg_at_k(returned_ids: List[str], relevance: Dict[str, int], k: int) -> Optional[float]:
+    if not relevance:
+        return None
+    dcg = sum((2 ** relevance.get(i, 0) - 1) / math.log2(rank + 2) for rank, i in enumerate(returned_ids[:k]))
+    ideal = sorted(relevance.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg else None
+
+
+def level_correctness(case: Dict[str, Any], target_level: int, returned: List[Dict[str, Any]]) -> float:
+    if case.get("expect_empty"):
+        return 1.0 if not returned else 0.0
+    if target_level != case["expected_level"] or not returned:
+        return 0.0
+    window = sum(1 for ex in returned if abs(ex.get("difficulty_level", -99) - case["expected_level"]) <= PROGRESSION_HOPS)
+    return window / len(returned)
+
+
+def on_level_share(case: Dict[str, Any], returned: List[Dict[str, Any]]) -> Optional[float]:
+    if case.get("expect_empty") or not returned:
+        return None
+    return sum(1 for ex in returned if ex.get("difficulty_level") == case["expected_level"]) / len(returned)
+
+
+def tag_coverage(required_tags: List[str], returned: List[Dict[str, Any]]) -> Optional[float]:
+    if not required_tags:
+        return None
+    present = {str(t).lower() for ex in returned for t in ex.get("tags", [])}
+    return sum(1 for t in required_tags if t.lower() in present) / len(required_tags)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(statistics.fmean(values), 4) if values else None
+
+
+# ── HARNESS ──
+def load_golden(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _retrieve(profile: Dict[str, Any], kb) -> Dict[str, Any]:
+    # The retriever's debug prints are not part of what we measure or show
+    with contextlib.redirect_stdout(io.StringIO()):
+        return await get_exercises_by_profile(simple_scores={}, detailed_faults=profile, kb=kb)
+
+
+async def evaluate_case(case: Dict[str, Any], kb, k: int, repeats: int) -> Dict[str, Any]:
+    clear_retrieval_cache()
+    started = time.perf_counter()
+    result = await _retrieve(case["profile"], kb)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    warm_ms = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await _retrieve(case["profile"], kb)
+        warm_ms.append((time.perf_counter() - started) * 1000)
+
+    returned = result.get("data", [])
+    returned_ids = [ex.get("id") for ex in returned]
+    target_level = result.get("analysis", {}).get("target_level")
+    relevance = case.get("relevance", {})
+    return {
+        "id": case["id"],
+        "target_level": target_level,
+        "returned_ids": returned_ids,
+        "recall_at_k": recall_at_k(returned_ids, relevance, k),
+        "ndcg_at_k": ndcg_at_k(returned_ids, relevance, k),
+        "level_correctness": level_correctness(case, target_level, returned),
+        "on_level_share": on_level_share(case, returned),
+        "tag_coverage": tag_coverage(case.get("required_tags", []), returned),
+        "cold_ms": cold_ms,
+        "warm_ms": warm_ms,
+    }
+
+
+async def run_harness(golden: List[Dict[str, Any]], kb, k: int = TOP_K, repeats: int = WARM_REPEATS) -> Dict[str, Any]:
+    cases = [await evaluate_case(case, kb, k, repeats) for case in golden]
+    cold = [c["cold_ms"] for c in cases]
+    warm = [ms for c in cases for ms in c["warm_ms"]]
+    return {
+        "k": k,
+        "cases": len(cases),
+        "kb_version": kb.version,
+        "mean_recall_at_k": _mean([c["recall_at_k"] for c in cases]),
+        "mean_ndcg_at_k": _mean([c["ndcg_at_k"] for c in cases]),
+        "level_correctness": _mean([c["level_correctness"] for c in cases]),
+        "on_level_share": _mean([c["on_level_share"] for c in cases]),
+        "tag_coverage": _mean([c["tag_coverage"] for c in cases]),
+        "cold_p50_ms": round(percentile(cold, 50), 3),
+        "cold_p95_ms": round(percentile(cold, 95), 3),
+        "warm_p50_ms": round(percentile(warm, 50), 3),
+        "warm_p95_ms": round(percentile(warm, 95), 3),
+        "results": [{key: v for key, v in c.items() if key != "warm_ms"} for c in cases],
+    }
+
+
+def check_thresholds(report: Dict[str, Any], thresholds: Dict[str, float]) -> List[str]:
+    failures = []
+    for name, limit in thresholds.items():
+        kind, metric = name.split("_", 1)
+        value = report.get(metric)
+        if value is None:
+            continue
+        if kind == "min" and value < limit:
+            failures.append(f"{metric} = {value} < min {limit}")
+        elif kind == "max" and value > limit:
+            failures.append(f"{metric} = {value} > max {limit}")
+    return failures
+
+
+def check_baseline(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Per-case quality must not drop; catches regressions hidden by the means."""
+    before = {c["id"]: c for c in baseline.get("results", [])}
+    failures = []
+    for case in report["results"]:
+        old = before.get(case["id"])
+        if not old:
+            continue
+        for metric in ("recall_at_k", "ndcg_at_k", "level_correctness", "on_level_share", "tag_coverage"):
+            if old.get(metric) is not None and case.get(metric) is not None \
+                    and case[metric] < old[metric] - BASELINE_TOLERANCE:
+                failures.append(f"{case['id']}: {metric} {old[metric]:.3f} -> {case[metric]:.3f}")
+    return failures
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "   -  " if value is None else f"{value:6.3f}"
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"🧪 Retrieval harness: {report['cases']} golden cases, k={report['k']}, KB {report['kb_version']}")
+    print(f"   {'case':26s} {'lvl':>3s} {'recall':>6s} {'nDCG':>6s} {'level':>6s} {'tags':>6s} {'cold ms':>8s}")
+    for c in report["results"]:
+        print(f"   {c['id']:26s} {c['target_level']!s:>3s} {_fmt(c['recall_at_k'])} {_fmt(c['ndcg_at_k'])} "
+              f"{_fmt(c['level_correctness'])} {_fmt(c['tag_coverage'])} {c['cold_ms']:8.3f}")
+    print(f"\n   mean recall@{report['k']} {report['mean_recall_at_k']}  mean nDCG@{report['k']} {report['mean_ndcg_at_k']}  "
+          f"level {report['level_correctness']} (on-level {report['on_level_share']})  tags {report['tag_coverage']}")
+    print(f"   latency cold p50/p95 {report['cold_p50_ms']}/{report['cold_p95_ms']} ms, "
+          f"warm p50/p95 {report['warm_p50_ms']}/{report['warm_p95_ms']} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline retrieval quality + latency regression gate.")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--kb", default=None, help="KB to evaluate (JSON or .kbs snapshot); default: the serving KB")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--baseline", default=None, help="Previous --report; fail if any case got worse")
+    parser.add_argument("--repeats", type=int, default=WARM_REPEATS, help="Warm calls per case for latency")
+    parser.add_argument("--report", default=None, help="Write the JSON report here (use as the next --baseline)")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        kb = load_knowledge_base(args.kb)
+    if not kb:
+        print(f"❌ Could not load the KB ({args.kb or 'default path'})")
+        sys.exit(2)
+
+    report = asyncio.run(run_harness(load_golden(args.golden), kb, repeats=args.repeats))
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    with open(args.thresholds) as f:
+        failures = check_thresholds(report, json.load(f))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_baseline(report, json.load(f))
+
+    if failures:
+        print("\n❌ REGRESSION:")
+        for failure in failures:
+            print(f"   - {failure}")
+        sys.exit(1)
+    print("\n✅ Retrieval within thresholds.")
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from sqlalchemy import select
+
+from src.database import AsyncSessionLocal, AssessmentInput
+from src.blobs import with_blob, read_profile
+from src.rag.retriever import get_exercises_by_profile
+from src.rag.generator import generate_workout_plan, GENERATOR_ID
+from src.rag.resilience import Deadline
+from src.pipeline import plan_fingerprint
+
+# Usage: python -m src.eval.runner [--db 50 | --jsonl profiles.jsonl] [--concurrency 8]
+#                                  [--fresh-plans] [--no-judge] [--report out.json]
+#
+# Runs retrieval + generation for many profiles concurrently, then judges each
+# plan with the DeepEval metrics below. Generated plans and judge verdicts are
+# cached on disk, so a rerun only pays for cases whose inputs changed.
+
+# --- CONFIGURATION ---
+EVAL_CONCURRENCY = int(os.getenv("FMS_EVAL_CONCURRENCY", "8"))
+EVAL_CACHE_PATH = os.getenv("FMS_EVAL_CACHE", "data/eval/.cache/eval_cache.sqlite")
+EVAL_CASE_BUDGET_S = float(os.getenv("FMS_EVAL_CASE_BUDGET_S", "60"))
+JUDGE_MODEL = os.getenv("FMS_JUDGE_MODEL", "llama-3.3-70b-versatile")
+
+
+# ── METRICS ──
+# Versioned names: change the suffix when a metric's criteria/threshold change,
+# so cached verdicts from the old definition are not reused.
+SQUAT_CORRECTNESS_CRITERIA = """Evaluate the workout plan compliance:
+    1. SCORING LOGIC:
+       - Score 1: Focus on "Corrective" or "Regression". Low intensity.
+       - Score 2: Focus on "Progression" or moderate intensity.
+       - Score 3: Focus on "Performance" or high intensity.
+    2. RELEVANCE: Exercises must be relevant to the user's movement capability.
+    3. SAFETY: Ensure exercises match the user's score level.
+    """
+
+
+def build_metrics(judge) -> Dict[str, Any]:
+    """Fresh metric instances (DeepEval metrics keep per-measure state)."""
+    from deepeval.test_case import LLMTestCaseParams
+    from deepeval.metrics import FaithfulnessMetric, AnswerRelevancyMetric, GEval
+
+    return {
+        "faithfulness@v1": FaithfulnessMetric(threshold=0.8, model=judge, include_reason=True, async_mode=True),
+        "answer_relevancy@v1": AnswerRelevancyMetric(threshold=0.9, model=judge, include_reason=True, async_mode=True),
+        "squat_rag_correctness@v1": GEval(
+            name="Squat RAG Correctness",
+            criteria=SQUAT_CORRECTNESS_CRITERIA,
+            evaluation_steps=[
+                "Identify the squat score in the input.",
+                "Does the workout intensity/level match that score?",
+                "Are the exercises relevant?"
+            ],
+            evaluation_params=[LLMTestCaseParams.INPUT, LLMTestCaseParams.ACTUAL_OUTPUT],
+            model=judge,
+            async_mode=True
+        ),
+    }
+
+
+# ── ON-DISK CACHE ──
+def _sha1(*parts: str) -> str:
+    return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+
+def case_hash(input_text: str, actual_output: str, retrieval_context: List[str]) -> str:
+    return _sha1(input_text, actual_output, *retrieval_context)
+
+
+class EvalCache:
+    """
+    SQLite file with two tables:
+      verdicts  (case hash, metric, judge model) -> score / success / reason
+      plans     (plan fingerprint, generator id) -> generated plan
+    """
+
+    def __init__(self, path: str = EVAL_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                key TEXT PRIMARY KEY, metric TEXT, judge_model TEXT,
+                score REAL, success INTEGER, reason TEXT, created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, plan TEXT, created_at REAL);
+        """)
+
+    def get_verdict(self, case: str, metric: str, judge_model: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT score, success, reason FROM verdicts WHERE key = ?", (_sha1(case, metric, judge_model),)
+        ).fetchone()
+        return {"score": row[0], "success": bool(row[1]), "reason": row[2]} if row else None
+
+    def put_verdict(self, case: str, metric: str, judge_model: str, verdict: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (_sha1(case, metric, judge_model), metric, judge_model,
+             verdict["score"], int(bool(verdict["success"])), verdict.get("reason"), time.time())
+        )
+        self.conn.commit()
+
+    def get_plan(self, fingerprint: str, generator_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT plan FROM plans WHERE key = ?", (_sha1(fingerprint, generator_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_plan(self, fingerprint: str, generator_id: str, plan: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO plans VALUES (?, ?, ?)",
+            (_sha1(fingerprint, generator_id), json.dumps(plan), time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# ── PROFILE SOURCES ──
+async def load_profiles_from_db(limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Latest `limit` stored inputs as (label, profile)."""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            with_blob(
+                select(AssessmentInput.id, AssessmentInput.athlete_id, AssessmentInput.raw_json_data),
+                AssessmentInput.raw_hash, "raw"
+            )
+            .order_by(AssessmentInput.created_at.desc(), AssessmentInput.id.desc())
+            .limit(limit)
+        )).all()
+    return [(f"input:{row.id}", read_profile(row, "raw", row.raw_json_data, row.athlete_id)) for row in rows]
+
+
+def load_profiles_from_jsonl(path: str, limit: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    profiles = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                profiles.append((f"{os.path.basename(path)}:{line_no}", json.loads(line)))
+            if limit and len(profiles) >= limit:
+                break
+    return profiles
+
+
+# ── RUNNER ──
+class EvalRunner:
+    def __init__(
+        self,
+        judge=None,
+        cache: Optional[EvalCache] = None,
+        concurrency: int = EVAL_CONCURRENCY,
+        fresh_plans: bool = False,
+        metrics_factory: Callable[[Any], Dict[str, Any]] = build_metrics,
+        judge_model: str = JUDGE_MODEL
+    ):
+        self.judge = judge
+        self.cache = cache or EvalCache()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.fresh_plans = fresh_plans
+        self.metrics_factory = metrics_factory
+        self.judge_model = judge_model
+        self.stats = {"plans_generated": 0, "plans_cached": 0, "verdicts_judged": 0, "verdicts_cached": 0}
+        # Identical cases running concurrently share one generation / judge call
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _single_flight(self, key: str, compute: Callable[[], Any]):
+        """Returns (value, shared): shared=True if another case already computed it."""
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key]), True
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            future.set_result(value)
+            return value, False
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; the waiters re-raise it
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _plan(self, profile: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any], bool]:
+        retrieval_output = await get_exercises_by_profile(simple_scores={}, detailed_faults=profile)
+        exercises = retrieval_output.get('data', [])
+        analysis = retrieval_output.get('analysis', {})
+
+        fingerprint = plan_fingerprint(profile, analysis, exercises)
+        plan = None if self.fresh_plans else self.cache.get_plan(fingerprint, GENERATOR_ID)
+        if plan is not None:
+            self.stats["plans_cached"] += 1
+            return plan, exercises, analysis, True
+
+        async def generate():
+            generated = await generate_workout_plan(analysis, exercises, deadline=Deadline(EVAL_CASE_BUDGET_S))
+            self.stats["plans_generated"] += 1
+            if not generated.get("fallback_reason"):
+                self.cache.put_plan(fingerprint, GENERATOR_ID, generated)
+            return generated
+
+        plan, shared = await self._single_flight(f"plan:{fingerprint}", generate)
+        if shared:
+            self.stats["plans_cached"] += 1
+        return dict(plan), exercises, analysis, shared
+
+    async def _judge(self, name: str, metric, test_case, case: str) -> Dict[str, Any]:
+        cached = self.cache.get_verdict(case, name, self.judge_model)
+        if cached is not None:
+            self.stats["verdicts_cached"] += 1
+            return {**cached, "cached": True}
+
+        async def measure():
+            await metric.a_measure(test_case, _show_indicator=False)
+            verdict = {"score": metric.score, "success": bool(metric.success), "reason": getattr(metric, "reason", None)}
+            self.stats["verdicts_judged"] += 1
+            self.cache.put_verdict(case, name, self.judge_model, verdict)
+            return verdict
+
+        verdict, shared = await self._single_flight(f"verdict:{case}:{name}", measure)
+        if shared:
+            self.stats["verdicts_cached"] += 1
+        return {**verdict, "cached": shared}
+
+    async def run_case(self, label: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.slots:
+            started = time.perf_counter()
+            try:
+                plan, exercises, analysis, plan_cached = await self._plan(profile)
+                result = {
+                    "label": label,
+                    "status": "FALLBACK" if plan.get("fallback_reason") else "OK",
+                    "target_level": analysis.get("target_level"),
+                    "plan_cached": plan_cached,
+                    "fallback_reason": plan.get("fallback_reason"),
+                    "metrics": {},
+                }
+
+                if self.judge is not None and not plan.get("fallback_reason"):
+                    from deepeval.test_case import LLMTestCase
+
+                    input_text = f"User Profile: {json.dumps(profile, sort_keys=True)}"
+                    actual_output = json.dumps(plan, indent=2, sort_keys=True)
+                    retrieval_context = [
+                        f"{ex.get('exercise_name', 'Unknown')}: {ex.get('description', '')}" for ex in exercises
+                    ]
+                    test_case = LLMTestCase(input=input_text, actual_output=actual_output, retrieval_context=retrieval_context)
+                    case = case_hash(input_text, actual_output, retrieval_context)
+
+                    metrics = self.metrics_factory(self.judge)
+                    verdicts = await asyncio.gather(
+                        *[self._judge(name, metric, test_case, case) for name, metric in metrics.items()],
+                        return_exceptions=True
+                    )
+                    for name, verdict in zip(metrics, verdicts):
+                        result["metrics"][name] = (
+                            {"error": str(verdict)} if isinstance(verdict, Exception) else verdict
+                        )
+            except Exception as e:
+                print(f"⚠️ Error evaluating {label}: {e}")
+                result = {"label": label, "status": "ERROR", "error": str(e), "metrics": {}}
+            result["seconds"] = round(time.perf_counter() - started, 2)
+            print(f"   {'✅' if result['status'] == 'OK' else '⚠️'} {label} {result['status']} ({result['seconds']}s)")
+            return result
+
+    async def run(self, profiles: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        print(f"🚀 Evaluating {len(profiles)} profiles (concurrency {self.concurrency})...")
+        started = time.perf_counter()
+        cases = await asyncio.gather(*[self.run_case(label, profile) for label, profile in profiles])
+        return self.report(cases, time.perf_counter() - started)
+
+    def report(self, cases: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+        per_metric: Dict[str, Dict[str, Any]] = {}
+        for case in cases:
+            for name, verdict in case["metrics"].items():
+                m = per_metric.setdefault(name, {"n": 0, "passed": 0, "errors": 0, "score_sum": 0.0})
+                if "error" in verdict:
+                    m["errors"] += 1
+                    continue
+                m["n"] += 1
+                m["passed"] += int(verdict["success"])
+                m["score_sum"] += verdict["score"] or 0.0
+
+        judge = self.judge
+        return {
+            "cases": len(cases),
+            "statuses": {s: sum(1 for c in cases if c["status"] == s) for s in ("OK", "FALLBACK", "ERROR")},
+            "wall_s": round(wall_s, 2),
+            **self.stats,
+            "judge_model": self.judge_model,
+            "judge_calls": getattr(judge, "calls", 0),
+            "judge_prompt_tokens": getattr(judge, "prompt_tokens", 0),
+            "judge_completion_tokens": getattr(judge, "completion_tokens", 0),
+            "judge_cost_usd": round(judge.cost_usd(), 4) if hasattr(judge, "cost_usd") else 0.0,
+            "metrics": {
+                name: {
+                    "mean_score": round(m["score_sum"] / m["n"], 3) if m["n"] else None,
+                    "pass_rate": round(m["passed"] / m["n"], 3) if m["n"] else None,
+                    "judged": m["n"],
+                    "errors": m["errors"],
+                }
+                for name, m in per_metric.items()
+            },
+            "results": cases,
+        }
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n" + "=" * 40)
+    print(f"📊 EVAL: {report['cases']} cases in {report['wall_s']}s  {report['statuses']}")
+    print(f"   Plans     : {report['plans_generated']} generated, {report['plans_cached']} from cache")
+    print(f"   Verdicts  : {report['verdicts_judged']} judged, {report['verdicts_cached']} from cache")
+    print(f"   Judge     : {report['judge_calls']} calls, "
+          f"{report['judge_prompt_tokens']}+{report['judge_completion_tokens']} tokens, ${report['judge_cost_usd']:.4f}")
+    for name, m in report["metrics"].items():
+        print(f"   {name:28s} mean {m['mean_score']}  pass {m['pass_rate']}  (n={m['judged']}, errors={m['errors']})")
+    print("=" * 40)
+
+
+async def main(args) -> Dict[str, Any]:
+    if args.jsonl:
+        profiles = load_profiles_from_jsonl(args.jsonl, args.limit)
+    else:
+        profiles = await load_profiles_from_db(args.db)
+    if not profiles:
+        print("✅ No profiles to evaluate.")
+        return {}
+
+    judge = None
+    if not args.no_judge:
+        from groq_judge import GroqJudge
+        judge = GroqJudge(model=JUDGE_MODEL)
+
+    cache = EvalCache(args.cache)
+    try:
+        report = await EvalRunner(judge, cache, args.concurrency, args.fresh_plans).run(profiles)
+    finally:
+        cache.close()
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent, cached RAG evaluation.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", type=int, default=5, help="Evaluate the latest N stored inputs (default 5)")
+    source.add_argument("--jsonl", default=None, help="Evaluate profiles from a JSONL file instead")
+    parser.add_argument("--limit", type=int, default=None, help="Max profiles read from --jsonl")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument("--cache", default=EVAL_CACHE_PATH)
+    parser.add_argument("--fresh-plans", action="store_true", help="Regenerate plans instead of reusing cached ones")
+    parser.add_argument("--no-judge", action="store_true", help="Only run retrieval + generation (no DeepEval)")
+    parser.add_argument("--report", default=None, help="Write the full JSON report here")
+    asyncio.run(main(parser.parse_args()))
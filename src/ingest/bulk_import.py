@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import resource
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+
+from src.schemas import FMSProfileRequest
+from src.serialization import loads
+from src.database import AsyncSessionLocal, AssessmentInput, AssessmentScore
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.pipeline import FMS_TESTS, active_faults
+from src.analytics import new_rollup_counters, count_rollups, add_rollup_counts
+from src.blobs import encode_blob, profile_blob, store_blobs, remember_blobs
+from src.rag.knowledge_base import load_knowledge_base, UnknownTenant
+
+# Usage: python -m src.ingest.bulk_import screens.jsonl [--format csv] [--chunk-size 1000]
+#                                        [--plans none|fallback] [--rejects bad.jsonl] [--dry-run]
+#        python -m src.ingest.bulk_import --csv-template > screens.csv
+#
+# Backfills historical screens without calling the LLM. Records are read as a
+# stream and handled one chunk at a time (validate -> analyze -> multi-row
+# INSERT ... RETURNING -> commit), so memory does not grow with the file.
+#
+# JSONL: one /generate-workout body per line.
+# CSV:   one screen per row, columns are dotted paths of the same body, e.g.
+#        athlete_id, created_at, overhead_squat.score, overhead_squat.feet.heels_lift
+#        (empty cells take the model defaults; --csv-template prints every column)
+# Both accept an optional `created_at` (ISO 8601, UTC if no offset) for the
+# original screening date; otherwise the import time is used.
+
+# --- CONFIGURATION ---
+DEFAULT_CHUNK_SIZE = int(os.getenv("FMS_IMPORT_CHUNK_SIZE", "1000"))
+FALLBACK_REASON = "bulk_import"
+
+
+# ── READERS ──
+def iter_jsonl(path: str) -> Iterator[Tuple[int, Any]]:
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, loads(line)
+            except ValueError as e:  # json and orjson decode errors are both ValueErrors
+                yield line_no, e
+
+
+def unflatten(row: Dict[str, str]) -> Dict[str, Any]:
+    """{'overhead_squat.feet.heels_lift': '1'} -> {'overhead_squat': {'feet': {'heels_lift': '1'}}}"""
+    record: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue  # empty cells fall back to the model defaults
+        node = record
+        *parents, leaf = key.strip().split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = value.strip()
+    return record
+
+
+def _section_models(model) -> Dict[str, Any]:
+    """Fields of a pydantic model that are themselves models (tests / fault categories)."""
+    return {
+        name: field.annotation for name, field in model.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel)
+    }
+
+
+def fill_empty_sections(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A fault category whose cells are all empty is still present (all defaults)."""
+    for test, test_model in _section_models(FMSProfileRequest).items():
+        data = record.get(test)
+        if isinstance(data, dict):
+            for category in _section_models(test_model):
+                data.setdefault(category, {})
+    return record
+
+
+def csv_template_columns() -> List[str]:
+    columns = ["athlete_id", "tenant_id", "created_at", "use_manual_scores"]
+    for test, test_model in _section_models(FMSProfileRequest).items():
+        categories = _section_models(test_model)
+        for name in test_model.model_fields:
+            if name in categories:
+                columns.extend(f"{test}.{name}.{fault}" for fault in categories[name].model_fields)
+            else:
+                columns.append(f"{test}.{name}")
+    return columns
+
+
+def iter_csv(path: str) -> Iterator[Tuple[int, Any]]:
+    with open(path, encoding='utf-8', newline='') as f:
+        for line_no, row in enumerate(csv.DictReader(f), 2):
+            yield line_no, fill_empty_sections(unflatten(row))
+
+
+def chunked(records: Iterator, size: int) -> Iterator[List]:
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_created_at(value: Any, default: datetime) -> datetime:
+    if value in (None, ""):
+        return default
+    created_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return created_at if created_at.tzinfo else created_at.replace(tzinfo=timezone.utc)
+
+
+# ── CHUNK PROCESSING ──
+def prepare_chunk(chunk: List[Tuple[int, Any]], plans: str, now: datetime):
+    """Validates and scores a chunk. Returns (input rows, score rows, rejects)."""
+    inputs, scores, rejects = [], [], []
+
+    for line_no, record in chunk:
+        try:
+            if isinstance(record, Exception):
+                raise ValueError(str(record))
+            if not isinstance(record, dict):
+                raise ValueError("record is not an object")
+            created_at = parse_created_at(record.pop("created_at", None), now)
+            full_data = FMSProfileRequest(**record).dict()
+            analysis = analyze_fms_profile(full_data, use_manual_scores=full_data.get('use_manual_scores', False))
+            kb = load_knowledge_base(tenant=full_data.get("tenant_id")) if plans == "fallback" else None
+        except (ValidationError, ValueError, TypeError, UnknownTenant) as e:
+            rejects.append({"line": line_no, "error": str(e)})
+            continue
+
+        effective_scores = analysis.get("effective_scores", {})
+        raw_blob = encode_blob(profile_blob(full_data))
+        inputs.append({"raw_hash": raw_blob["hash"], "athlete_id": full_data.get("athlete_id"),
+                       "created_at": created_at, "_blob": raw_blob})
+        scores.append({
+            "athlete_id": full_data.get("athlete_id"),
+            "created_at": created_at,
+            **{test: effective_scores.get(test, 0) for test in FMS_TESTS},
+            "total_score": sum(effective_scores.values()),
+            "status": analysis.get("status"),
+            "target_level": analysis.get("target_level"),
+            # analysis/faults for the rollups; popped before the insert
+            "_faults": active_faults(full_data),
+            "_effective_scores": effective_scores,
+        })
+        # plans="none" leaves workout_hash NULL, which is how the rows still to
+        # generate are found later
+        if plans == "fallback":
+            plan_blob = encode_blob(fallback_plan(analysis, full_data, kb))
+            scores[-1]["workout_hash"] = plan_blob["hash"]
+            scores[-1]["_blob"] = plan_blob
+    return inputs, scores, rejects
+
+
+def fallback_plan(analysis: Dict[str, Any], full_data: Dict[str, Any], kb=None) -> Dict[str, Any]:
+    """Deterministic retrieval-only plan (no LLM); never reused by the reassessment check."""
+    from src.rag.retriever import build_search_tags, cached_rank
+    from src.rag.generator import build_fallback_plan
+
+    target_level = analysis.get("target_level", 1)
+    exercises = cached_rank(kb, target_level, build_search_tags(target_level, full_data))[0] if kb else []
+    plan = build_fallback_plan(exercises, reason=FALLBACK_REASON)
+    plan["calculated_scores"] = analysis.get("effective_scores", {})
+    return plan
+
+
+async def insert_chunk(inputs: List[Dict[str, Any]], scores: List[Dict[str, Any]]):
+    """One transaction per chunk: the new blobs, two multi-row INSERTs and one rollup upsert per table."""
+    counters = new_rollup_counters()
+    for row in scores:
+        count_rollups(counters, row["created_at"], row["status"], row.pop("_effective_scores"), row.pop("_faults"))
+
+    blobs = [row.pop("_blob") for row in (*inputs, *scores) if "_blob" in row]
+
+    async with AsyncSessionLocal() as db:
+        # Deduplicated in the chunk and against the table (content-addressed)
+        await store_blobs(db, blobs)
+        # RETURNING with executemany is batched into multi-row VALUES by SQLAlchemy 2.0
+        # (insertmanyvalues); sort_by_parameter_order maps ids back to their rows.
+        input_ids = (await db.execute(
+            insert(AssessmentInput).returning(AssessmentInput.id, sort_by_parameter_order=True),
+            inputs
+        )).scalars().all()
+        for row, input_id in zip(scores, input_ids):
+            row["input_id"] = input_id
+        await db.execute(insert(AssessmentScore), scores)
+        await add_rollup_counts(db, counters)
+        await db.commit()
+    remember_blobs(blobs)
+
+
+async def run_import(
+    path: str,
+    fmt: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    plans: str = "none",
+    rejects_path: Optional[str] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    records = iter_csv(path) if fmt == "csv" else iter_jsonl(path)
+    rejects_file = open(rejects_path, 'w', encoding='utf-8') if rejects_path else None
+    stats = {"read": 0, "imported": 0, "rejected": 0}
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+
+    try:
+        for chunk in chunked(records, chunk_size):
+            inputs, scores, rejects = prepare_chunk(chunk, plans, now)
+            if scores and not dry_run:
+                await insert_chunk(inputs, scores)
+
+            stats["read"] += len(chunk)
+            stats["imported"] += len(scores)
+            stats["rejected"] += len(rejects)
+            for reject in rejects:
+                print(f"⚠️ Line {reject['line']} rejected: {reject['error'].splitlines()[0]}")
+                if rejects_file:
+                    rejects_file.write(json.dumps(reject) + "\n")
+
+            elapsed = time.perf_counter() - started
+            print(f"--- DEBUG [import]: {stats['read']} read, {stats['imported']} imported "
+                  f"({stats['imported'] / elapsed:,.0f} rows/s) ---")
+    finally:
+        if rejects_file:
+            rejects_file.close()
+
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    stats["rows_per_s"] = round(stats["imported"] / max(stats["seconds"], 1e-9))
+    stats["max_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-import historical FMS screens (JSONL or CSV) without the LLM.")
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--plans", choices=["none", "fallback"], default="none",
+                        help="none: leave generated_workout empty for later batch generation; "
+                             "fallback: store a retrieval-only plan")
+    parser.add_argument("--rejects", default=None, help="Write rejected lines (with errors) to this JSONL file")
+    parser.add_argument("--dry-run", action="store_true", help="Validate and score only, insert nothing")
+    parser.add_argument("--csv-template", action="store_true", help="Print the CSV header with every column and exit")
+    args = parser.parse_args()
+
+    if args.csv_template:
+        print(",".join(csv_template_columns()))
+        raise SystemExit(0)
+    if not args.path:
+        parser.error("path is required")
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "jsonl")
+    result = asyncio.run(run_import(args.path, fmt, args.chunk_size, args.plans, args.rejects, args.dry_run))
+    print(f"✅ Imported {result['imported']} of {result['read']} records ({result['rejected']} rejected) "
+          f"in {result['seconds']}s, {result['rows_per_s']:,} rows/s, max RSS {result['max_rss_mib']} MiB")
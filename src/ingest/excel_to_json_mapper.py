@@ -1,11 +1,17 @@
+import argparse
+import asyncio
 import pandas as pd
 import json
 import os
 import re
 
+from src.rag.kb_snapshot import build_from_json
+from src.rag.progression import link_progressions
+
 # CONFIGURATION
 INPUT_EXCEL_PATH = 'data/raw/SQUAT (PROGRESSION).xlsx'
 OUTPUT_JSON_PATH = 'data/processed/exercise_knowledge_base.json'
+OUTPUT_SNAPSHOT_PATH = 'data/processed/exercise_knowledge_base.kbs'
 
 # --- 1. SMART TAGGING LOGIC ---
 # This maps keywords in the Exercise Name to specific FMS Faults.
@@ -63,7 +69,7 @@ def generate_smart_tags(name, category, level):
     # Remove duplicates
     return list(set(tags))
 
-def run_ingestion():
+def run_ingestion(to_db: bool = False, tenant: str = None):
     print(f"Loading data from {INPUT_EXCEL_PATH}...")
     
     if not os.path.exists(INPUT_EXCEL_PATH):
@@ -139,13 +145,30 @@ def run_ingestion():
                 knowledge_base.append(entry)
                 count += 1
 
+    # Progression graph: regressions / progressions within each category row
+    edges = link_progressions(knowledge_base)
+
     # Save to JSON
     os.makedirs(os.path.dirname(OUTPUT_JSON_PATH), exist_ok=True)
     with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f:
         json.dump(knowledge_base, f, indent=4)
         
-    print(f"✅ Success! Processed and Auto-Tagged {count} exercises.")
+    # Read-only binary snapshot that production workers memory-map
+    snapshot_size = build_from_json(OUTPUT_JSON_PATH, OUTPUT_SNAPSHOT_PATH)
+
+    print(f"✅ Success! Processed and Auto-Tagged {count} exercises ({edges} progression links).")
     print(f"📁 Database ready at: {OUTPUT_JSON_PATH}")
+    print(f"📁 Snapshot ready at: {OUTPUT_SNAPSHOT_PATH} ({snapshot_size / 1024:.1f} KiB)")
+
+    # Optional: the database catalog served with FMS_KB_SOURCE=db (needs DATABASE_URL)
+    if to_db:
+        from src.rag.catalog import import_catalog
+        asyncio.run(import_catalog(knowledge_base, tenant=tenant))
 
+# Usage: python -m src.ingest.excel_to_json_mapper [--db [--tenant gym42]]
 if __name__ == "__main__":
-    run_ingestion()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the exercise knowledge base from the Excel matrix.")
+    parser.add_argument("--db", action="store_true", help="Also upsert the exercises into the database catalog")
+    parser.add_argument("--tenant", help="Catalog to write with --db (default: the shared library)")
+    args = parser.parse_args()
+    run_ingestion(to_db=args.db, tenant=args.tenant)
\ No newline at end of file
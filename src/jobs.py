@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from src.database import AsyncSessionLocal
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.rag.retriever import get_exercises_by_profile
+from src.rag.generator import generate_workout_plan
+from src.rag.resilience import Deadline, TokenBucket, retry_with_jitter
+from src.pipeline import save_assessment, plan_fingerprint, find_reusable_plan, plan_cache_key, plan_cacheable
+from src.cache import shared_cache, PLAN_TTL_S
+from src.plan_index import find_similar_plan, remember_plan
+from src.tracing import start_trace, KIND_CONSUMER
+from src.profiling import ProfileSession, finish_and_write
+
+# --- CONFIGURATION ---
+JOB_WORKERS = int(os.getenv("FMS_JOB_WORKERS", "8"))
+JOB_LLM_CONCURRENCY = int(os.getenv("FMS_JOB_LLM_CONCURRENCY", "4"))
+JOB_LLM_RPM = float(os.getenv("FMS_JOB_LLM_RPM", "30"))  # match the Groq requests-per-minute quota
+JOB_LLM_BURST = float(os.getenv("FMS_JOB_LLM_BURST", "5"))
+JOB_RETRY_ATTEMPTS = int(os.getenv("FMS_JOB_RETRY_ATTEMPTS", "3"))
+JOB_ITEM_BUDGET_S = float(os.getenv("FMS_JOB_ITEM_BUDGET_S", "30"))
+JOB_MAX_PROFILES = int(os.getenv("FMS_JOB_MAX_PROFILES", "500"))
+JOB_RETENTION = int(os.getenv("FMS_JOB_RETENTION", "100"))
+
+# Fallback reasons worth another attempt (a transient provider error). Not
+# "circuit_open": the breaker stays open for FMS_BREAKER_RESET_S, far longer than
+# the retry backoff, so retries would only burn the item's budget
+RETRYABLE_FALLBACKS = {"llm_error", "deadline_exceeded"}
+
+
+class RetryableGenerationError(Exception):
+    def __init__(self, plan: Dict[str, Any]):
+        super().__init__(plan.get("fallback_reason"))
+        self.plan = plan
+
+
+class BulkJob:
+    """One submitted roster. Results are filled in by index as athletes finish."""
+
+    def __init__(self, profiles: List[Dict[str, Any]], profile: Optional[ProfileSession] = None):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.profiles = profiles
+        self.results: List[Optional[Dict[str, Any]]] = [None] * len(profiles)
+        self.completion_order: List[int] = []
+        self.changed = asyncio.Condition()
+        self.profile = profile  # set when the submit request was profiled; covers every item
+
+    @property
+    def total(self) -> int:
+        return len(self.profiles)
+
+    @property
+    def completed(self) -> int:
+        return len(self.completion_order)
+
+    @property
+    def status(self) -> str:
+        if self.completed == self.total:
+            return "COMPLETED"
+        return "RUNNING" if self.completed else "QUEUED"
+
+    async def record(self, index: int, result: Dict[str, Any]):
+        async with self.changed:
+            self.results[index] = result
+            self.completion_order.append(index)
+            if self.completed == self.total:
+                self.finished_at = time.time()
+                if self.profile is not None:
+                    finish_and_write(self.profile)
+            self.changed.notify_all()
+
+    def summary(self, include_results: bool = True) -> Dict[str, Any]:
+        failed = sum(1 for r in self.results if r and r["status"] == "ERROR")
+        body = {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if include_results:
+            body["results"] = [r for r in self.results if r is not None]
+        return body
+
+    async def stream(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yields each athlete's result once, in completion order, until the job is done."""
+        sent = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.completed > sent)
+                batch = [self.results[i] for i in self.completion_order[sent:]]
+            for result in batch:
+                yield result
+            sent += len(batch)
+            if sent == self.total:
+                return
+
+
+class JobManager:
+    """
+    In-process worker pool for bulk plan generation.
+    Analysis and retrieval run on any free worker; the LLM stage is bounded by
+    a semaphore and a token bucket matched to the provider quota.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        llm_concurrency: int = JOB_LLM_CONCURRENCY,
+        llm_rpm: float = JOB_LLM_RPM,
+        llm_burst: float = JOB_LLM_BURST,
+    ):
+        self.workers = workers
+        self.llm_slots = asyncio.Semaphore(llm_concurrency)
+        self.rate_limiter = TokenBucket(rate_per_s=llm_rpm / 60.0, capacity=llm_burst)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.jobs: "OrderedDict[str, BulkJob]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+            print(f"🧵 Job pool started: {self.workers} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, profiles: List[Dict[str, Any]], profile: Optional[ProfileSession] = None) -> BulkJob:
+        job = BulkJob(profiles, profile)
+        self.jobs[job.id] = job
+        self._evict_finished()
+        for index in range(job.total):
+            self.queue.put_nowait((job, index))
+        return job
+
+    def get(self, job_id: str) -> Optional[BulkJob]:
+        return self.jobs.get(job_id)
+
+    def _evict_finished(self):
+        while len(self.jobs) > JOB_RETENTION:
+            oldest_id = next((jid for jid, j in self.jobs.items() if j.status == "COMPLETED"), None)
+            if oldest_id is None:
+                return
+            del self.jobs[oldest_id]
+
+    async def _worker(self, worker_no: int):
+        while True:
+            job, index = await self.queue.get()
+            try:
+                # One trace per athlete; the id ties the item's log lines together
+                with start_trace("job.item", request_id=f"{job.id[:8]}-{index}", kind=KIND_CONSUMER,
+                                 **{"job.id": job.id, "job.index": index}), \
+                        (job.profile.attach() if job.profile is not None else nullcontext()):
+                    result = await self._process(job.profiles[index])
+            except Exception as e:
+                print(f"❌ JOB {job.id[:8]} item {index} failed: {e}")
+                result = {"status": "ERROR", "error": str(e)}
+            result["index"] = index
+            await job.record(index, result)
+            self.queue.task_done()
+
+    async def _generate(self, analysis: Dict[str, Any], exercises: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Token first: waiting for the rate limit must not hold an LLM slot
+        await self.rate_limiter.acquire()
+        async with self.llm_slots:
+            plan = await generate_workout_plan(analysis, exercises, deadline=Deadline(JOB_ITEM_BUDGET_S))
+        if plan.get("fallback_reason") in RETRYABLE_FALLBACKS:
+            raise RetryableGenerationError(plan)
+        return plan
+
+    async def _process(self, full_data: Dict[str, Any]) -> Dict[str, Any]:
+        analysis = analyze_fms_profile(full_data, use_manual_scores=full_data.get('use_manual_scores', False))
+        effective_scores = analysis.get("effective_scores", {})
+
+        retrieval_result = await get_exercises_by_profile(
+            simple_scores=effective_scores,
+            detailed_faults=full_data
+        )
+        exercises = retrieval_result.get("data", [])
+
+        fingerprint = plan_fingerprint(full_data, analysis, exercises)
+        async with AsyncSessionLocal() as db:
+            try:
+                previous = await find_reusable_plan(db, full_data.get("athlete_id"), fingerprint)
+                if previous is None:
+                    previous = await find_similar_plan(db, full_data, analysis, exercises)
+            except Exception as e:
+                print(f"⚠️ WARNING: Previous plan lookup failed (bulk job): {str(e)}")
+                previous = None
+
+        if previous:
+            reused_id, final_plan = previous
+            final_plan["reused_previous_plan"] = True
+            final_plan["reused_assessment_id"] = reused_id
+        else:
+            async def generate():
+                try:
+                    return await retry_with_jitter(
+                        lambda: self._generate(analysis, exercises),
+                        attempts=JOB_RETRY_ATTEMPTS,
+                        retry_on=(RetryableGenerationError,)
+                    )
+                except RetryableGenerationError as e:
+                    # Out of retries: keep the deterministic fallback rather than failing the athlete
+                    return e.plan
+
+            final_plan, source = await shared_cache.get_or_compute(
+                plan_cache_key(fingerprint, retrieval_result.get("kb_version")), generate, PLAN_TTL_S,
+                cacheable=plan_cacheable
+            )
+            if source != "computed":
+                final_plan["plan_cache"] = source
+            final_plan["reused_previous_plan"] = False
+        final_plan["calculated_scores"] = effective_scores
+
+        async with AsyncSessionLocal() as db:
+            try:
+                score_entry = await save_assessment(db, full_data, analysis, final_plan, fingerprint=fingerprint)
+                assessment_id = score_entry.id
+                if not previous:
+                    remember_plan(full_data, analysis, exercises, score_entry)
+            except Exception as e:
+                await db.rollback()
+                print(f"❌ DB Save Error (bulk job): {str(e)}")
+                assessment_id = None
+
+        return {
+            "status": "FALLBACK" if final_plan.get("fallback_reason") else "SUCCESS",
+            "assessment_id": assessment_id,
+            "plan": final_plan,
+        }
+
+
+job_manager = JobManager()
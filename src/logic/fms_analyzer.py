@@ -1,5 +1,9 @@
 # fms_analyzer.py: Adjusted for binary inputs (0/1 present/absent). Added STOP for pain/score=0.
 
+from src.tracing import traced
+
+
+@traced("analyze", result_attributes=lambda r: {"fms.status": r.get("status"), "fms.target_level": r.get("target_level")})
 def analyze_fms_profile(profile, use_manual_scores=False):
     """
     Input: The full nested FMS profile dictionary.
@@ -167,6 +171,7 @@ def analyze_fms_profile(profile, use_manual_scores=False):
         if test_name in ['use_manual_scores']: continue # Skip flag
         
         test_data = profile[test_name]
+        if not isinstance(test_data, dict): continue # Skip metadata (e.g. athlete_id)
         
         # Check if sub-data exists (did the user expand and check boxes?)
         # We check this by seeing if any value in the nested dicts is > 0
@@ -0,0 +1,103 @@
+from typing import Any, Dict, Iterable, List, Tuple
+
+from src.rag.knowledge_base import tenant_registry
+from src.rag.retriever import retrieval_cache_stats
+from src.plan_index import plan_index
+from src.cache import shared_cache
+
+# ── PROMETHEUS TEXT EXPOSITION ──
+# GET /metrics renders the in-process counters in the Prometheus text format
+# (version 0.0.4), so any scraper can read them without a client library.
+# Counters are per process; with several workers, scrape each one or sum them.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(families: Iterable[Family]) -> str:
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def kb_families() -> List[Family]:
+    s = tenant_registry.snapshot()
+    return [
+        ("fms_kb_tenant_requests_total", "counter", "Tenant KB lookups by outcome",
+         [({"outcome": "hit"}, s["hits"]), ({"outcome": "load"}, s["loads"]),
+          ({"outcome": "reload"}, s["reloads"]), ({"outcome": "unknown"}, s["unknown"]),
+          ({"outcome": "error"}, s["load_errors"])]),
+        ("fms_kb_tenant_evictions_total", "counter", "Tenant KBs evicted from the LRU", [({}, s["evictions"])]),
+        ("fms_kb_tenant_load_seconds_total", "counter", "Time spent loading and indexing tenant KBs",
+         [({}, s["load_seconds"])]),
+        ("fms_kb_tenant_resident", "gauge", "Tenant KBs held in memory", [({}, s["resident"])]),
+        ("fms_kb_tenant_resident_bytes", "gauge", "Estimated heap bytes of resident tenant KBs",
+         [({}, s["resident_bytes"])]),
+        ("fms_kb_tenant_mapped_bytes", "gauge", "Snapshot bytes memory-mapped by resident tenant KBs (page cache)",
+         [({}, s["mapped_bytes"])]),
+        ("fms_kb_tenant_budget_bytes", "gauge", "FMS_KB_CACHE_MB in bytes", [({}, s["max_bytes"])]),
+        ("fms_kb_tenant_bytes", "gauge", "Estimated heap bytes per resident tenant KB",
+         [({"tenant": tenant}, nbytes) for tenant, nbytes in s["tenants"].items()]),
+    ]
+
+
+def retrieval_families() -> List[Family]:
+    s = retrieval_cache_stats()
+    return [
+        ("fms_retrieval_cache_requests_total", "counter", "Retrieval ranking cache lookups by outcome",
+         [({"outcome": "hit"}, s["hits"]), ({"outcome": "miss"}, s["misses"])]),
+        ("fms_retrieval_cache_entries", "gauge", "Cached rankings, across all KB versions", [({}, s["entries"])]),
+    ]
+
+
+def plan_index_families() -> List[Family]:
+    s = plan_index.snapshot()
+    return [
+        ("fms_plan_index_lookups_total", "counter", "Near-duplicate plan lookups by outcome",
+         [({"outcome": "exact"}, s["exact_hits"]), ({"outcome": "similar"}, s["similar_hits"]),
+          ({"outcome": "miss"}, s["misses"])]),
+        ("fms_plan_index_candidates_total", "counter", "LSH candidates compared by exact Jaccard", [({}, s["candidates"])]),
+        ("fms_plan_index_evictions_total", "counter", "Plans evicted from the index", [({}, s["evicted"])]),
+        ("fms_plan_index_entries", "gauge", "Plans in the near-duplicate index", [({}, s["entries"])]),
+    ]
+
+
+def shared_cache_families() -> List[Family]:
+    s = shared_cache.snapshot()
+    return [
+        ("fms_shared_cache_requests_total", "counter", "Two-level cache lookups by where the value came from",
+         [({"outcome": "l1"}, s["l1_hits"]), ({"outcome": "l2"}, s["l2_hits"]), ({"outcome": "shared"}, s["shared"]),
+          ({"outcome": "miss"}, s["misses"])]),
+        ("fms_shared_cache_computed_total", "counter", "Values computed after a miss", [({}, s["computed"])]),
+        ("fms_shared_cache_not_stored_total", "counter", "Computed values not cached (e.g. fallback plans)",
+         [({}, s["not_stored"])]),
+        ("fms_shared_cache_lease_waits_total", "counter", "Misses that waited on another worker's computation",
+         [({"outcome": "waited"}, s["lease_waits"]), ({"outcome": "timed_out"}, s["lease_timeouts"])]),
+        ("fms_shared_cache_l2_errors_total", "counter", "Failed L2 operations", [({}, s["l2_errors"])]),
+        ("fms_shared_cache_l1_entries", "gauge", "Values held in this process's L1", [({}, s["l1_entries"])]),
+        ("fms_shared_cache_l1_bytes", "gauge", "Encoded bytes held in this process's L1", [({}, s["l1_bytes"])]),
+        ("fms_shared_cache_l2_up", "gauge", "1 if L2 is configured and not skipped after an error",
+         [({"backend": s["backend"]}, 0 if s["l2_down"] or s["backend"] == "none" else 1)]),
+    ]
+
+
+def collect() -> List[Family]:
+    return [*kb_families(), *retrieval_families(), *plan_index_families(), *shared_cache_families()]
+
+
+def metrics_text() -> str:
+    return render(collect())
@@ -0,0 +1,201 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import AssessmentInput, AssessmentScore
+from src.analytics import record_rollups
+from src.blobs import encode_blob, profile_blob, store_blobs, remember_blobs, with_blob, read_blob
+from src.tracing import traced
+from src.rag.generator import GENERATOR_ID
+from src.rag.retriever import FAULT_TO_TAG_MAP
+from src.cache import cache_key
+
+# The seven FMS tests, in the order they are stored on AssessmentScore
+FMS_TESTS = [
+    'overhead_squat',
+    'hurdle_step',
+    'inline_lunge',
+    'shoulder_mobility',
+    'active_straight_leg_raise',
+    'trunk_stability_pushup',
+    'rotary_stability',
+]
+
+# Checkboxes that flag a fault; the others (upright_torso, no_pain, heels_stay_down, ...) mark normal movement
+FAULT_FIELDS = frozenset(FAULT_TO_TAG_MAP) | {"pain_reported"}
+
+
+# ── INCREMENTAL REASSESSMENT ──
+def active_faults(full_data: Dict[str, Any]) -> List[str]:
+    """Every `test.category.fault` fault (FAULT_FIELDS) flagged with severity > 0, sorted."""
+    faults = []
+    for test in FMS_TESTS:
+        data = full_data.get(test)
+        if not isinstance(data, dict):
+            continue
+        for category, fields in data.items():
+            if not isinstance(fields, dict):
+                continue
+            for fault, severity in fields.items():
+                if fault in FAULT_FIELDS and isinstance(severity, (int, float)) and severity > 0:
+                    faults.append(f"{test}.{category}.{fault}")
+    return sorted(faults)
+
+
+def plan_fingerprint(full_data: Dict[str, Any], analysis: Dict[str, Any], exercises: List[Dict[str, Any]]) -> str:
+    """
+    Identifies the LLM input: same effective scores, active faults and
+    retrieved exercise ids means the prompt would be the same too.
+    """
+    effective_scores = analysis.get("effective_scores", {})
+    payload = {
+        "scores": [effective_scores.get(test) for test in FMS_TESTS],
+        "faults": active_faults(full_data),
+        "exercise_ids": [ex.get("id") for ex in exercises],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def plan_cache_key(fingerprint: str, kb_version: Optional[str]) -> str:
+    """Shared-cache key for a generated plan: the LLM input plus the KB and prompt it was built with."""
+    return cache_key("plan", (kb_version, GENERATOR_ID), fingerprint)
+
+
+# Plans stored before the missing-API-key plan became a "config_error" fallback
+LEGACY_ERROR_TITLES = {"Config Error"}
+
+
+def plan_cacheable(plan: Dict[str, Any]) -> bool:
+    # Fallbacks are transient (LLM down or over budget, no API key); never share or reuse them
+    return not plan.get("fallback_reason") and plan.get("session_title") not in LEGACY_ERROR_TITLES
+
+
+@traced("db.find_reusable_plan", result_attributes=lambda found: {"plan.reused": found is not None})
+async def find_reusable_plan(db: AsyncSession, athlete_id: Optional[str], fingerprint: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """
+    Returns (assessment_id, plan) if the athlete's latest assessment has the
+    same fingerprint. Only the newest row is looked at (one seek on the
+    history index); fallback plans are stored without a fingerprint, so they
+    are never reused.
+    """
+    if not athlete_id:
+        return None
+    latest = (await db.execute(
+        with_blob(
+            select(AssessmentScore.id, AssessmentScore.plan_fingerprint, AssessmentScore.generated_workout),
+            AssessmentScore.workout_hash, "plan"
+        )
+        .where(AssessmentScore.athlete_id == athlete_id)
+        .order_by(AssessmentScore.created_at.desc(), AssessmentScore.id.desc())
+        .limit(1)
+    )).first()
+    if latest is None or latest.plan_fingerprint != fingerprint:
+        return None
+    plan = read_blob(latest, "plan", latest.generated_workout)
+    if not plan or not plan_cacheable(plan):
+        return None
+    return latest.id, dict(plan)
+
+
+@traced("db.save_assessment")
+async def save_assessment(
+    db: AsyncSession,
+    full_data: Dict[str, Any],
+    analysis: Dict[str, Any],
+    final_plan: Dict[str, Any],
+    fingerprint: Optional[str] = None
+) -> AssessmentScore:
+    """
+    Persists one assessment (raw inputs + calculated scores + plan), bumps the
+    daily analytics rollups and commits. Shared by /generate-workout and the
+    bulk job workers. The profile and plan go to content_blobs, so repeats
+    cost a hash reference instead of another copy.
+    """
+    effective_scores = analysis.get("effective_scores", {})
+    athlete_id = full_data.get("athlete_id")
+    # Set explicitly (not server default) so both rows agree and keyset cursors
+    # compare in one timestamp format on every backend
+    created_at = datetime.now(timezone.utc)
+
+    raw_blob, plan_blob = encode_blob(profile_blob(full_data)), encode_blob(final_plan)
+    await store_blobs(db, [raw_blob, plan_blob])
+
+    input_entry = AssessmentInput(raw_hash=raw_blob["hash"], athlete_id=athlete_id, created_at=created_at)
+    db.add(input_entry)
+    await db.flush()
+
+    score_entry = AssessmentScore(
+        input_id=input_entry.id,
+        athlete_id=athlete_id,
+        created_at=created_at,
+        **{test: effective_scores.get(test, 0) for test in FMS_TESTS},
+        total_score=sum(effective_scores.values()),
+        status=analysis.get("status"),
+        target_level=analysis.get("target_level"),
+        workout_hash=plan_blob["hash"],
+        # Only a plan generated for this very input is reusable as such; a
+        # near-duplicate reuse (src/plan_index.py) is stored without one
+        plan_fingerprint=None if not plan_cacheable(final_plan) or "reuse_similarity" in final_plan else fingerprint
+    )
+    db.add(score_entry)
+    # Same transaction: the dashboards' counters never disagree with the rows
+    await record_rollups(db, created_at, analysis.get("status"), effective_scores, active_faults(full_data))
+    await db.commit()
+    remember_blobs([raw_blob, plan_blob])
+    return score_entry
+
+
+# ── ATHLETE HISTORY (KEYSET PAGINATION) ──
+HISTORY_COLUMNS = [AssessmentScore.id, AssessmentScore.created_at] + \
+    [getattr(AssessmentScore, test) for test in FMS_TESTS] + [AssessmentScore.total_score]
+
+
+def encode_cursor(created_at: datetime, score_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), score_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    created_at, score_id = json.loads(raw)
+    return datetime.fromisoformat(created_at), int(score_id)
+
+
+def history_page_query(athlete_id: str, limit: int, cursor: Optional[str] = None):
+    """
+    Newest-first page of one athlete's scores. Seeks past the cursor with a
+    row-value comparison on (created_at, id) instead of OFFSET, so every page
+    costs the same and only reads the covering history index.
+    """
+    stmt = (
+        select(*HISTORY_COLUMNS)
+        .where(AssessmentScore.athlete_id == athlete_id)
+        .order_by(AssessmentScore.created_at.desc(), AssessmentScore.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        created_at, score_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(AssessmentScore.created_at, AssessmentScore.id) < tuple_(created_at, score_id))
+    return stmt
+
+
+async def fetch_athlete_history(db: AsyncSession, athlete_id: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    rows = (await db.execute(history_page_query(athlete_id, limit, cursor))).all()
+    page, has_more = rows[:limit], len(rows) > limit
+
+    items: List[Dict[str, Any]] = []
+    for row in page:
+        item = dict(row._mapping)
+        item["created_at"] = row.created_at.isoformat() if row.created_at else None
+        items.append(item)
+
+    last = page[-1] if page else None
+    return {
+        "athlete_id": athlete_id,
+        "items": items,
+        "next_cursor": encode_cursor(last.created_at, last.id) if has_more else None,
+    }
@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import os
+import random
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import AsyncSessionLocal, AssessmentInput, AssessmentScore
+from src.blobs import load_blob, with_blob, read_profile
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.pipeline import FMS_TESTS, active_faults, plan_fingerprint, plan_cacheable
+from src.tracing import traced
+
+# ── NEAR-DUPLICATE PLAN REUSE ──
+# The exact fingerprint (src/pipeline.py) only reuses an athlete's own plan for
+# an identical reassessment. This index reuses any previously generated plan
+# whose input was *nearly* the same:
+#
+#   partition  (tenant, target level, retrieved exercise ids in rank order);
+#              a candidate must match it exactly, so the LLM would have been
+#              given the very same exercises
+#   tokens     the active faults plus one "test=score" token per FMS test
+#
+# Within a partition, plans are found by Jaccard similarity of the token sets.
+# MinHash signatures (BANDS x ROWS values) are split into LSH bands, and a plan
+# is a candidate when it shares at least one whole band with the request. The
+# best candidate at or above SIMILARITY_THRESHOLD, by exact Jaccard, is served.
+# Only plans generated for their own input are indexed, so one reuse never
+# seeds another (no drift away from the original input).
+
+# --- CONFIGURATION ---
+SIMILAR_REUSE = os.getenv("FMS_PLAN_SIMILAR_REUSE", "1") == "1"
+SIMILARITY_THRESHOLD = float(os.getenv("FMS_PLAN_SIMILARITY", "0.8"))
+# 8 bands x 4 rows: pairs at Jaccard 0.8 share a band with probability 0.985
+LSH_BANDS = int(os.getenv("FMS_PLAN_LSH_BANDS", "8"))
+LSH_ROWS = int(os.getenv("FMS_PLAN_LSH_ROWS", "4"))
+MAX_CANDIDATES = int(os.getenv("FMS_PLAN_LSH_MAX_CANDIDATES", "24"))  # newest first, per band
+INDEX_MAX_ENTRIES = int(os.getenv("FMS_PLAN_INDEX_MAX", "500000"))
+# Rows of history to index at startup (0 = start empty)
+WARM_ROWS = int(os.getenv("FMS_PLAN_INDEX_WARM", "50000"))
+WARM_BATCH = 1000
+
+_MERSENNE = (1 << 61) - 1
+
+Partition = Tuple[str, int, Tuple[str, ...]]
+
+
+def plan_partition(full_data: Dict[str, Any], analysis: Dict[str, Any], exercises: List[Dict[str, Any]]) -> Partition:
+    return (full_data.get("tenant_id") or "", analysis.get("target_level", 1), tuple(ex.get("id") for ex in exercises))
+
+
+def plan_tokens(full_data: Dict[str, Any], analysis: Dict[str, Any]) -> FrozenSet[str]:
+    effective_scores = analysis.get("effective_scores", {})
+    return frozenset([*active_faults(full_data), *(f"{test}={effective_scores.get(test)}" for test in FMS_TESTS)])
+
+
+def jaccard(a: int, b: int) -> float:
+    """Jaccard similarity of two token sets held as bitmasks."""
+    union = (a | b).bit_count()
+    return (a & b).bit_count() / union if union else 1.0
+
+
+class PlanEntry:
+    __slots__ = ("partition", "mask", "workout_hash", "assessment_id")
+
+    def __init__(self, partition: Partition, mask: int, workout_hash: str, assessment_id: Optional[int]):
+        self.partition = partition
+        self.mask = mask
+        self.workout_hash = workout_hash
+        self.assessment_id = assessment_id
+
+
+class PlanIndex:
+    """
+    In-process MinHash/LSH index of generated plans, bounded to `max_entries`
+    (oldest evicted). Sized for hundreds of thousands of plans: token sets are
+    bitmasks, partitions are shared between entries, band keys are recomputed
+    on eviction rather than stored, and a bucket with one plan holds it directly.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, bands: int = LSH_BANDS, rows: int = LSH_ROWS,
+                 max_entries: int = INDEX_MAX_ENTRIES, max_candidates: int = MAX_CANDIDATES, seed: int = 0x5EED):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(bands * rows)]
+        # The token vocabulary is small and fixed (schema faults, 7 tests x 4 scores),
+        # so each token gets a bit (token sets are ints, Jaccard is two popcounts)
+        # and its permuted hashes are computed once
+        self._token_bits: Dict[str, int] = {}
+        self._bit_tokens: List[str] = []
+        self._token_values: Dict[str, Tuple[int, ...]] = {}
+        self._partitions: Dict[Partition, List[Any]] = {}  # partition -> [shared tuple, entry count]
+        self._entries: "OrderedDict[Tuple[Partition, int], PlanEntry]" = OrderedDict()
+        self._buckets: Dict[int, Any] = {}  # band key -> PlanEntry, or a list of them (oldest first)
+        self.counters = {"lookups": 0, "exact_hits": 0, "similar_hits": 0, "misses": 0,
+                         "candidates": 0, "added": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def mask(self, tokens: FrozenSet[str]) -> int:
+        bits = self._token_bits
+        mask = 0
+        for t in tokens:
+            bit = bits.get(t)
+            if bit is None:
+                bit = bits[t] = 1 << len(self._bit_tokens)
+                self._bit_tokens.append(t)
+            mask |= bit
+        return mask
+
+    def tokens_of(self, mask: int) -> FrozenSet[str]:
+        return frozenset(t for i, t in enumerate(self._bit_tokens) if mask >> i & 1)
+
+    def _values(self, token: str) -> Tuple[int, ...]:
+        values = self._token_values.get(token)
+        if values is None:
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            values = self._token_values[token] = tuple((a * h + b) % _MERSENNE for a, b in self._perms)
+        return values
+
+    def signature(self, tokens: FrozenSet[str]) -> Tuple[int, ...]:
+        if not tokens:
+            return (0,) * len(self._perms)
+        return tuple(map(min, zip(*(self._values(t) for t in tokens))))
+
+    def band_keys(self, partition: Partition, tokens: FrozenSet[str]) -> Tuple[int, ...]:
+        sig, r = self.signature(tokens), self.rows
+        return tuple(hash((partition, b, sig[b * r:(b + 1) * r])) for b in range(self.bands))
+
+    def lookup(self, partition: Partition, tokens: FrozenSet[str]) -> Optional[Tuple[PlanEntry, float]]:
+        """The most similar indexed plan in the same partition at or above the threshold, with its Jaccard."""
+        self.counters["lookups"] += 1
+        mask = self.mask(tokens)
+        entry = self._entries.get((partition, mask))
+        if entry is not None:
+            self.counters["exact_hits"] += 1
+            return entry, 1.0
+        if partition not in self._partitions:
+            self.counters["misses"] += 1
+            return None
+
+        # Jaccard >= t needs t*|A| <= |B| <= |A|/t; the popcount rejects most candidates
+        size = mask.bit_count()
+        low, high = size * self.threshold, size / self.threshold if self.threshold > 0 else float("inf")
+        best, seen = None, set()
+        for key in self.band_keys(partition, tokens):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            for candidate in (bucket,) if type(bucket) is PlanEntry else reversed(bucket[-self.max_candidates:]):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if not low <= candidate.mask.bit_count() <= high or candidate.partition != partition:
+                    continue  # partition mismatch: band hash collision across partitions
+                similarity = jaccard(mask, candidate.mask)
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+        self.counters["candidates"] += len(seen)
+        self.counters["similar_hits" if best else "misses"] += 1
+        return best
+
+    def add(self, partition: Partition, tokens: FrozenSet[str], workout_hash: str, assessment_id: Optional[int] = None):
+        mask = self.mask(tokens)
+        key = (partition, mask)
+        entry = self._entries.get(key)
+        if entry is not None:  # same input generated again: serve the newer plan
+            entry.workout_hash, entry.assessment_id = workout_hash, assessment_id
+            self._entries.move_to_end(key)
+            return
+        shared = self._partitions.setdefault(partition, [partition, 0])
+        shared[1] += 1
+        entry = PlanEntry(shared[0], mask, workout_hash, assessment_id)
+        self._entries[(shared[0], mask)] = entry
+        for band_key in self.band_keys(partition, tokens):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                self._buckets[band_key] = entry
+            elif type(bucket) is PlanEntry:
+                self._buckets[band_key] = [bucket, entry]
+            else:
+                bucket.append(entry)
+        self.counters["added"] += 1
+        while len(self._entries) > self.max_entries:
+            self._evict(self._entries.popitem(last=False)[1])
+
+    def _evict(self, entry: PlanEntry):
+        for band_key in self.band_keys(entry.partition, self.tokens_of(entry.mask)):
+            bucket = self._buckets[band_key]
+            if bucket is entry:
+                del self._buckets[band_key]
+                continue
+            bucket.remove(entry)
+            if len(bucket) == 1:
+                self._buckets[band_key] = bucket[0]
+        shared = self._partitions[entry.partition]
+        shared[1] -= 1
+        if not shared[1]:
+            del self._partitions[entry.partition]
+        self.counters["evicted"] += 1
+
+    def discard(self, entry: PlanEntry):
+        if self._entries.pop((entry.partition, entry.mask), None) is not None:
+            self._evict(entry)
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+        self._partitions.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "partitions": len(self._partitions),
+                "buckets": len(self._buckets), **self.counters}
+
+
+plan_index = PlanIndex()
+
+
+# ── SERVING ──
+@traced("db.find_similar_plan", result_attributes=lambda found: {"plan.similar": found is not None})
+async def find_similar_plan(db: AsyncSession, full_data: Dict[str, Any], analysis: Dict[str, Any],
+                            exercises: List[Dict[str, Any]]) -> Optional[Tuple[Optional[int], Dict[str, Any]]]:
+    """
+    Returns (assessment_id, plan) for a plan generated from a near-identical
+    input with the same retrieved exercises; the plan carries `reuse_similarity`.
+    """
+    if not SIMILAR_REUSE or not exercises:
+        return None
+    found = plan_index.lookup(plan_partition(full_data, analysis, exercises), plan_tokens(full_data, analysis))
+    if found is None:
+        return None
+    entry, similarity = found
+    plan = await load_blob(db, entry.workout_hash)
+    if not plan or not plan_cacheable(plan):  # legacy rows fingerprinted an error plan
+        plan_index.discard(entry)
+        return None
+    plan = dict(plan)
+    plan["reuse_similarity"] = round(similarity, 3)
+    return entry.assessment_id, plan
+
+
+def remember_plan(full_data: Dict[str, Any], analysis: Dict[str, Any], exercises: List[Dict[str, Any]],
+                  score_entry: AssessmentScore):
+    """Indexes a saved plan if it was generated for this input (not a fallback, not reused)."""
+    if SIMILAR_REUSE and exercises and score_entry.plan_fingerprint and score_entry.workout_hash:
+        plan_index.add(plan_partition(full_data, analysis, exercises), plan_tokens(full_data, analysis),
+                       score_entry.workout_hash, score_entry.id)
+
+
+# ── STARTUP ──
+async def warm_plan_index(limit: int = WARM_ROWS) -> int:
+    """
+    Indexes the newest `limit` fingerprinted assessments. Retrieval is re-run on
+    the stored profile, and a row whose fingerprint no longer matches (KB or
+    rules changed since) is skipped: its plan was built from other exercises.
+    """
+    from src.rag.knowledge_base import load_knowledge_base, UnknownTenant, KB_SOURCE
+    from src.rag.retriever import build_search_tags, cached_rank
+
+    if not SIMILAR_REUSE or limit <= 0:
+        return 0
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            with_blob(
+                select(AssessmentScore.id, AssessmentScore.workout_hash, AssessmentScore.plan_fingerprint,
+                       AssessmentInput.raw_json_data)
+                .join(AssessmentInput, AssessmentInput.id == AssessmentScore.input_id),
+                AssessmentInput.raw_hash, "raw"
+            )
+            .where(AssessmentScore.plan_fingerprint.is_not(None), AssessmentScore.workout_hash.is_not(None))
+            .order_by(AssessmentScore.id.desc())
+            .limit(limit)
+        )).all()
+
+    profiles = [read_profile(row, "raw", row.raw_json_data) for row in reversed(rows)]
+    if KB_SOURCE == "db":
+        from src.rag.catalog import refresh_catalogs
+        await refresh_catalogs(profile.get("tenant_id") for profile in profiles if profile)
+
+    indexed = stale = 0
+    # oldest first, so the newest plan wins and is evicted last
+    for n, (row, profile) in enumerate(zip(reversed(rows), profiles), 1):
+        if not profile:
+            continue
+        analysis = analyze_fms_profile(profile, use_manual_scores=profile.get('use_manual_scores', False))
+        try:
+            kb = load_knowledge_base(tenant=profile.get("tenant_id"))
+        except UnknownTenant:
+            kb = None
+        if not kb:
+            continue
+        target_level = analysis.get("target_level", 1)
+        exercises = list(cached_rank(kb, target_level, build_search_tags(target_level, profile))[0])
+        if plan_fingerprint(profile, analysis, exercises) != row.plan_fingerprint:
+            stale += 1
+            continue
+        plan_index.add(plan_partition(profile, analysis, exercises), plan_tokens(profile, analysis),
+                       row.workout_hash, row.id)
+        indexed += 1
+        if n % WARM_BATCH == 0:
+            await asyncio.sleep(0)  # let requests in between batches
+    print(f"✅ Plan index warmed: {indexed} plans from {len(rows)} assessments ({stale} stale)")
+    return indexed
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import select, func, case
+
+from src.database import AsyncSessionLocal, AssessmentInput, ContentBlob
+from src.blobs import decode_blob
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.rag.knowledge_base import load_knowledge_base, UnknownTenant, KB_SOURCE
+from src.rag.retriever import build_search_tags, cached_rank
+from src.rag.generator import generate_workout_plan
+from src.rag.resilience import Deadline, TokenBucket
+from src.pipeline import active_faults, plan_fingerprint, plan_cache_key, plan_cacheable
+from src.cache import shared_cache, PLAN_TTL_S, CACHE_PREFIX
+
+# Usage: python -m src.plan_warmer [--days 28] [--budget 100] [--report warm.json]
+#        python -m src.plan_warmer --dry-run          coverage only, no LLM calls
+#
+# Pre-generates plans for the most common screening outcomes so they are in the
+# shared plan cache (src/cache.py) before the morning rush. Run it off-peak from
+# cron, or set FMS_PLAN_WARM_AT=HH:MM to have the API do it once a day (one
+# worker per day, coordinated through a shared-cache lease).
+#
+#   mine      count screenings per distinct input (raw_hash) over FMS_PLAN_WARM_DAYS
+#   key       re-run analysis + retrieval on each input under the current KB and
+#             prompt, and group by plan cache key: inputs that differ only in
+#             fields the plan does not depend on share one key
+#   warm      generate the most frequent keys that are not cached yet, at most
+#             FMS_PLAN_WARM_BUDGET LLM calls and FMS_PLAN_WARM_MAX_S seconds
+#   coverage  share of the last FMS_PLAN_WARM_COVERAGE_DAYS of screenings whose
+#             plan is now cached, before and after warming
+#
+# Legacy rows (JSON column, no raw_hash) are not mined; `python -m src.blobs
+# --migrate` moves them into content_blobs.
+
+# --- CONFIGURATION ---
+WARM_DAYS = int(os.getenv("FMS_PLAN_WARM_DAYS", "28"))
+COVERAGE_DAYS = int(os.getenv("FMS_PLAN_WARM_COVERAGE_DAYS", "7"))
+WARM_MAX_INPUTS = int(os.getenv("FMS_PLAN_WARM_MAX_INPUTS", "20000"))  # distinct inputs, most frequent first
+WARM_LLM_BUDGET = int(os.getenv("FMS_PLAN_WARM_BUDGET", "100"))  # LLM calls per run
+WARM_LLM_RPM = float(os.getenv("FMS_PLAN_WARM_RPM", "20"))  # leave headroom under the provider quota
+WARM_CONCURRENCY = int(os.getenv("FMS_PLAN_WARM_CONCURRENCY", "2"))
+WARM_MIN_COUNT = int(os.getenv("FMS_PLAN_WARM_MIN_COUNT", "2"))  # one-off inputs are not worth an LLM call
+WARM_MAX_S = float(os.getenv("FMS_PLAN_WARM_MAX_S", "3600"))  # stop before the rush even with budget left
+WARM_ITEM_BUDGET_S = float(os.getenv("FMS_PLAN_WARM_ITEM_BUDGET_S", "30"))
+WARM_AT = os.getenv("FMS_PLAN_WARM_AT", "")  # "HH:MM" server local time; empty = no in-process schedule
+BLOB_BATCH = 500
+WARM_LEASE_KEY = f"{CACHE_PREFIX}:warmer:lease"
+
+
+@dataclass
+class WarmKey:
+    """One plan cache key and the screenings that map to it."""
+    key: str
+    count: int = 0          # screenings in the mining window
+    recent: int = 0         # ... of which in the coverage window
+    status: str = ""
+    target_level: int = 0
+    faults: int = 0
+    cached: bool = False    # before this run
+    warmed: bool = False    # generated and stored by this run
+    sample: Optional[Tuple[Dict[str, Any], Dict[str, Any], List[Dict[str, Any]]]] = field(default=None, repr=False)
+
+
+# ── MINE ──
+async def mine_inputs(days: int = WARM_DAYS, coverage_days: int = COVERAGE_DAYS,
+                      max_inputs: int = WARM_MAX_INPUTS) -> Dict[str, Any]:
+    """
+    Screenings per distinct input over the last `days` (a range scan of
+    ix_assessment_inputs_created_at_id), most frequent first, with the profiles.
+    """
+    now = datetime.now(timezone.utc)
+    since, recent_since = now - timedelta(days=days), now - timedelta(days=coverage_days)
+    in_window = AssessmentInput.created_at >= since
+    async with AsyncSessionLocal() as db:
+        counts = (await db.execute(
+            select(AssessmentInput.raw_hash, func.count().label("n"),
+                   func.sum(case((AssessmentInput.created_at >= recent_since, 1), else_=0)).label("recent"))
+            .where(in_window, AssessmentInput.raw_hash.is_not(None))
+            .group_by(AssessmentInput.raw_hash)
+            .order_by(func.count().desc())
+            .limit(max_inputs)
+        )).all()
+        legacy = (await db.execute(
+            select(func.count()).select_from(AssessmentInput)
+            .where(AssessmentInput.created_at >= recent_since, AssessmentInput.raw_hash.is_(None))
+        )).scalar_one()
+        # Screenings of inputs beyond max_inputs still count towards the coverage denominator
+        recent_total = (await db.execute(
+            select(func.count()).select_from(AssessmentInput)
+            .where(AssessmentInput.created_at >= recent_since, AssessmentInput.raw_hash.is_not(None))
+        )).scalar_one()
+
+        profiles: Dict[str, Any] = {}
+        hashes = [row.raw_hash for row in counts]
+        for start in range(0, len(hashes), BLOB_BATCH):
+            rows = (await db.execute(
+                select(ContentBlob.hash, ContentBlob.codec, ContentBlob.data)
+                .where(ContentBlob.hash.in_(hashes[start:start + BLOB_BATCH]))
+            )).all()
+            profiles.update((row.hash, decode_blob(row.codec, row.data)) for row in rows)
+
+    return {
+        "inputs": [(profiles[row.raw_hash], row.n, int(row.recent or 0)) for row in counts if row.raw_hash in profiles],
+        "screenings": sum(row.n for row in counts),
+        "recent_total": recent_total,
+        "legacy_recent": legacy,
+    }
+
+
+# ── KEY ──
+def group_by_plan_key(inputs: List[Tuple[Dict[str, Any], int, int]]) -> Tuple[List[WarmKey], int]:
+    """WarmKeys by descending frequency, and the recent screenings that have no key (unknown tenant, no KB)."""
+    keys: Dict[str, WarmKey] = {}
+    unkeyed = 0
+    for profile, count, recent in inputs:
+        analysis = analyze_fms_profile(profile, use_manual_scores=profile.get('use_manual_scores', False))
+        try:
+            kb = load_knowledge_base(tenant=profile.get("tenant_id"))
+        except UnknownTenant:
+            kb = None
+        if not kb:
+            unkeyed += recent
+            continue
+        target_level = analysis.get("target_level", 1)
+        exercises = list(cached_rank(kb, target_level, build_search_tags(target_level, profile))[0])
+        key = plan_cache_key(plan_fingerprint(profile, analysis, exercises), kb.version)
+        entry = keys.get(key)
+        if entry is None:
+            entry = keys[key] = WarmKey(key, status=analysis.get("status", ""), target_level=target_level,
+                                        faults=len(active_faults(profile)), sample=(profile, analysis, exercises))
+        entry.count += count
+        entry.recent += recent
+    return sorted(keys.values(), key=lambda k: (-k.count, -k.recent)), unkeyed
+
+
+# ── WARM ──
+async def warm_keys(keys: List[WarmKey], budget: int = WARM_LLM_BUDGET, rpm: float = WARM_LLM_RPM,
+                    concurrency: int = WARM_CONCURRENCY, max_s: float = WARM_MAX_S) -> Dict[str, int]:
+    """
+    Generates uncached keys in order until the LLM budget or time runs out.
+    Only LLM plans count as warmed; a config_error (no API key) stops the run,
+    since every other key would get the same fallback.
+    """
+    todo = [k for k in keys if not k.cached][:max(0, budget)]
+    bucket = TokenBucket(rate_per_s=rpm / 60, capacity=1)
+    slots = asyncio.Semaphore(concurrency)
+    stop_at = time.monotonic() + max_s
+    config_error = asyncio.Event()
+    stats = {"attempted": 0, "warmed": 0, "not_cached": 0, "skipped_time": 0, "skipped_config": 0}
+
+    async def warm(entry: WarmKey):
+        async with slots:
+            if config_error.is_set():
+                stats["skipped_config"] += 1
+                return
+            if time.monotonic() >= stop_at:
+                stats["skipped_time"] += 1
+                return
+            await bucket.acquire()
+            if config_error.is_set():
+                stats["skipped_config"] += 1
+                return
+            profile, analysis, exercises = entry.sample
+
+            async def generate():
+                stats["attempted"] += 1
+                return await generate_workout_plan(analysis, exercises, deadline=Deadline(WARM_ITEM_BUDGET_S))
+
+            plan, source = await shared_cache.get_or_compute(entry.key, generate, PLAN_TTL_S, cacheable=plan_cacheable)
+            if plan_cacheable(plan):
+                entry.warmed = source == "computed"
+                stats["warmed"] += entry.warmed
+            else:
+                stats["not_cached"] += 1  # fallback (LLM down or over budget); retried next run
+                if plan.get("fallback_reason") == "config_error" and not config_error.is_set():
+                    config_error.set()
+                    print("❌ Plan warmer: LLM is not configured (config_error); stopping this run")
+
+    await asyncio.gather(*(warm(entry) for entry in todo))
+    return stats
+
+
+# ── RUN ──
+def coverage(keys: List[WarmKey], recent_total: int, after: bool) -> float:
+    hit = sum(k.recent for k in keys if k.cached or (after and k.warmed))
+    return hit / recent_total if recent_total else 0.0
+
+
+async def run_warmer(days: int = WARM_DAYS, budget: int = WARM_LLM_BUDGET, min_count: int = WARM_MIN_COUNT,
+                     dry_run: bool = False) -> Dict[str, Any]:
+    started = time.perf_counter()
+    mined = await mine_inputs(days=days)
+    if KB_SOURCE == "db":
+        from src.rag.catalog import refresh_catalogs
+        await refresh_catalogs(profile.get("tenant_id") for profile, _, _ in mined["inputs"])
+    keys, unkeyed = group_by_plan_key(mined["inputs"])
+    for entry in keys:
+        entry.cached = await shared_cache.contains(entry.key)
+    candidates = [k for k in keys if k.count >= min_count]
+    stats = {"attempted": 0, "warmed": 0, "not_cached": 0, "skipped_time": 0}
+    if not dry_run:
+        stats = await warm_keys(candidates, budget=budget)
+
+    recent_total = mined["recent_total"]
+    report = {
+        "window_days": days,
+        "coverage_days": COVERAGE_DAYS,
+        "screenings": mined["screenings"],
+        "distinct_inputs": len(mined["inputs"]),
+        "plan_keys": len(keys),
+        "candidates": len(candidates),
+        "already_cached": sum(k.cached for k in keys),
+        "budget": budget,
+        **stats,
+        "recent_screenings": recent_total,
+        "recent_unkeyed": unkeyed,
+        "recent_legacy_excluded": mined["legacy_recent"],
+        "coverage_before": round(coverage(keys, recent_total, after=False), 4),
+        "coverage_after": round(coverage(keys, recent_total, after=True), 4),
+        # If the whole budget went to the top keys, regardless of what was cached
+        "coverage_top_budget": round(sum(k.recent for k in keys[:budget]) / recent_total, 4) if recent_total else 0.0,
+        "duration_s": round(time.perf_counter() - started, 2),
+        "top": [{"status": k.status, "target_level": k.target_level, "faults": k.faults, "count": k.count,
+                 "recent": k.recent, "cached": k.cached, "warmed": k.warmed} for k in keys[:20]],
+    }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"🔎 Mined {report['screenings']:,} screenings ({report['window_days']} days): "
+          f"{report['distinct_inputs']:,} distinct inputs → {report['plan_keys']:,} plan keys, "
+          f"{report['candidates']:,} seen at least {WARM_MIN_COUNT}x")
+    print(f"🔥 Already cached {report['already_cached']:,}; generated {report['warmed']} "
+          f"({report['attempted']} LLM calls of budget {report['budget']}, {report['not_cached']} fallbacks not cached, "
+          f"{report['skipped_time']} skipped for time) in {report['duration_s']}s")
+    if report.get("skipped_config"):
+        print(f"   ❌ stopped on config_error: {report['skipped_config']} keys not attempted (check GROQ_API_KEY)")
+    print(f"📈 Last {report['coverage_days']} days ({report['recent_screenings']:,} screenings): plan cached for "
+          f"{report['coverage_before']:.1%} before → {report['coverage_after']:.1%} after "
+          f"(top {report['budget']} keys: {report['coverage_top_budget']:.1%})")
+    if report["recent_legacy_excluded"] or report["recent_unkeyed"]:
+        print(f"   not counted: {report['recent_legacy_excluded']} legacy rows, "
+              f"{report['recent_unkeyed']} screenings without a KB (unknown tenant)")
+    print(f"   {'count':>7s}{str(report['coverage_days']) + 'd':>6s}  {'status':8s}{'level':>6s}{'faults':>7s}  cache")
+    for k in report["top"]:
+        state = "warmed" if k["warmed"] else ("hit" if k["cached"] else "-")
+        print(f"   {k['count']:7d}{k['recent']:6d}  {k['status']:8s}{k['target_level']:6d}{k['faults']:7d}  {state}")
+
+
+# ── IN-PROCESS SCHEDULE ──
+def seconds_until(at: str, now: Optional[datetime] = None) -> float:
+    """Seconds until the next local HH:MM."""
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def run_daily(at: str = WARM_AT):
+    """Started by main.lifespan when FMS_PLAN_WARM_AT is set; one worker per day wins the lease."""
+    while True:
+        await asyncio.sleep(seconds_until(at))
+        token = await shared_cache.acquire_lease(WARM_LEASE_KEY, WARM_MAX_S + 600)
+        if token is None:
+            print("🔥 Plan warmer: another worker is warming today, skipping")
+            continue
+        try:
+            print_report(await run_warmer())
+        except Exception as e:
+            print(f"⚠️ Plan warmer failed: {e}")
+        finally:
+            await shared_cache.release_lease(WARM_LEASE_KEY, token)
+
+
+async def main(args) -> Dict[str, Any]:
+    if shared_cache.l2() is None and not args.dry_run:
+        print("⚠️ WARNING: No shared cache (FMS_CACHE_BACKEND=none or unreachable); warmed plans would die with this process")
+        return {}
+    try:
+        report = await run_warmer(days=args.days, budget=args.budget, min_count=args.min_count, dry_run=args.dry_run)
+    finally:
+        await shared_cache.close()
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.report}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate plans for the most common screening outcomes.")
+    parser.add_argument("--days", type=int, default=WARM_DAYS)
+    parser.add_argument("--budget", type=int, default=WARM_LLM_BUDGET)
+    parser.add_argument("--min-count", type=int, default=WARM_MIN_COUNT)
+    parser.add_argument("--dry-run", action="store_true", help="Mine and report coverage, no LLM calls")
+    parser.add_argument("--report")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,356 @@
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.serialization import dumps
+from src.tracing import request_id
+
+# ── ON-DEMAND REQUEST PROFILING ──
+# A request carrying the admin token (header X-FMS-Profile or ?profile=) is
+# run under a sampling profiler. A background thread snapshots the event-loop
+# thread's stack every FMS_PROFILE_INTERVAL_MS and sorts each sample into one
+# of these buckets:
+#   request CPU      the loop is running one of this request's tasks (stack kept)
+#   [wait] llm       the loop is idle while the request waits on the LLM
+#   [wait] io        the loop is idle while it waits on the DB or other IO
+#   [event loop]     callbacks/transports, no task running
+#   [other tasks]    the loop is running someone else's task
+# "Its tasks" are the request's own task plus any task it creates (wait_for,
+# hedged calls). Bulk jobs adopt the session and profile every item.
+#
+# Without FMS_PROFILE_TOKEN the middleware is not installed; outside a session,
+# the waiting() marker costs one contextvar lookup.
+
+# --- CONFIGURATION ---
+PROFILE_TOKEN = os.getenv("FMS_PROFILE_TOKEN", "")  # empty: profiling disabled
+PROFILE_DIR = os.getenv("FMS_PROFILE_DIR", "logs/profiles")
+PROFILE_FORMAT = os.getenv("FMS_PROFILE_FORMAT", "speedscope")  # "speedscope", "collapsed" or "both"
+PROFILE_INTERVAL_MS = float(os.getenv("FMS_PROFILE_INTERVAL_MS", "1"))
+PROFILE_PATHS = tuple(p for p in os.getenv("FMS_PROFILE_PATHS", "/generate-workout,/jobs/generate-workout").split(",") if p)
+
+WAIT_LLM, WAIT_IO, LOOP, OTHER = "[wait] llm", "[wait] io", "[event loop]", "[other tasks]"
+
+_session: ContextVar[Optional["ProfileSession"]] = ContextVar("fms_profile_session", default=None)
+_active_lock = threading.Lock()
+_active: List["ProfileSession"] = []
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN)
+
+
+def token_matches(candidate: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and candidate is not None and hmac.compare_digest(candidate, PROFILE_TOKEN)
+
+
+@contextmanager
+def waiting(kind: str = "llm"):
+    """Marks an await as waiting on `kind` so idle loop samples are attributed to it."""
+    session = _session.get()
+    if session is None:
+        yield
+        return
+    session.waits[kind] += 1
+    try:
+        yield
+    finally:
+        session.waits[kind] -= 1
+
+
+def _frame_key(code) -> Tuple[str, str, int]:
+    return code.co_qualname, code.co_filename, code.co_firstlineno
+
+
+def _is_loop_entry(code) -> bool:
+    # asyncio.events.Handle._run: everything above it is event-loop plumbing
+    return code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py"))
+
+
+class ProfileSession:
+    def __init__(self, name: str, label: str, loop: asyncio.AbstractEventLoop):
+        self.name = name  # file name stem
+        self.label = label
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.waits: Counter = Counter()
+        self.stacks: Counter = Counter()  # tuple of frame keys (root..leaf) -> seconds
+        self.buckets: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.wall_s = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="fms-profiler", daemon=True)
+        self._switch_interval = sys.getswitchinterval()
+        self._previous_factory = None
+        self.finished = False
+        self.adopted = False
+
+    # ── lifecycle (event-loop thread) ──
+    def start(self):
+        self._previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        # The sampler needs the GIL to look at the loop thread; hand it over more often
+        sys.setswitchinterval(min(self._switch_interval, PROFILE_INTERVAL_MS / 2000))
+        self._thread.start()
+
+    def finish(self) -> Dict[str, Any]:
+        if self.finished:
+            return self.summary()
+        self.finished = True
+        self._stop.set()
+        self._thread.join()
+        self.wall_s = time.perf_counter() - self.started
+        sys.setswitchinterval(self._switch_interval)
+        if self.loop.get_task_factory() == self._task_factory:
+            self.loop.set_task_factory(self._previous_factory)
+        with _active_lock:
+            if self in _active:
+                _active.remove(self)
+        return self.summary()
+
+    @contextmanager
+    def attach(self):
+        """Counts the current task (and the tasks it creates) as part of this profile."""
+        task = asyncio.current_task()
+        if task is not None:
+            self.tasks.add(task)
+        token = _session.set(self)
+        try:
+            yield
+        finally:
+            _session.reset(token)
+            if task is not None:
+                self.tasks.discard(task)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        owner = context.get(_session) if context is not None else _session.get()
+        if owner is self:
+            self.tasks.add(task)
+        return task
+
+    # ── sampling (profiler thread) ──
+    def _sample_loop(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        current_tasks = asyncio.tasks._current_tasks
+        last = time.perf_counter()
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.loop_thread)
+            task = current_tasks.get(self.loop)
+            now = time.perf_counter()
+            self._record(frame, task, now - last)
+            last = now
+
+    def _record(self, frame, task, weight: float):
+        self.samples += 1
+        if task is None:
+            leaf = frame.f_code if frame is not None else None
+            idle = leaf is None or (leaf.co_name == "select" and leaf.co_filename.endswith("selectors.py"))
+            if idle:
+                bucket = WAIT_LLM if self.waits["llm"] > 0 else WAIT_IO
+            else:
+                bucket = LOOP
+            self.buckets[bucket] += weight
+            self.stacks[(bucket,)] += weight
+            return
+        if task not in self.tasks:
+            self.buckets[OTHER] += weight
+            self.stacks[(OTHER,)] += weight
+            return
+
+        stack = []
+        while frame is not None:
+            if _is_loop_entry(frame.f_code):
+                break
+            stack.append(_frame_key(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.buckets["cpu"] += weight
+        self.stacks[tuple(stack)] += weight
+
+    # ── output ──
+    def summary(self) -> Dict[str, Any]:
+        ms = {k: round(v * 1000, 2) for k, v in self.buckets.items()}
+        return {
+            "label": self.label,
+            "wall_ms": round(self.wall_s * 1000, 2),
+            "samples": self.samples,
+            "cpu_ms": ms.get("cpu", 0.0),
+            "llm_wait_ms": ms.get(WAIT_LLM, 0.0),
+            "io_wait_ms": ms.get(WAIT_IO, 0.0),
+            "event_loop_ms": ms.get(LOOP, 0.0),
+            "other_tasks_ms": ms.get(OTHER, 0.0),
+        }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format, values in microseconds (flamegraph.pl, speedscope, inferno)."""
+        lines = []
+        for stack, seconds in self.stacks.items():
+            names = [f if isinstance(f, str) else f"{f[0]} ({os.path.basename(f[1])}:{f[2]})" for f in stack]
+            lines.append(f"{';'.join(n.replace(';', ':') for n in names)} {max(1, round(seconds * 1e6))}")
+        return "\n".join(sorted(lines)) + "\n"
+
+    def speedscope(self) -> Dict[str, Any]:
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Any, int] = {}
+
+        def frame_id(f) -> int:
+            if f not in index:
+                index[f] = len(frames)
+                frames.append({"name": f} if isinstance(f, str) else {"name": f[0], "file": f[1], "line": f[2]})
+            return index[f]
+
+        samples, weights = [], []
+        for stack, seconds in self.stacks.items():
+            samples.append([frame_id(f) for f in stack])
+            weights.append(round(seconds * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.label,
+            "exporter": "src.profiling",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.label} ({self.summary()['cpu_ms']} ms CPU)",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def write(self, name: str, directory: str = PROFILE_DIR, fmt: str = PROFILE_FORMAT) -> List[str]:
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        if fmt in ("speedscope", "both"):
+            paths.append(os.path.join(directory, f"{name}.speedscope.json"))
+            with open(paths[-1], 'wb') as f:
+                f.write(dumps(self.speedscope()))
+        if fmt in ("collapsed", "both"):
+            paths.append(os.path.join(directory, f"{name}.collapsed.txt"))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(self.collapsed())
+        return paths
+
+
+def start_session(name: str, label: str) -> Optional[ProfileSession]:
+    """One session at a time per process (the task factory and sampler are loop-wide)."""
+    with _active_lock:
+        if _active:
+            return None
+        session = ProfileSession(name, label, asyncio.get_running_loop())
+        _active.append(session)
+    session.start()
+    return session
+
+
+def finish_and_write(session: ProfileSession) -> Tuple[Dict[str, Any], List[str]]:
+    summary = session.finish()
+    paths = session.write(session.name)
+    print(f"🔬 PROFILE [{session.name}] wall {summary['wall_ms']} ms | CPU {summary['cpu_ms']} | "
+          f"LLM wait {summary['llm_wait_ms']} | IO wait {summary['io_wait_ms']} | "
+          f"loop {summary['event_loop_ms']} | other tasks {summary['other_tasks_ms']} → {', '.join(paths)}")
+    return summary, paths
+
+
+def adopt_session() -> Optional[ProfileSession]:
+    """
+    Takes over the current request's session (bulk jobs): the middleware stops
+    sampling the request and the caller finishes the session itself.
+    """
+    session = _session.get()
+    if session is not None:
+        session.adopted = True
+    return session
+
+
+def server_timing(summary: Dict[str, Any]) -> str:
+    return (f"cpu;dur={summary['cpu_ms']}, llm;dur={summary['llm_wait_ms']}, io;dur={summary['io_wait_ms']}, "
+            f"loop;dur={summary['event_loop_ms']}, other;dur={summary['other_tasks_ms']}")
+
+
+# ── ASGI MIDDLEWARE ──
+def _query_token(query_string: bytes) -> Optional[str]:
+    for pair in query_string.decode('latin-1').split("&"):
+        key, _, value = pair.partition("=")
+        if key == "profile":
+            return value
+    return None
+
+
+class ProfileMiddleware:
+    """
+    Installed only when FMS_PROFILE_TOKEN is set. Profiles requests to
+    FMS_PROFILE_PATHS that carry the token and reports the breakdown in a
+    Server-Timing header; the profile file name is in X-Profile-Path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PROFILE_PATHS:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        candidate = headers.get(b"x-fms-profile")
+        candidate = candidate.decode('latin-1') if candidate is not None else _query_token(scope.get("query_string", b""))
+        if not token_matches(candidate):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request_id()}"
+        session = start_session(name, f"{scope['method']} {scope['path']} [{request_id()}]")
+        if session is None:
+            await self._run_unprofiled(scope, receive, send, b"busy")
+            return
+
+        # Headers go out before the body; buffer the start message so the
+        # breakdown can ride on it (these endpoints return one JSON body)
+        pending: List[Dict[str, Any]] = []
+
+        async def buffered_send(message):
+            if message["type"] == "http.response.start":
+                pending.append(message)
+                return
+            if pending and not session.finished:
+                if session.adopted:
+                    headers = [(b"x-profile-path", f"{name} (written when the job completes)".encode('latin-1'))]
+                else:
+                    summary, paths = finish_and_write(session)
+                    headers = [(b"server-timing", server_timing(summary).encode('latin-1')),
+                               (b"x-profile-path", ", ".join(os.path.basename(p) for p in paths).encode('latin-1'))]
+                start = pending.pop()
+                start["headers"] = [*start.get("headers", []), *headers]
+                await send(start)
+            elif pending:
+                await send(pending.pop())
+            await send(message)
+
+        try:
+            with session.attach():
+                await self.app(scope, receive, buffered_send)
+        finally:
+            if not session.adopted and not session.finished:
+                finish_and_write(session)
+
+    async def _run_unprofiled(self, scope, receive, send, reason: bytes):
+        async def send_with_reason(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile", reason)]
+            await send(message)
+        await self.app(scope, receive, send_with_reason)
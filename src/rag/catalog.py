@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, Any, List, Optional, Iterable
+
+from sqlalchemy import select, delete, update, insert, func, case, and_, type_coerce, String, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import AsyncSessionLocal, Exercise, ExerciseTag, ExerciseReach, CatalogVersion
+from src.rag.knowledge_base import (KnowledgeBase, CatalogKnowledgeBase, KB_SOURCE, JSON_KB_PATH,
+                                    serve_catalog_kb, served_catalog_kb)
+from src.rag.progression import progression_reach
+from src.serialization import dumps, loads
+
+# Usage: python -m src.rag.catalog --import data/processed/exercise_knowledge_base.json [--tenant gym42]
+#        python -m src.rag.catalog --upsert edited_exercises.json [--tenant gym42]   merge by id
+#        python -m src.rag.catalog --rebuild [--tenant gym42]    re-derive tags/reach after hand edits of `data`
+#        python -m src.rag.catalog --stats
+#        python -m src.rag.catalog --search fix_heels_lift,pattern_squat [--level 3]
+#
+# Optional database-backed exercise library (FMS_KB_SOURCE=db). Every write
+# replaces the catalog's derived rows and bumps catalog_versions.version in one
+# transaction. Workers compare that counter at most every FMS_CATALOG_POLL_S
+# and reload the catalog when it moved: the new KB has a new version, so the
+# retrieval caches (and plan cache keys) keyed on it roll over by themselves.
+#
+# Retrieval keeps the in-process ranking cache. With FMS_CATALOG_RANK_IN_DB=1
+# a miss runs the ranking as one indexed query (rank_in_catalog): candidates by
+# (catalog, target_level) from exercise_reach, tag overlap counted through
+# exercise_tags' primary key. Off by default: against SQLite the round trip
+# costs more than the in-memory scan (python -m benchmarks.exercise_catalog).
+
+# --- CONFIGURATION ---
+CATALOG_POLL_S = float(os.getenv("FMS_CATALOG_POLL_S", "5"))
+RANK_IN_DB = os.getenv("FMS_CATALOG_RANK_IN_DB", "0") == "1"
+# exercise_reach holds candidates up to this many progression links away;
+# FMS_RETRIEVAL_HOPS above it ranks in memory instead
+MAX_REACH_HOPS = 3
+FIX_BOOST = 5  # same boost as rank_exercises for a matched fix_ tag
+CHECKED_MAX = 10000
+SHARED_CATALOG = ""
+
+_checked: Dict[str, float] = {}  # catalog -> monotonic time its counter was last read
+
+
+def catalog_name(tenant: Optional[str]) -> str:
+    return tenant or SHARED_CATALOG
+
+
+def normalized_tags(exercise: Dict[str, Any]) -> List[str]:
+    return sorted({str(t).lower() for t in exercise.get('tags', [])})
+
+
+# ── WRITE ──
+async def save_catalog(db: AsyncSession, exercises: List[Dict[str, Any]], catalog: str = SHARED_CATALOG) -> int:
+    """
+    Makes `exercises` (in this order) the catalog's full content: upserts the
+    exercise rows, deletes the ones not listed, re-derives tags and reach and
+    bumps the version. Runs in the caller's transaction; returns the new version.
+    """
+    kb = KnowledgeBase(exercises, version="pending")
+    rows = [{"catalog": catalog, "id": ex["id"], "position": i, "difficulty_level": int(ex.get('difficulty_level', 1)),
+             "tags": normalized_tags(ex), "data": ex} for i, ex in enumerate(exercises)]
+    table = Exercise.__table__
+    dialect = db.bind.dialect.name
+
+    if rows and dialect in ("postgresql", "sqlite"):
+        module = postgresql if dialect == "postgresql" else sqlite
+        stmt = module.insert(table)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["catalog", "id"],
+            set_={c: stmt.excluded[c] for c in ("position", "difficulty_level", "tags", "data")} | {"updated_at": func.now()}
+        ), rows)
+        await db.execute(delete(table).where(table.c.catalog == catalog, table.c.id.not_in([r["id"] for r in rows])))
+    else:
+        await db.execute(delete(table).where(table.c.catalog == catalog))
+        if rows:
+            await db.execute(insert(table), rows)
+
+    # Derived rows: rewritten whole, they are a function of the exercise list
+    await db.execute(delete(ExerciseTag).where(ExerciseTag.catalog == catalog))
+    await db.execute(delete(ExerciseReach).where(ExerciseReach.catalog == catalog))
+    tag_rows = [{"catalog": catalog, "exercise_id": r["id"], "tag": tag, "difficulty_level": r["difficulty_level"]}
+                for r in rows for tag in r["tags"]]
+    if tag_rows:
+        await db.execute(insert(ExerciseTag), tag_rows)
+    reach_rows = [{"catalog": catalog, "target_level": level, "exercise_id": rows[i]["id"], "hops": hops, "position": i}
+                  for level in range(0, max(kb.by_level, default=0) + 1)
+                  for i, hops in progression_reach(kb.level_rows(level), kb.row_neighbors, MAX_REACH_HOPS).items()]
+    if reach_rows:
+        await db.execute(insert(ExerciseReach), reach_rows)
+
+    version = (await db.execute(
+        select(CatalogVersion.version).where(CatalogVersion.catalog == catalog).with_for_update()
+    )).scalar_one_or_none()
+    if version is None:
+        version = 1
+        db.add(CatalogVersion(catalog=catalog, version=version))
+    else:
+        version += 1
+        await db.execute(update(CatalogVersion).where(CatalogVersion.catalog == catalog)
+                         .values(version=version, updated_at=func.now()))
+    return version
+
+
+async def analyze_catalog(db: AsyncSession):
+    # Fresh planner statistics after a bulk write (an empty-stats SQLite file
+    # picks the primary key over the level/tag index for tag search)
+    for table in (Exercise, ExerciseTag, ExerciseReach):
+        await db.execute(text(f"ANALYZE {table.__tablename__}"))
+    await db.commit()
+
+
+async def catalog_exercises(db: AsyncSession, catalog: str) -> List[Dict[str, Any]]:
+    rows = (await db.execute(
+        select(Exercise.data).where(Exercise.catalog == catalog).order_by(Exercise.position)
+    )).scalars().all()
+    return list(rows)
+
+
+async def import_catalog(exercises: List[Dict[str, Any]], tenant: Optional[str] = None, merge: bool = False) -> int:
+    """Writes a JSON-KB-shaped list into the catalog; with `merge`, by id into the existing list."""
+    catalog = catalog_name(tenant)
+    async with AsyncSessionLocal() as db:
+        if merge:
+            current = await catalog_exercises(db, catalog)
+            index = {ex["id"]: i for i, ex in enumerate(current)}
+            for ex in exercises:
+                if ex["id"] in index:
+                    current[index[ex["id"]]] = ex
+                else:
+                    index[ex["id"]] = len(current)
+                    current.append(ex)
+            exercises = current
+        version = await save_catalog(db, exercises, catalog)
+        await db.commit()
+        await analyze_catalog(db)
+    print(f"✅ Catalog '{catalog or 'default'}': {len(exercises)} exercises, version {version}")
+    return version
+
+
+# ── READ / RELOAD ──
+async def read_catalog(db: AsyncSession, catalog: str) -> Optional[CatalogKnowledgeBase]:
+    counter = (await db.execute(
+        select(CatalogVersion.version).where(CatalogVersion.catalog == catalog)
+    )).scalar_one_or_none()
+    if counter is None:
+        return None
+    exercises = await catalog_exercises(db, catalog)
+    content_hash = hashlib.sha1(dumps(exercises)).hexdigest()
+    return CatalogKnowledgeBase(exercises, catalog=catalog, counter=counter, content_hash=content_hash)
+
+
+async def refresh_catalog(tenant: Optional[str] = None, force: bool = False) -> Optional[CatalogKnowledgeBase]:
+    """
+    The catalog KB to serve for `tenant`, reloaded if its version counter moved.
+    Reads the counter (a primary-key lookup) at most every CATALOG_POLL_S per
+    catalog; None when the catalog has no rows (its file, if any, is served).
+    """
+    catalog = catalog_name(tenant)
+    current = served_catalog_kb(catalog)
+    now = time.monotonic()
+    if not force and now - _checked.get(catalog, float("-inf")) < CATALOG_POLL_S:
+        return current
+    if len(_checked) > CHECKED_MAX:
+        _checked.clear()
+    _checked[catalog] = now  # before the await: concurrent requests keep using `current`
+
+    try:
+        async with AsyncSessionLocal() as db:
+            counter = (await db.execute(
+                select(CatalogVersion.version).where(CatalogVersion.catalog == catalog)
+            )).scalar_one_or_none()
+            if current is not None and counter == current.counter:
+                return current
+            kb = await read_catalog(db, catalog) if counter is not None else None
+    except Exception as e:
+        print(f"⚠️ Catalog '{catalog or 'default'}' check failed ({e}); serving what is loaded")
+        return current
+
+    serve_catalog_kb(catalog, kb)
+    if kb is not None:
+        print(f"📚 Catalog '{catalog or 'default'}' {'reloaded' if current else 'loaded'}: {len(kb)} exercises, "
+              f"version {kb.version}")
+    elif current is not None:
+        print(f"📚 Catalog '{catalog or 'default'}' removed; serving its file again")
+    return kb
+
+
+async def refresh_catalogs(tenants: Iterable[Optional[str]]):
+    """For batch callers that rank synchronously afterwards (plan index / warmer)."""
+    if KB_SOURCE != "db":
+        return
+    for tenant in {catalog_name(t) for t in tenants}:
+        await refresh_catalog(tenant or None)
+
+
+# ── RANKING PUSHDOWN ──
+def rank_query(kb: CatalogKnowledgeBase, target_level: int, search_tags: Iterable[str],
+               hops: int, hop_penalty: float, top_k: int):
+    """
+    rank_exercises as one query: candidates from exercise_reach, matched tags
+    via exercise_tags, fix_ boost, hop penalty, ties by hops then KB order.
+    Joining catalog_versions on the KB's counter makes a concurrent edit
+    return no rows rather than rows the KB does not have.
+    """
+    tags = sorted(search_tags)
+    fix_tags = [t for t in tags if "fix_" in t]
+    r, t, v = ExerciseReach.__table__, ExerciseTag.__table__, CatalogVersion.__table__
+    matched = func.count(t.c.tag)
+    boost = FIX_BOOST * func.max(case((t.c.tag.in_(fix_tags), 1), else_=0)) if fix_tags else 0
+    score = (matched + boost - hop_penalty * r.c.hops).label("score")
+    return (
+        select(r.c.exercise_id, score)
+        .select_from(
+            r.join(v, and_(v.c.catalog == r.c.catalog, v.c.version == kb.counter))
+            .outerjoin(t, and_(t.c.catalog == r.c.catalog, t.c.exercise_id == r.c.exercise_id, t.c.tag.in_(tags)))
+        )
+        .where(r.c.catalog == kb.catalog, r.c.target_level == target_level, r.c.hops <= hops)
+        .group_by(r.c.exercise_id, r.c.hops, r.c.position)
+        .order_by(score.desc(), r.c.hops, r.c.position)
+        .limit(top_k)
+    )
+
+
+async def rank_in_catalog(kb: CatalogKnowledgeBase, target_level: int, search_tags: Iterable[str],
+                          hops: int, hop_penalty: float, top_k: int) -> Optional[List[Dict[str, Any]]]:
+    """Top-k exercise dicts from the database, or None when the caller should rank in memory."""
+    if not RANK_IN_DB or hops > MAX_REACH_HOPS:
+        return None
+    async with AsyncSessionLocal() as db:
+        ids = (await db.execute(rank_query(kb, target_level, search_tags, hops, hop_penalty, top_k))).scalars().all()
+    rows = [kb.row_by_id.get(i) for i in ids]
+    if (not ids and kb.level_rows(target_level)) or None in rows:
+        return None  # catalog changed since this KB was read; the next poll reloads it
+    return [kb.exercise(i) for i in rows]
+
+
+# ── TAG SEARCH ──
+def search_query(tags: Iterable[str], level: Optional[int] = None, catalog: str = SHARED_CATALOG,
+                 limit: int = 50, dialect: str = "sqlite"):
+    """Exercises carrying any of `tags`, most matches first: the GIN index on Postgres, the tag index elsewhere."""
+    tags = sorted({t.lower() for t in tags})
+    if dialect == "postgresql":
+        tag_array = type_coerce(Exercise.tags, postgresql.ARRAY(String(64)))  # JSON elsewhere
+        unnested = func.unnest(tag_array).table_valued("tag").render_derived()
+        matched = (select(func.count()).select_from(unnested)
+                   .where(unnested.c.tag.in_(tags)).scalar_subquery().label("matched"))
+        stmt = (select(Exercise.data, matched)
+                .where(Exercise.catalog == catalog, tag_array.overlap(postgresql.array(tags))))
+        if level is not None:
+            stmt = stmt.where(Exercise.difficulty_level == level)
+    else:
+        t = ExerciseTag.__table__
+        counted = (select(t.c.exercise_id, func.count().label("matched"))
+                   .where(t.c.catalog == catalog, t.c.tag.in_(tags)))
+        if level is not None:
+            counted = counted.where(t.c.difficulty_level == level)
+        counted = counted.group_by(t.c.exercise_id).subquery()
+        matched = counted.c.matched
+        stmt = (select(Exercise.data, matched)
+                .join(counted, and_(Exercise.catalog == catalog, Exercise.id == counted.c.exercise_id)))
+    return stmt.order_by(matched.desc(), Exercise.position).limit(limit)
+
+
+async def search_catalog(db: AsyncSession, tags: List[str], level: Optional[int] = None,
+                         catalog: str = SHARED_CATALOG, limit: int = 50) -> List[Dict[str, Any]]:
+    rows = (await db.execute(search_query(tags, level, catalog, limit, db.bind.dialect.name))).all()
+    return [{**row.data, "matched_tags": row.matched} for row in rows]
+
+
+async def catalog_stats() -> List[Dict[str, Any]]:
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(CatalogVersion.catalog, CatalogVersion.version, CatalogVersion.updated_at,
+                   select(func.count()).where(Exercise.catalog == CatalogVersion.catalog).scalar_subquery(),
+                   select(func.count()).where(ExerciseTag.catalog == CatalogVersion.catalog).scalar_subquery())
+            .order_by(CatalogVersion.catalog)
+        )).all()
+    return [{"catalog": c or "default", "version": v, "updated_at": u, "exercises": n, "tags": nt}
+            for c, v, u, n, nt in rows]
+
+
+async def main(args):
+    if args.import_path or args.upsert:
+        with open(args.import_path or args.upsert, 'rb') as f:
+            await import_catalog(loads(f.read()), tenant=args.tenant, merge=bool(args.upsert))
+    if args.rebuild:
+        catalog = catalog_name(args.tenant)
+        async with AsyncSessionLocal() as db:
+            exercises = await catalog_exercises(db, catalog)
+            version = await save_catalog(db, exercises, catalog)
+            await db.commit()
+            await analyze_catalog(db)
+        print(f"✅ Catalog '{catalog or 'default'}' rebuilt: {len(exercises)} exercises, version {version}")
+    if args.search:
+        async with AsyncSessionLocal() as db:
+            found = await search_catalog(db, args.search.split(","), level=args.level, catalog=catalog_name(args.tenant))
+        print(f"🔎 {len(found)} exercises")
+        for ex in found:
+            print(f"   {ex['matched_tags']}  L{ex.get('difficulty_level')}  {ex.get('exercise_name')}")
+    if args.stats:
+        for row in await catalog_stats():
+            print(f"📚 {row['catalog']:16s} version {row['version']:<5d} {row['exercises']:>6,} exercises "
+                  f"{row['tags']:>7,} tags  updated {row['updated_at']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database-backed exercise catalog.")
+    parser.add_argument("--import", dest="import_path", help=f"Replace the catalog with a JSON KB (e.g. {JSON_KB_PATH})")
+    parser.add_argument("--upsert", help="Merge exercises from a JSON list into the catalog by id")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--search")
+    parser.add_argument("--level", type=int)
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--tenant")
+    asyncio.run(main(parser.parse_args()))
@@ -1,14 +1,46 @@
 import os
-import uuid
-from typing import List, Dict, Any
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+import time
+import asyncio
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
+from src.rag.resilience import Deadline, CircuitBreaker, LatencyTracker, StageLimiter, hedged_call
+from src.rag.llm_stub import StubPlanChain
+from src.tracing import traced, span, current_span, request_id, KIND_CLIENT
+from src.profiling import waiting
+
 load_dotenv()
 
+# ── LLM RESILIENCE CONFIG ──
+LLM_BACKEND = os.getenv("FMS_LLM_BACKEND", "groq")  # "groq" or "stub"
+LLM_RESERVE_S = float(os.getenv("FMS_LLM_RESERVE_S", "1.0"))  # budget kept back for saving/returning
+LLM_MIN_TIMEOUT_S = float(os.getenv("FMS_LLM_MIN_TIMEOUT_S", "0.5"))  # below this, skip the call
+HEDGE_ENABLED = os.getenv("FMS_LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("FMS_LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("FMS_LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_MODEL = "llama-3.3-70b-versatile"
+# Bump when the prompt template or model settings change: cached plans are keyed on it
+PROMPT_VERSION = "prompt-v1"
+# Identifies the plan generator in plan cache keys (shared cache, eval cache)
+GENERATOR_ID = f"{LLM_BACKEND}:{LLM_MODEL}:{PROMPT_VERSION}"
+
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("FMS_BREAKER_FAILURES", "5")),
+    reset_timeout_s=float(os.getenv("FMS_BREAKER_RESET_S", "30")),
+    half_open_max_calls=int(os.getenv("FMS_BREAKER_HALF_OPEN_CALLS", "1")),
+)
+llm_latency = LatencyTracker()
+
+# Admission for interactive /generate-workout LLM calls (bulk jobs have their own
+# semaphore + token bucket in src/jobs.py). FMS_ADMIT_LLM_CONCURRENCY=0 disables it.
+llm_admission = StageLimiter(
+    "llm",
+    limit=int(os.getenv("FMS_ADMIT_LLM_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("FMS_ADMIT_LLM_QUEUE", "32")),
+    max_wait_s=float(os.getenv("FMS_ADMIT_LLM_MAX_WAIT_S", "5")),
+)
+
 # ── UI OUTPUT SCHEMA ──
 class ExerciseCard(BaseModel):
     name: str = Field(description="Exact exercise name from database")
@@ -59,15 +91,135 @@ def format_faults_for_prompt(full_data: Dict[str, Any]) -> str:
 
     return "\n".join(fault_summary) if fault_summary else "No severe faults detected."
 
+# ── DETERMINISTIC FALLBACK ──
+def build_fallback_plan(exercises: List[Dict[str, Any]], reason: str) -> Dict[str, Any]:
+    return {
+        "session_title": "Workout Generated (Fallback)",
+        "coach_summary": "AI coach encountered an issue. Here's a basic plan based on retrieved exercises.",
+        "difficulty_color": "Yellow",
+        "fallback_reason": reason,
+        "exercises": [
+            {
+                "name": ex.get('exercise_name', 'Exercise'),
+                "tag": "CORRECTIVE",
+                "sets_reps": "3 x 10",
+                "tempo": "Controlled",
+                "coach_tip": "Focus on perfect form."
+            }
+            for ex in exercises[:3]
+        ]
+    }
+
+# ── LAZY LLM STACK ──
+# langchain_groq / langchain_core are the slowest imports on the serving path,
+# so they are only imported when a chain is first built (or by the background
+# warmup started in main.lifespan once the server is accepting connections).
+def preload_llm_stack():
+    if LLM_BACKEND == "stub":
+        return
+    import langchain_groq  # noqa: F401
+    import langchain_core.prompts  # noqa: F401
+    import langchain_core.output_parsers  # noqa: F401
+
+# ── CHAIN FACTORY ──
+# The Groq chain has no per-request state, so one instance per API key is
+# reused; that keeps its HTTP connection pool (and TLS session) warm.
+_groq_chains: Dict[str, Any] = {}
+
+def build_chain(api_key: Optional[str], exercises: List[Dict[str, Any]]):
+    if LLM_BACKEND == "stub":
+        return StubPlanChain(exercises)
+    return get_groq_chain(api_key)[0]
+
+def get_groq_chain(api_key: str):
+    """Returns (chain, llm) for this key, building it on first use."""
+    if api_key in _groq_chains:
+        return _groq_chains[api_key]
+
+    from langchain_groq import ChatGroq
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+
+    llm = ChatGroq(
+        model_name=LLM_MODEL,
+        temperature=0.0,
+        api_key=api_key,
+        model_kwargs={"seed": 42}
+    )
+    parser = JsonOutputParser(pydantic_object=WorkoutSession)
+
+    # Enhanced prompt
+    system_prompt = """
+    You are an expert FMS Strength Coach. Create a corrective workout plan.
+
+    ### ATHLETE DATA
+    - Status: {status}
+    - Target Level: {level}
+    - Key Faults: 
+    {faults_text}
+
+    ### AVAILABLE EXERCISES (STRICT CONSTRAINT)
+    Use ONLY exercises from this list. Do NOT invent new ones.
+    Prioritize ones that best match the specific faults shown above.
+    {exercise_list}
+
+    ### INSTRUCTIONS
+    1. Select 3 top most relevant exercises that address the key faults.
+    2. Create short, specific 'coach_tip' cues mentioning the actual fault.
+    3. Set difficulty_color: Red if severe faults, Yellow if moderate, Green if minor/cleared.
+    4. Return valid JSON matching the schema exactly.
+
+    {format_instructions}
+    """
+
+    prompt = ChatPromptTemplate.from_template(
+        template=system_prompt,
+        partial_variables={"format_instructions": parser.get_format_instructions()}
+    )
+
+    _groq_chains[api_key] = (prompt | llm | parser, llm)
+    return _groq_chains[api_key]
+
+async def prime_llm_connection(timeout_s: float = 5.0) -> bool:
+    """
+    Builds the shared Groq client and makes one cheap call (list models) so the
+    DNS lookup and TLS handshake happen before the first real request.
+    """
+    if LLM_BACKEND == "stub":
+        return True
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        return False
+
+    _, llm = await asyncio.to_thread(get_groq_chain, api_key)
+    # ChatGroq exposes the resource; its parent AsyncGroq owns the connection pool.
+    # That parent link is private to the SDKs: if a release drops it, skip priming
+    # (the first request pays the handshake) rather than failing warmup
+    try:
+        list_models = llm.async_client._client.models.list
+    except AttributeError:
+        print("⚠️ WARNING: LLM connection priming skipped: this groq/langchain-groq version has no async_client._client")
+        return False
+    await asyncio.wait_for(list_models(), timeout=timeout_s)
+    return True
+
 # ── MAIN GENERATOR FUNCTION ──
-def generate_workout_plan(analysis_context: Dict[str, Any], exercises: List[Dict[str, Any]]):
-    call_id = str(uuid.uuid4())[:8]
+@traced("generate", result_attributes=lambda plan: {"plan.exercises": len(plan.get("exercises", [])),
+                                                     "plan.fallback_reason": plan.get("fallback_reason")})
+async def generate_workout_plan(
+    analysis_context: Dict[str, Any],
+    exercises: List[Dict[str, Any]],
+    deadline: Optional[Deadline] = None
+):
+    call_id = request_id()
     print(f"--- GENERATE CALL START [{call_id}] | received {len(exercises)} items ---")
+    current_span().set(**{"llm.backend": LLM_BACKEND, "generate.candidates": len(exercises)})
 
     api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
+    if not api_key and LLM_BACKEND != "stub":
         print(f"❌ Error [{call_id}]: GROQ_API_KEY is missing.")
-        return {"session_title": "Config Error", "coach_summary": "System configuration error (API Key).", "exercises": []}
+        # A fallback like the others, so it is never cached, fingerprinted or reused
+        return build_fallback_plan([ex for ex in exercises if isinstance(ex, dict)], "config_error")
 
     # REMOVED: The strict "Medical Referral Required" return block.
     # The code now proceeds to generate a workout even if status was "STOP".
@@ -80,9 +232,11 @@ def generate_workout_plan(analysis_context: Dict[str, Any], exercises: List[Dict
             "exercises": []
         }
 
+    deadline = deadline or Deadline()
+    valid_exercises = []
+
     try:
         # ── ROBUST FILTERING & SORTING ───────────────────────────────────────
-        valid_exercises = []
         for item in exercises:
             if not isinstance(item, dict):
                 print(f"WARNING [{call_id}]: Skipping invalid item (not dict): {item}")
@@ -110,54 +264,58 @@ def generate_workout_plan(analysis_context: Dict[str, Any], exercises: List[Dict
         # Format faults
         faults_text = format_faults_for_prompt(analysis_context.get('detailed_faults', {}))
 
-        # Setup LLM
-        llm = ChatGroq(
-            model_name="llama-3.3-70b-versatile",
-            temperature=0.0,
-            api_key=api_key,
-            model_kwargs={"seed": 42}
-        )
-        parser = JsonOutputParser(pydantic_object=WorkoutSession)
-
-        # Enhanced prompt
-        system_prompt = """
-        You are an expert FMS Strength Coach. Create a corrective workout plan.
-
-        ### ATHLETE DATA
-        - Status: {status}
-        - Target Level: {level}
-        - Key Faults: 
-        {faults_text}
-
-        ### AVAILABLE EXERCISES (STRICT CONSTRAINT)
-        Use ONLY exercises from this list. Do NOT invent new ones.
-        Prioritize ones that best match the specific faults shown above.
-        {exercise_list}
-
-        ### INSTRUCTIONS
-        1. Select 3 top most relevant exercises that address the key faults.
-        2. Create short, specific 'coach_tip' cues mentioning the actual fault.
-        3. Set difficulty_color: Red if severe faults, Yellow if moderate, Green if minor/cleared.
-        4. Return valid JSON matching the schema exactly.
-
-        {format_instructions}
-        """
-
-        prompt = ChatPromptTemplate.from_template(
-            template=system_prompt,
-            partial_variables={"format_instructions": parser.get_format_instructions()}
-        )
-
-        chain = prompt | llm | parser
-
-        # Invoke
-        response = chain.invoke({
+        # ── RESILIENCE GATES ──
+        timeout_s = deadline.remaining() - LLM_RESERVE_S
+        if timeout_s < LLM_MIN_TIMEOUT_S:
+            print(f"--- GENERATE CALL END [{call_id}] | budget exhausted ({deadline.remaining():.2f}s left) → fallback ---")
+            return build_fallback_plan(valid_exercises, "budget_exhausted")
+
+        chain = build_chain(api_key, valid_exercises)
+        chain_inputs = {
             # We pass the status, but the LLM will now generate a workout instead of hard-stopping
             "status": analysis_context.get('status', 'TRAINING'),
             "level": str(analysis_context.get('target_level', 1)),
             "faults_text": faults_text,
             "exercise_list": exercise_text
-        })
+        }
+
+        hedge_after_s = None
+        if HEDGE_ENABLED and len(llm_latency.samples) >= HEDGE_MIN_SAMPLES:
+            hedge_after_s = llm_latency.percentile(HEDGE_PERCENTILE)
+
+        # Nothing between taking a half-open probe slot and the call below may fail
+        if not llm_breaker.allow_request():
+            print(f"--- GENERATE CALL END [{call_id}] | circuit {llm_breaker.state} → fallback ---")
+            return build_fallback_plan(valid_exercises, "circuit_open")
+
+        # Invoke (cancelled when the budget runs out)
+        prompt_chars = sum(len(v) for v in chain_inputs.values())
+        started = time.monotonic()
+        try:
+            with span("llm.invoke", KIND_CLIENT, **{"llm.timeout_s": round(timeout_s, 3),
+                                                    "llm.hedge_after_s": hedge_after_s,
+                                                    "llm.prompt_chars": prompt_chars,
+                                                    # ~4 characters per token; the parsed response carries no usage
+                                                    "llm.prompt_tokens_est": prompt_chars // 4}):
+                with waiting("llm"):
+                    response = await asyncio.wait_for(
+                        hedged_call(lambda: chain.ainvoke(chain_inputs), hedge_after_s, deadline),
+                        timeout=timeout_s
+                    )
+        except asyncio.TimeoutError:
+            llm_breaker.record_failure()
+            print(f"--- GENERATE CALL END [{call_id}] | LLM exceeded {timeout_s:.2f}s budget → fallback ---")
+            return build_fallback_plan(valid_exercises, "deadline_exceeded")
+        except asyncio.CancelledError:
+            # The caller went away: no verdict on the LLM, but hand back a half-open probe slot
+            llm_breaker.release()
+            raise
+        except Exception:
+            llm_breaker.record_failure()
+            raise
+
+        llm_breaker.record_success()
+        llm_latency.record(time.monotonic() - started)
 
         # Fallback for missing fields
         if 'difficulty_color' not in response:
@@ -169,18 +327,4 @@ def generate_workout_plan(analysis_context: Dict[str, Any], exercises: List[Dict
     except Exception as e:
         print(f"❌ GENERATION ERROR [{call_id}]: {str(e)}")
         # Safe fallback
-        return {
-            "session_title": "Workout Generated (Fallback)",
-            "coach_summary": "AI coach encountered an issue. Here's a basic plan based on retrieved exercises.",
-            "difficulty_color": "Yellow",
-            "exercises": [
-                {
-                    "name": ex.get('exercise_name', 'Exercise'),
-                    "tag": "CORRECTIVE",
-                    "sets_reps": "3 x 10",
-                    "tempo": "Controlled",
-                    "coach_tip": "Focus on perfect form."
-                }
-                for ex in valid_exercises[:3]
-            ]
-        }
\ No newline at end of file
+        return build_fallback_plan(valid_exercises, "llm_error")
@@ -0,0 +1,281 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Any, List, FrozenSet
+
+from src.rag.progression import stored_links
+from src.serialization import dumps, dumps_str, loads
+
+# ── READ-ONLY BINARY KB SNAPSHOT ──
+# Layout (little-endian, sections 8-byte aligned):
+#
+#   magic "FMSKBS01" | uint32 section_count | directory of (8-byte name, uint64 offset, uint64 length)
+#
+#   STROFFS  uint32[n_strings + 1]   offsets into STRDATA (deduplicated string table)
+#   STRDATA  utf-8 bytes
+#   COL_ID, COL_NAME, COL_CAT,       uint32[n] string ids, one column per field
+#   COL_DESC, COL_SRC, COL_XTRA
+#   COL_LVL  int32[n]                difficulty_level
+#   COL_POS  uint32[n]               row's position in the source KB (ranking ties follow it)
+#   TAGSTART uint32[n + 1]           row i's tags are TAGIDS[TAGSTART[i]:TAGSTART[i+1]]
+#   TAGIDS   uint32[...]             string ids
+#   LEVELS   int32[3 * n_levels]     (level, first_row, end_row); rows are sorted by level
+#   REGSTART uint32[n + 1]           progression graph in the same CSR layout as tags:
+#   REGROWS  uint32[...]             row i's regressions are REGROWS[REGSTART[i]:REGSTART[i+1]],
+#   PROSTART uint32[n + 1]           its progressions PROROWS[PROSTART[i]:PROSTART[i+1]]
+#   PROROWS  uint32[...]             (snapshot row numbers, not ids)
+#   META     utf-8 JSON              {"version", "source", "count", "links"}
+#
+# Every worker mmaps the same file, so the page cache holds one copy of the KB
+# no matter how many processes serve it. Only a few small dicts (tag names,
+# level ranges, level vocabularies) are built per process.
+
+MAGIC = b"FMSKBS01"
+SNAPSHOT_PATH = 'data/processed/exercise_knowledge_base.kbs'
+
+STRING_COLUMNS = [
+    ("COL_ID", "id"),
+    ("COL_NAME", "exercise_name"),
+    ("COL_CAT", "category"),
+    ("COL_DESC", "description"),
+    ("COL_SRC", "description_source"),
+]
+KNOWN_FIELDS = {field for _, field in STRING_COLUMNS} | {"difficulty_level", "tags", "regressions", "progressions"}
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+def _pad8(buf: bytearray):
+    buf.extend(b"\0" * (-len(buf) % 8))
+
+
+def write_snapshot(exercises: List[Dict[str, Any]], path: str, version: str, source: str = "") -> int:
+    """Writes the snapshot atomically (tmp file + rename) and returns its size in bytes."""
+    strings: Dict[str, int] = {}
+
+    def sid(value: Any) -> int:
+        text = "" if value is None else str(value)
+        if text not in strings:
+            strings[text] = len(strings)
+        return strings[text]
+
+    # Stable sort by level keeps the KB order inside a level (ranking ties depend on it)
+    order = sorted(range(len(exercises)), key=lambda i: (exercises[i].get('difficulty_level', 1), i))
+    row_of = {i: row for row, i in enumerate(order)}
+    links = stored_links(exercises)
+    has_links = any("progressions" in ex or "regressions" in ex for ex in exercises)
+
+    columns = {name: array('I') for name, _ in STRING_COLUMNS}
+    columns["COL_XTRA"] = array('I')
+    levels = array('i')
+    positions = array('I', order)
+    tag_start = array('I', [0])
+    tag_ids = array('I')
+    graph = {name: array('I', [0]) if name.endswith("START") else array('I')
+             for name in ("REGSTART", "REGROWS", "PROSTART", "PROROWS")}
+    level_ranges: List[List[int]] = []
+
+    for row, i in enumerate(order):
+        ex = exercises[i]
+        for name, field in STRING_COLUMNS:
+            columns[name].append(sid(ex.get(field)))
+        extra = {k: v for k, v in ex.items() if k not in KNOWN_FIELDS}
+        columns["COL_XTRA"].append(sid(dumps_str(extra) if extra else ""))
+
+        level = int(ex.get('difficulty_level', 1))
+        levels.append(level)
+        if not level_ranges or level_ranges[-1][0] != level:
+            level_ranges.append([level, row, row])
+        level_ranges[-1][2] = row + 1
+
+        tag_ids.extend(sid(t) for t in ex.get('tags', []))
+        tag_start.append(len(tag_ids))
+
+        regressions, progressions = links[i]
+        graph["REGROWS"].extend(row_of[j] for j in regressions)
+        graph["REGSTART"].append(len(graph["REGROWS"]))
+        graph["PROROWS"].extend(row_of[j] for j in progressions)
+        graph["PROSTART"].append(len(graph["PROROWS"]))
+
+    str_offsets = array('I', [0])
+    str_data = bytearray()
+    for text in strings:  # dicts keep insertion order == id order
+        str_data.extend(text.encode('utf-8'))
+        str_offsets.append(len(str_data))
+
+    sections = [
+        ("STROFFS", str_offsets.tobytes()),
+        ("STRDATA", bytes(str_data)),
+        *[(name, columns[name].tobytes()) for name in columns],
+        ("COL_LVL", levels.tobytes()),
+        ("COL_POS", positions.tobytes()),
+        ("TAGSTART", tag_start.tobytes()),
+        ("TAGIDS", tag_ids.tobytes()),
+        ("LEVELS", array('i', [v for r in level_ranges for v in r]).tobytes()),
+        *[(name, graph[name].tobytes()) for name in graph],
+        ("META", dumps({"version": version, "source": source, "count": len(exercises), "links": has_links})),
+    ]
+    if sys.byteorder != "little":
+        raise SnapshotError("Snapshots are little-endian; writing on a big-endian host is not supported")
+
+    header_size = len(MAGIC) + 4 + len(sections) * 24
+    header = bytearray(MAGIC + struct.pack("<I", len(sections)))
+    body = bytearray()
+    offset = header_size + (-header_size % 8)
+    for name, data in sections:
+        header.extend(struct.pack("<8sQQ", name.encode('ascii'), offset + len(body), len(data)))
+        body.extend(data)
+        _pad8(body)
+    _pad8(header)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, path)
+    return len(header) + len(body)
+
+
+class _ExerciseView(Sequence):
+    """Lazy list-like view: exercises are decoded only when indexed."""
+
+    def __init__(self, kb: "MappedKnowledgeBase"):
+        self._kb = kb
+
+    def __len__(self) -> int:
+        return len(self._kb)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._kb.exercise(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self._kb.exercise(i)
+
+
+class MappedKnowledgeBase:
+    """
+    Same accessors as KnowledgeBase (level_rows / row_tags / row_neighbors / row_position /
+    exercise / level_vocab / version), served straight from a memory-mapped
+    snapshot.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        if sys.byteorder != "little":
+            raise SnapshotError("Snapshots are little-endian; use the JSON KB on this host")
+
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise SnapshotError(f"{path} is not a KB snapshot")
+
+        view = memoryview(self._mm)
+        (count,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        sections = {}
+        for n in range(count):
+            name, offset, length = struct.unpack_from("<8sQQ", self._mm, len(MAGIC) + 4 + n * 24)
+            sections[name.rstrip(b"\0").decode('ascii')] = view[offset:offset + length]
+
+        self._str_offsets = sections["STROFFS"].cast('I')
+        self._str_data = sections["STRDATA"]
+        self._columns = {name: sections[name].cast('I') for name, _ in STRING_COLUMNS}
+        self._extra = sections["COL_XTRA"].cast('I')
+        self._levels = sections["COL_LVL"].cast('i')
+        self._tag_start = sections["TAGSTART"].cast('I')
+        self._tag_ids = sections["TAGIDS"].cast('I')
+
+        if "PROSTART" not in sections:
+            raise SnapshotError(f"{path} predates the progression graph; rebuild it with python -m src.rag.kb_snapshot")
+        self._graph = {name: sections[name].cast('I') for name in ("REGSTART", "REGROWS", "PROSTART", "PROROWS")}
+        if "COL_POS" not in sections:
+            raise SnapshotError(f"{path} predates stored KB positions; rebuild it with python -m src.rag.kb_snapshot")
+        self._positions = sections["COL_POS"].cast('I')
+
+        meta = loads(bytes(sections["META"]))
+        self.version = meta["version"]
+        self.source = path
+        self._links_stored = meta.get("links", False)
+
+        ranges = sections["LEVELS"].cast('i')
+        self._level_ranges: Dict[int, range] = {
+            ranges[k]: range(ranges[k + 1], ranges[k + 2]) for k in range(0, len(ranges), 3)
+        }
+
+        # Small per-process structures: lower-cased tag names and per-level vocabularies
+        self._tag_names: Dict[int, str] = {}
+        self.level_vocab: Dict[int, FrozenSet[str]] = {}
+        for level, rows in self._level_ranges.items():
+            ids = set(self._tag_ids[self._tag_start[rows.start]:self._tag_start[rows.stop]])
+            for t in ids:
+                if t not in self._tag_names:
+                    self._tag_names[t] = self._string(t).lower()
+            self.level_vocab[level] = frozenset(self._tag_names[t] for t in ids)
+
+        self.exercises = _ExerciseView(self)
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def _string(self, sid: int) -> str:
+        return bytes(self._str_data[self._str_offsets[sid]:self._str_offsets[sid + 1]]).decode('utf-8')
+
+    def level_rows(self, level: int) -> range:
+        return self._level_ranges.get(level, range(0))
+
+    def row_tags(self, i: int) -> FrozenSet[str]:
+        names = self._tag_names
+        return frozenset(names[t] for t in self._tag_ids[self._tag_start[i]:self._tag_start[i + 1]])
+
+    def _links(self, kind: str, i: int):
+        start = self._graph[f"{kind}START"]
+        return self._graph[f"{kind}ROWS"][start[i]:start[i + 1]]
+
+    def row_neighbors(self, i: int) -> List[int]:
+        return [*self._links("REG", i), *self._links("PRO", i)]
+
+    def row_position(self, i: int) -> int:
+        return self._positions[i]
+
+    def exercise(self, i: int) -> Dict[str, Any]:
+        entry = {field: self._string(self._columns[name][i]) for name, field in STRING_COLUMNS}
+        entry["difficulty_level"] = self._levels[i]
+        entry["tags"] = [self._string(t) for t in self._tag_ids[self._tag_start[i]:self._tag_start[i + 1]]]
+        if self._links_stored:
+            ids = self._columns["COL_ID"]
+            entry["regressions"] = [self._string(ids[j]) for j in self._links("REG", i)]
+            entry["progressions"] = [self._string(ids[j]) for j in self._links("PRO", i)]
+        extra = self._string(self._extra[i])
+        if extra:
+            entry.update(loads(extra))
+        return entry
+
+    def heap_bytes(self) -> int:
+        """The per-process structures only; the mapped file itself is shared page cache."""
+        from src.rag.knowledge_base import deep_sizeof
+        return deep_sizeof(self._tag_names, self.level_vocab, self._level_ranges)
+
+
+def build_from_json(json_path: str, snapshot_path: str = SNAPSHOT_PATH) -> int:
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    version = hashlib.sha1(raw).hexdigest()[:12]
+    return write_snapshot(loads(raw), snapshot_path, version=version, source=json_path)
+
+
+if __name__ == "__main__":
+    from src.rag.knowledge_base import JSON_KB_PATH
+
+    parser = argparse.ArgumentParser(description="Build the memory-mappable KB snapshot from the JSON KB.")
+    parser.add_argument("--input", default=JSON_KB_PATH)
+    parser.add_argument("--output", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    size = build_from_json(args.input, args.output)
+    print(f"✅ Snapshot written to {args.output} ({size / 1024:.1f} KiB)")
@@ -0,0 +1,309 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, FrozenSet, Union, Callable
+
+from src.rag.kb_snapshot import MappedKnowledgeBase, SNAPSHOT_PATH
+from src.rag.progression import stored_links
+from src.serialization import loads
+
+# --- CONFIGURATION ---
+JSON_KB_PATH = 'data/processed/exercise_knowledge_base.json'
+# "json" parses the JSON KB per process; "snapshot" memory-maps the binary
+# snapshot so all workers share one copy (see src/serve.py)
+KB_FORMAT = os.getenv("FMS_KB_FORMAT", "json")
+KB_SNAPSHOT_PATH = os.getenv("FMS_KB_SNAPSHOT_PATH", SNAPSHOT_PATH)
+# Per-tenant libraries: <dir>/<tenant_id>.kbs (preferred) or <tenant_id>.json
+TENANT_KB_DIR = os.getenv("FMS_KB_TENANT_DIR", "data/tenants")
+# Resident tenant KBs are evicted least-recently-used past either bound
+TENANT_CACHE_MB = float(os.getenv("FMS_KB_CACHE_MB", "512"))
+TENANT_CACHE_MAX = int(os.getenv("FMS_KB_CACHE_MAX", "64"))
+# "db" serves libraries from the exercise catalog tables (src/rag/catalog.py)
+# when the catalog has them; libraries it lacks still come from the files
+KB_SOURCE = os.getenv("FMS_KB_SOURCE", "file")
+
+_TENANT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class KnowledgeBase:
+    """
+    The exercise list plus the lookup structures retrieval needs:
+    lower-cased tag sets per exercise, row indices per difficulty level, the
+    tag vocabulary of each level and the progression graph as adjacency lists.
+    `version` is a content hash, so any cache keyed on it is invalidated when
+    the file changes.
+    """
+
+    def __init__(self, exercises: List[Dict[str, Any]], version: str, source: str = JSON_KB_PATH):
+        self.exercises = exercises
+        self.version = version
+        self.source = source
+        self.tag_sets: List[FrozenSet[str]] = [
+            frozenset(str(t).lower() for t in ex.get('tags', [])) for ex in exercises
+        ]
+        self.by_level: Dict[int, List[int]] = {}
+        for i, ex in enumerate(exercises):
+            self.by_level.setdefault(ex.get('difficulty_level', 1), []).append(i)
+        self.level_vocab: Dict[int, FrozenSet[str]] = {
+            level: frozenset().union(*(self.tag_sets[i] for i in rows))
+            for level, rows in self.by_level.items()
+        }
+        self.neighbors: List[List[int]] = [
+            regressions + progressions for regressions, progressions in stored_links(exercises)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.exercises)
+
+    # Accessors shared with the memory-mapped snapshot (src/rag/kb_snapshot.py)
+    def level_rows(self, level: int) -> List[int]:
+        return self.by_level.get(level, [])
+
+    def row_tags(self, i: int) -> FrozenSet[str]:
+        return self.tag_sets[i]
+
+    def row_position(self, i: int) -> int:
+        """Position in the source KB; ranking ties follow it (snapshot rows are level-sorted)."""
+        return i
+
+    def row_neighbors(self, i: int) -> List[int]:
+        return self.neighbors[i]
+
+    def exercise(self, i: int) -> Dict[str, Any]:
+        return self.exercises[i]
+
+    def heap_bytes(self) -> int:
+        return deep_sizeof(self.exercises, self.tag_sets, self.by_level, self.level_vocab, self.neighbors)
+
+
+class CatalogKnowledgeBase(KnowledgeBase):
+    """
+    A KB read from the database catalog. `counter` is the catalog's version
+    counter at read time; `version` adds a content hash, so a wiped and
+    re-imported catalog never reuses an old version string.
+    """
+
+    def __init__(self, exercises: List[Dict[str, Any]], catalog: str, counter: int, content_hash: str):
+        super().__init__(exercises, version=f"db{counter}.{content_hash[:8]}", source=f"db:{catalog or 'default'}")
+        self.catalog = catalog
+        self.counter = counter
+        self.row_by_id: Dict[str, int] = {ex.get('id'): i for i, ex in enumerate(exercises)}
+
+
+def deep_sizeof(*objs) -> int:
+    """Bytes held by the objects and everything they contain (shared objects counted once)."""
+    seen, total, stack = set(), 0, list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
+
+
+# KB versions that stop being served (file changed, tenant evicted); caches keyed on the version drop them
+_unload_listeners: List[Callable[[str], None]] = []
+
+
+def on_kb_unload(listener: Callable[[str], None]):
+    _unload_listeners.append(listener)
+
+
+def _unloaded(version: str):
+    for listener in _unload_listeners:
+        listener(version)
+
+
+class UnknownTenant(LookupError):
+    pass
+
+
+# Catalog KBs currently served, by catalog ("" = the shared library); filled by src/rag/catalog.py
+_catalog_kbs: Dict[str, CatalogKnowledgeBase] = {}
+
+
+def serve_catalog_kb(catalog: str, kb: Optional[CatalogKnowledgeBase]):
+    """Serves `kb` for the catalog (None stops serving it); the replaced version's caches are dropped."""
+    previous = _catalog_kbs.pop(catalog, None)
+    if kb is not None:
+        _catalog_kbs[catalog] = kb
+    if previous is not None and (kb is None or previous.version != kb.version):
+        _unloaded(previous.version)
+
+
+def served_catalog_kb(catalog: str) -> Optional[CatalogKnowledgeBase]:
+    return _catalog_kbs.get(catalog)
+
+
+def read_knowledge_base(path: str) -> Union[KnowledgeBase, MappedKnowledgeBase]:
+    if path.endswith(".kbs"):
+        return MappedKnowledgeBase(path)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return KnowledgeBase(loads(raw), version=hashlib.sha1(raw).hexdigest()[:12], source=path)
+
+
+_loaded: Dict[str, Any] = {"stat": None, "kb": None}
+
+
+def load_knowledge_base(path: Optional[str] = None, tenant: Optional[str] = None) -> Optional[Union[KnowledgeBase, MappedKnowledgeBase]]:
+    """
+    Returns the KB, re-reading the file only when its size or mtime changed
+    since the last call. Returns None if the file is missing or invalid.
+    With `tenant`, returns that tenant's KB from the registry instead
+    (raises UnknownTenant if it has none). A library served from the
+    database catalog (FMS_KB_SOURCE=db) takes precedence over its file.
+    """
+    if path is None and _catalog_kbs:
+        served = _catalog_kbs.get(tenant or "")
+        if served is not None:
+            return served
+    if tenant:
+        return tenant_registry.get(tenant)
+    if path is None:
+        path = KB_SNAPSHOT_PATH if KB_FORMAT == "snapshot" else JSON_KB_PATH
+
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        print(f"❌ ERROR: KB file not found at {path}")
+        return None
+
+    stat_key = (path, st.st_size, st.st_mtime_ns)
+    if _loaded["stat"] == stat_key:
+        return _loaded["kb"]
+
+    print(f"--- DEBUG: Loading exercises from {path}... ---")
+    try:
+        kb = read_knowledge_base(path)
+    except Exception as e:
+        print(f"❌ ERROR reading KB: {e}")
+        return None
+
+    previous = _loaded["kb"]
+    _loaded["stat"], _loaded["kb"] = stat_key, kb
+    if previous is not None and previous.version != kb.version:
+        _unloaded(previous.version)
+    print(f"✅ SUCCESS: Loaded {len(kb)} exercises from {path} (version {kb.version}).")
+    return kb
+
+
+# ── PER-TENANT LIBRARIES ──
+class KBRegistry:
+    """
+    Tenant KBs, loaded and indexed on first use and kept in an LRU bounded by
+    entry count and by estimated heap bytes (a snapshot's mapped pages are
+    page cache, shared and reclaimable, so only its small per-process indexes
+    count). Evicting drops the registry's reference only: a request still
+    holding the KB finishes with it. Counters feed /metrics.
+    """
+
+    def __init__(self, directory: str = TENANT_KB_DIR, max_bytes: int = int(TENANT_CACHE_MB * 2**20),
+                 max_entries: int = TENANT_CACHE_MAX):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # tenant -> stat, kb, bytes, mapped
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "loads": 0, "reloads": 0, "evictions": 0, "load_errors": 0, "unknown": 0}
+        self.load_seconds = 0.0
+
+    def path_for(self, tenant: str) -> Optional[str]:
+        if not _TENANT_ID_RE.match(tenant):
+            return None
+        for ext in (".kbs", ".json"):
+            path = os.path.join(self.directory, f"{tenant}{ext}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get(self, tenant: str) -> Union[KnowledgeBase, MappedKnowledgeBase]:
+        path = self.path_for(tenant)
+        if path is None:
+            with self._lock:
+                self.counters["unknown"] += 1
+            raise UnknownTenant(f"No exercise library for tenant '{tenant}'")
+        st = os.stat(path)
+        stat_key = (path, st.st_size, st.st_mtime_ns)
+
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None and entry["stat"] == stat_key:
+                self._entries.move_to_end(tenant)
+                self.counters["hits"] += 1
+                return entry["kb"]
+
+            started = time.perf_counter()
+            try:
+                kb = read_knowledge_base(path)
+            except Exception as e:
+                self.counters["load_errors"] += 1
+                raise UnknownTenant(f"Exercise library for tenant '{tenant}' is unreadable: {e}") from e
+            self.load_seconds += time.perf_counter() - started
+
+            mapped = isinstance(kb, MappedKnowledgeBase)
+            nbytes = kb.heap_bytes()
+            self.counters["reloads" if entry is not None else "loads"] += 1
+            print(f"📚 KB [{tenant}] {'reloaded' if entry else 'loaded'}: {len(kb)} exercises, "
+                  f"version {kb.version}, {nbytes / 2**20:.1f} MiB")
+            self._entries[tenant] = {"stat": stat_key, "kb": kb, "bytes": nbytes,
+                                     "mapped": os.path.getsize(path) if mapped else 0}
+            self._entries.move_to_end(tenant)
+            if entry is not None:
+                self._release(entry["kb"].version)
+            self._evict(keep=tenant)
+            return kb
+
+    def _evict(self, keep: str):
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.resident_bytes() > self.max_bytes):
+            tenant = next(iter(self._entries))
+            if tenant == keep:  # the entry just loaded stays, even if it alone exceeds the budget
+                self._entries.move_to_end(tenant)
+                tenant = next(iter(self._entries))
+            entry = self._entries.pop(tenant)
+            self.counters["evictions"] += 1
+            print(f"♻️ KB [{tenant}] evicted ({entry['bytes'] / 2**20:.1f} MiB)")
+            self._release(entry["kb"].version)
+
+    def _release(self, version: str):
+        """Tenants with identical files share a version; its caches go only when none serves it."""
+        default = _loaded["kb"]
+        if default is not None and default.version == version:
+            return
+        if all(entry["kb"].version != version for entry in self._entries.values()):
+            _unloaded(version)
+
+    def resident_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "load_seconds": round(self.load_seconds, 3),
+                "resident": len(self._entries),
+                "resident_bytes": self.resident_bytes(),
+                "mapped_bytes": sum(entry["mapped"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "tenants": {tenant: entry["bytes"] for tenant, entry in self._entries.items()},
+            }
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                _unloaded(entry["kb"].version)
+            self._entries.clear()
+
+
+tenant_registry = KBRegistry()
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional
+
+# --- CONFIGURATION ---
+# Select with FMS_LLM_BACKEND=stub. Fault injection knobs are read per instance
+# so a test or benchmark can change them between calls.
+STUB_LATENCY_MS = float(os.getenv("FMS_STUB_LATENCY_MS", "50"))
+STUB_JITTER_MS = float(os.getenv("FMS_STUB_JITTER_MS", "0"))
+STUB_FAILURE_RATE = float(os.getenv("FMS_STUB_FAILURE_RATE", "0"))
+STUB_HANG_RATE = float(os.getenv("FMS_STUB_HANG_RATE", "0"))
+# Calls the fake provider serves at once; the rest queue, like a provider rate
+# limit (0 = unlimited). Capacity / latency is the provider's saturation rate.
+STUB_CAPACITY = int(os.getenv("FMS_STUB_CAPACITY", "0"))
+
+_provider_slots = asyncio.Semaphore(STUB_CAPACITY) if STUB_CAPACITY > 0 else None
+
+
+class StubLLMError(RuntimeError):
+    """Injected provider failure (stands in for a 5xx / connection reset from Groq)."""
+
+
+class StubPlanChain:
+    """
+    Local, deterministic replacement for `prompt | llm | parser`.
+    Returns a WorkoutSession-shaped dict built from the retrieved exercises,
+    after an injected delay, and can be told to fail or hang.
+    """
+
+    def __init__(
+        self,
+        exercises: List[Dict[str, Any]],
+        latency_ms: Optional[float] = None,
+        jitter_ms: Optional[float] = None,
+        failure_rate: Optional[float] = None,
+        hang_rate: Optional[float] = None,
+        seed: Optional[int] = None,
+    ):
+        self.exercises = exercises
+        self.latency_ms = STUB_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = STUB_JITTER_MS if jitter_ms is None else jitter_ms
+        self.failure_rate = STUB_FAILURE_RATE if failure_rate is None else failure_rate
+        self.hang_rate = STUB_HANG_RATE if hang_rate is None else hang_rate
+        self.rng = random.Random(seed)
+
+    def _delay_s(self) -> float:
+        return max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def _build_plan(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "session_title": f"Level {inputs.get('level', '?')} Corrective Session",
+            "estimated_duration": "20-30 min",
+            "difficulty_color": "Yellow",
+            "coach_summary": f"Stub plan for status {inputs.get('status', 'TRAINING')}.",
+            "exercises": [
+                {
+                    "name": ex.get('exercise_name', 'Exercise'),
+                    "tag": str(ex.get('category', 'CORRECTIVE')).upper(),
+                    "sets_reps": "3 x 10",
+                    "tempo": "Controlled",
+                    "coach_tip": "Focus on perfect form."
+                }
+                for ex in self.exercises[:3]
+            ]
+        }
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        roll = self.rng.random()
+        if roll < self.hang_rate:
+            await asyncio.sleep(3600)
+        async with _provider_slots if _provider_slots is not None else nullcontext():
+            await asyncio.sleep(self._delay_s())
+        if roll < self.hang_rate + self.failure_rate:
+            raise StubLLMError("Injected LLM failure")
+        return self._build_plan(inputs)
+
+    def invoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        roll = self.rng.random()
+        if roll < self.hang_rate:
+            time.sleep(3600)
+        time.sleep(self._delay_s())
+        if roll < self.hang_rate + self.failure_rate:
+            raise StubLLMError("Injected LLM failure")
+        return self._build_plan(inputs)
@@ -0,0 +1,63 @@
+from collections import defaultdict
+from typing import Dict, Any, List, Tuple, Iterable, Callable
+
+# ── PROGRESSION GRAPH ──
+# Each workbook row (category) is a progression: LEVEL 1 .. LEVEL 10. An
+# exercise's regressions are the exercises of the same category at the nearest
+# populated lower level, its progressions those at the nearest populated
+# higher level. Ingestion stores them as id lists ("regressions" /
+# "progressions"); KBs built before that derive the same graph on load.
+
+
+def progression_links(exercises: List[Dict[str, Any]]) -> List[Tuple[List[int], List[int]]]:
+    """(regression indices, progression indices) for every exercise, derived from category + level."""
+    by_category: Dict[str, Dict[int, List[int]]] = defaultdict(lambda: defaultdict(list))
+    for i, ex in enumerate(exercises):
+        by_category[ex.get('category')][int(ex.get('difficulty_level', 1))].append(i)
+
+    links: List[Tuple[List[int], List[int]]] = [([], []) for _ in exercises]
+    for levels in by_category.values():
+        ordered = sorted(levels)
+        for lower, higher in zip(ordered, ordered[1:]):
+            for i in levels[lower]:
+                links[i][1].extend(levels[higher])
+            for i in levels[higher]:
+                links[i][0].extend(levels[lower])
+    return links
+
+
+def link_progressions(exercises: List[Dict[str, Any]]) -> int:
+    """Writes "regressions" / "progressions" id lists onto each exercise in place; returns the edge count."""
+    edges = 0
+    for ex, (regressions, progressions) in zip(exercises, progression_links(exercises)):
+        ex["regressions"] = [exercises[j]["id"] for j in regressions]
+        ex["progressions"] = [exercises[j]["id"] for j in progressions]
+        edges += len(progressions)
+    return edges
+
+
+def stored_links(exercises: List[Dict[str, Any]]) -> List[Tuple[List[int], List[int]]]:
+    """Index links from the stored id lists, or derived ones when the KB predates them."""
+    if not any("progressions" in ex or "regressions" in ex for ex in exercises):
+        return progression_links(exercises)
+    index = {ex.get('id'): i for i, ex in enumerate(exercises)}
+    return [
+        ([index[r] for r in ex.get("regressions", []) if r in index],
+         [index[p] for p in ex.get("progressions", []) if p in index])
+        for ex in exercises
+    ]
+
+
+def progression_reach(start: Iterable[int], neighbors: Callable[[int], List[int]], max_hops: int) -> Dict[int, int]:
+    """{row: hops} for the start rows (hop 0) and every row up to `max_hops` links away (breadth-first)."""
+    hops = {i: 0 for i in start}
+    frontier = list(hops)
+    for hop in range(1, max_hops + 1):
+        reached = []
+        for i in frontier:
+            for j in neighbors(i):
+                if j not in hops:
+                    hops[j] = hop
+                    reached.append(j)
+        frontier = reached
+    return hops
@@ -0,0 +1,291 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque, Counter
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+# --- CONFIGURATION ---
+DEFAULT_REQUEST_BUDGET_S = float(os.getenv("FMS_REQUEST_BUDGET_S", "25"))
+
+
+# ── DEADLINE (PER-REQUEST LATENCY BUDGET) ──
+class Deadline:
+    """
+    A latency budget created once per request and handed to every stage.
+    Stages ask how much time is left instead of using their own timeouts.
+    """
+
+    def __init__(self, budget_s: float = DEFAULT_REQUEST_BUDGET_S):
+        self.budget_s = budget_s
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_s
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+# ── CIRCUIT BREAKER ──
+class CircuitBreaker:
+    """
+    CLOSED: calls go through, consecutive failures are counted.
+    OPEN: calls are short-circuited until `reset_timeout_s` has passed.
+    HALF_OPEN: up to `half_open_max_calls` probes go through; a success closes
+    the circuit, a failure opens it again. Every allowed call must end in
+    record_success, record_failure or release, or its probe slot is lost.
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout_s:
+                return False
+            self.state = self.HALF_OPEN
+            self.half_open_in_flight = 0
+
+        if self.state == self.HALF_OPEN:
+            if self.half_open_in_flight >= self.half_open_max_calls:
+                return False
+            self.half_open_in_flight += 1
+
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.half_open_in_flight = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.half_open_in_flight = 0
+
+    def release(self):
+        """An allowed call ended without an outcome (cancelled); frees its half-open probe slot."""
+        if self.state == self.HALF_OPEN and self.half_open_in_flight > 0:
+            self.half_open_in_flight -= 1
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+
+# ── ROLLING LATENCY TRACKER (FOR HEDGING) ──
+class LatencyTracker:
+    """Keeps the last `window` successful call latencies and answers percentile queries."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency_s: float):
+        self.samples.append(latency_s)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[idx]
+
+
+# ── HEDGED CALL ──
+async def hedged_call(
+    make_call: Callable[[], Awaitable[Any]],
+    hedge_after_s: Optional[float],
+    deadline: Optional[Deadline] = None,
+) -> Any:
+    """
+    Starts `make_call()`. If it has not finished after `hedge_after_s` (and the
+    deadline still has room), starts a second identical call and returns
+    whichever finishes successfully first. The loser is cancelled.
+    """
+    tasks = [asyncio.ensure_future(make_call())]
+    try:
+        if hedge_after_s is None:
+            return await tasks[0]
+
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after_s)
+        if done or (deadline is not None and deadline.remaining() <= hedge_after_s):
+            return await tasks[0]
+
+        print(f"--- HEDGE: primary call exceeded {hedge_after_s:.2f}s, sending hedge request ---")
+        tasks.append(asyncio.ensure_future(make_call()))
+        pending = set(tasks)
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        # Covers the losing hedge and cancellation of the caller (deadline hit)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# ── TOKEN BUCKET (PROVIDER QUOTA) ──
+class TokenBucket:
+    """
+    Async token bucket. `rate_per_s` tokens are added per second up to
+    `capacity`; `acquire()` waits until enough tokens are available.
+    """
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_s)
+        self.updated_at = now
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate_per_s)
+                self._refill()
+            self.tokens -= tokens
+
+
+# ── ADMISSION CONTROL (LOAD SHEDDING) ──
+class Overloaded(Exception):
+    """A stage refused work; the API turns this into 429/503 with Retry-After."""
+
+    def __init__(self, stage: str, reason: str, retry_after_s: int):
+        super().__init__(f"{stage} stage overloaded ({reason})")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class StageLimiter:
+    """
+    At most `limit` callers hold the stage at once; up to `max_queue` more wait
+    in FIFO order, each for at most `max_wait_s`. A full queue or an expired
+    wait raises Overloaded right away, so excess load is rejected in
+    milliseconds instead of every request timing out. `limit=0` disables it.
+    """
+
+    QUEUE_FULL = "queue_full"
+    WAIT_TIMEOUT = "wait_timeout"
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait_s: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.in_flight = 0
+        self.waiters: deque = deque()
+        self.hold_s = 1.0  # EWMA of how long a slot is held, for Retry-After
+        self.counts = Counter()
+
+    def retry_after_s(self) -> int:
+        """Roughly when a slot should be free for a newcomer: the queue ahead of it drained at `limit` per hold time."""
+        drain_s = (len(self.waiters) + 1) / max(1, self.limit) * self.hold_s
+        return max(1, min(60, math.ceil(drain_s)))
+
+    async def acquire(self, max_wait_s: Optional[float] = None):
+        if self.limit <= 0:
+            return
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.counts["admitted"] += 1
+            return
+        wait_s = self.max_wait_s if max_wait_s is None else min(self.max_wait_s, max_wait_s)
+        if len(self.waiters) >= self.max_queue or wait_s <= 0:
+            self.counts[self.QUEUE_FULL] += 1
+            raise Overloaded(self.name, self.QUEUE_FULL, self.retry_after_s())
+
+        slot = asyncio.get_running_loop().create_future()
+        self.waiters.append(slot)
+        try:
+            await asyncio.wait_for(slot, timeout=wait_s)
+        except asyncio.TimeoutError:
+            self._abandon(slot)
+            self.counts[self.WAIT_TIMEOUT] += 1
+            raise Overloaded(self.name, self.WAIT_TIMEOUT, self.retry_after_s()) from None
+        except asyncio.CancelledError:
+            self._abandon(slot)
+            raise
+        self.counts["admitted"] += 1
+        self.counts["waited"] += 1
+
+    def _abandon(self, slot: asyncio.Future):
+        if slot in self.waiters:
+            self.waiters.remove(slot)
+        elif slot.done() and not slot.cancelled():
+            self.release()  # the slot was handed over just as we gave up: pass it on
+
+    def release(self, held_s: Optional[float] = None):
+        if self.limit <= 0:
+            return
+        if held_s is not None:
+            self.hold_s = 0.9 * self.hold_s + 0.1 * held_s
+        while self.waiters:
+            slot = self.waiters.popleft()
+            if not slot.done():
+                slot.set_result(None)  # hand the slot over; in_flight is unchanged
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, max_wait_s: Optional[float] = None):
+        await self.acquire(max_wait_s)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": len(self.waiters),
+                "max_queue": self.max_queue, "max_wait_s": self.max_wait_s, "hold_s": round(self.hold_s, 3),
+                **self.counts}
+
+
+# ── RETRY WITH JITTER ──
+async def retry_with_jitter(
+    call: Callable[[], Awaitable[Any]],
+    attempts: int = 3,
+    base_delay_s: float = 0.5,
+    max_delay_s: float = 10.0,
+    retry_on: tuple = (Exception,),
+) -> Any:
+    """Exponential backoff with full jitter: sleep U(0, min(max, base * 2^n)) between attempts."""
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay_s, base_delay_s * (2 ** attempt)))
+            print(f"--- RETRY: attempt {attempt + 1}/{attempts} failed ({e}); sleeping {delay:.2f}s ---")
+            await asyncio.sleep(delay)
@@ -1,11 +1,38 @@
-import json
 import os
-import uuid
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
 from src.logic.fms_analyzer import analyze_fms_profile
+from src.rag.knowledge_base import (JSON_KB_PATH, KB_SOURCE, KnowledgeBase, CatalogKnowledgeBase,
+                                    load_knowledge_base, on_kb_unload)
+from src.rag.progression import progression_reach
+from src.tracing import traced, current_span, request_id
 
 # --- CONFIGURATION ---
-JSON_KB_PATH = 'data/processed/exercise_knowledge_base.json'
+TOP_K = 6  # increased to 6 for better selection pool
+RETRIEVAL_CACHE_SIZE = int(os.getenv("FMS_RETRIEVAL_CACHE_SIZE", "4096"))
+PRECOMPUTE_AT_STARTUP = os.getenv("FMS_RETRIEVAL_PRECOMPUTE", "0") == "1"
+PRECOMPUTE_MAX_KEYS_PER_LEVEL = int(os.getenv("FMS_RETRIEVAL_PRECOMPUTE_MAX_KEYS", "4096"))
+# Progression-graph expansion: exercises up to PROGRESSION_HOPS regressions /
+# progressions away from the target level compete for the top-k, each hop
+# costing HOP_PENALTY points (on-level exercises also match their level tag).
+# PROGRESSION_HOPS=0 restores strict level matching.
+PROGRESSION_HOPS = int(os.getenv("FMS_RETRIEVAL_HOPS", "1"))
+HOP_PENALTY = float(os.getenv("FMS_RETRIEVAL_HOP_PENALTY", "2"))
+
+# Pattern tag added when a test's score is <= 2
+TEST_PATTERN_TAGS = {
+    'overhead_squat': "pattern_squat",
+    'hurdle_step': "pattern_step",
+    'inline_lunge': "pattern_lunge",
+    'shoulder_mobility': "pattern_shoulder",
+    'active_straight_leg_raise': "pattern_leg_raise",
+    'trunk_stability_pushup': "pattern_pushup",
+    'rotary_stability': "pattern_rotary",
+}
+
+# Every target_level the analyzer can emit
+TARGET_LEVELS = [0, 1, 3, 5, 7, 9]
 
 FAULT_TO_TAG_MAP = {
     "heels_lift": "fix_heels_lift",
@@ -61,26 +88,181 @@ FAULT_TO_TAG_MAP = {
 
 def fetch_exercises_from_json():
     """Fetch all exercises from the local JSON Knowledge Base"""
-    print(f"--- DEBUG: Loading exercises from {JSON_KB_PATH}... ---")
-    
-    if not os.path.exists(JSON_KB_PATH):
-        print(f"❌ ERROR: JSON file not found at {JSON_KB_PATH}")
-        return []
-        
+    kb = load_knowledge_base()
+    return list(kb.exercises) if kb else []
+
+def build_search_tags(target_level: int, detailed_faults: Optional[Dict[str, Any]]) -> set:
+    search_tags = set()
+    search_tags.add(f"level_{target_level}")
+
+    if detailed_faults:
+        for test, data in detailed_faults.items():
+            if test == 'use_manual_scores': continue
+            if not isinstance(data, dict): continue
+            
+            # Add pattern tags for low scores in each major test
+            if test in TEST_PATTERN_TAGS and data.get('score', 3) <= 2:
+                search_tags.add(TEST_PATTERN_TAGS[test])
+
+            # Fault-specific tags (binary > 0)
+            for category in data.values():
+                if isinstance(category, dict):
+                    for fault, severity in category.items():
+                        if isinstance(severity, (int, float)) and severity > 0:
+                            if fault in FAULT_TO_TAG_MAP:
+                                search_tags.add(FAULT_TO_TAG_MAP[fault])
+    return search_tags
+
+# ── PROGRESSION NEIGHBOURHOODS ──
+# Candidate rows per target level: the level's own rows (hop 0) followed by
+# the rows reachable through the KB's adjacency lists, with their hop count.
+# Computed once per (KB version, level), so ranking never scans the whole KB.
+# Several tenant KBs can be live at once, so entries for every version coexist.
+NEIGHBOURHOOD_CACHE_SIZE = 1024
+_neighbourhoods: "OrderedDict[Tuple[str, int, int], Tuple[List[Tuple[int, int]], FrozenSet[str]]]" = OrderedDict()
+
+def level_neighbourhood(kb: KnowledgeBase, target_level: int) -> Tuple[List[Tuple[int, int]], FrozenSet[str]]:
+    """([(row, hops), ...] in ranking tie order, tag vocabulary of those rows)."""
+    key = (kb.version, target_level, PROGRESSION_HOPS)
+    cached = _neighbourhoods.get(key)
+    if cached is not None:
+        _neighbourhoods.move_to_end(key)
+        return cached
+
+    hops = progression_reach(kb.level_rows(target_level), kb.row_neighbors, PROGRESSION_HOPS)
+
+    # Stable by hop count; inside a hop, source KB order, whatever the format's row layout
+    # (ranking ties depend on it)
+    rows = sorted(hops.items(), key=lambda item: (item[1], kb.row_position(item[0])))
+    vocab = frozenset().union(*(kb.row_tags(i) for i, _ in rows))
+    _neighbourhoods[key] = (rows, vocab)
+    if len(_neighbourhoods) > NEIGHBOURHOOD_CACHE_SIZE:
+        _neighbourhoods.popitem(last=False)
+    return rows, vocab
+
+def rank_exercises(kb: KnowledgeBase, target_level: int, search_tags: FrozenSet[str]) -> List[Dict[str, Any]]:
+    scored_exercises = []
+    # Target level plus its progression neighbourhood, penalised per hop
+    for i, hops in level_neighbourhood(kb, target_level)[0]:
+        matched = search_tags & kb.row_tags(i)
+        match_count = len(matched)
+
+        # Boost for specific corrective tags
+        if match_count > 0:
+            if any("fix_" in t for t in matched):
+                match_count += 5
+        scored_exercises.append((i, match_count - HOP_PENALTY * hops))
+
+    # Sort by relevance (stable, so ties keep KB order)
+    scored_exercises.sort(key=lambda x: x[1], reverse=True)
+    return [kb.exercise(i) for i, _ in scored_exercises[:TOP_K]]
+
+# ── RETRIEVAL RESULT CACHE ──
+# The ranking depends only on (KB, target_level, search tags). Tags that no
+# candidate exercise carries never change a score, so the key keeps only the
+# tags in the neighbourhood's vocabulary; many fault combinations share one entry.
+_retrieval_cache: "OrderedDict[Tuple[str, int, FrozenSet[str]], List[Dict[str, Any]]]" = OrderedDict()
+_cache_state = {"hits": 0, "misses": 0}
+
+def retrieval_cache_key(kb: KnowledgeBase, target_level: int, search_tags: set) -> Tuple[str, int, FrozenSet[str]]:
+    vocab = level_neighbourhood(kb, target_level)[1]
+    return (kb.version, target_level, frozenset(t.lower() for t in search_tags) & vocab)
+
+def _cached(key: Tuple[str, int, FrozenSet[str]]) -> Optional[List[Dict[str, Any]]]:
+    top = _retrieval_cache.get(key)
+    if top is not None:
+        _retrieval_cache.move_to_end(key)
+        _cache_state["hits"] += 1
+    else:
+        _cache_state["misses"] += 1
+    return top
+
+def _remember(key: Tuple[str, int, FrozenSet[str]], top: List[Dict[str, Any]]):
+    _retrieval_cache[key] = top
+    if len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+        _retrieval_cache.popitem(last=False)
+
+def cached_rank(kb: KnowledgeBase, target_level: int, search_tags: set) -> Tuple[List[Dict[str, Any]], bool]:
+    key = retrieval_cache_key(kb, target_level, search_tags)
+    top = _cached(key)
+    if top is not None:
+        return top, True
+
+    top = rank_exercises(kb, target_level, key[2])
+    _remember(key, top)
+    return top, False
+
+async def cached_rank_in_catalog(kb: CatalogKnowledgeBase, target_level: int,
+                                 search_tags: set) -> Tuple[List[Dict[str, Any]], bool]:
+    """cached_rank for a database catalog: misses rank in one indexed query instead of a scan."""
+    from src.rag.catalog import rank_in_catalog  # only FMS_KB_SOURCE=db serving imports the catalog
+    key = retrieval_cache_key(kb, target_level, search_tags)
+    top = _cached(key)
+    if top is not None:
+        return top, True
+
     try:
-        with open(JSON_KB_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            print(f"✅ SUCCESS: Loaded {len(data)} exercises from JSON.")
-            return data
+        top = await rank_in_catalog(kb, target_level, key[2], PROGRESSION_HOPS, HOP_PENALTY, TOP_K)
     except Exception as e:
-        print(f"❌ ERROR reading JSON: {e}")
-        return []
+        print(f"⚠️ Catalog ranking query failed ({e}); ranking in memory")
+        top = None
+    if top is None:
+        top = rank_exercises(kb, target_level, key[2])
+    _remember(key, top)
+    return top, False
+
+def clear_retrieval_cache():
+    _retrieval_cache.clear()
+    _neighbourhoods.clear()
+    _cache_state.update(hits=0, misses=0)
+
+def forget_kb_version(version: str):
+    """Drops the cached rankings of a KB that is no longer served (reloaded or evicted)."""
+    for cache in (_retrieval_cache, _neighbourhoods):
+        for key in [k for k in cache if k[0] == version]:
+            del cache[key]
+
+on_kb_unload(forget_kb_version)
+
+def retrieval_cache_stats() -> Dict[str, Any]:
+    return {"entries": len(_retrieval_cache), "versions": len({k[0] for k in _retrieval_cache}),
+            "hits": _cache_state["hits"], "misses": _cache_state["misses"]}
+
+def precompute_retrieval_cache(kb: Optional[KnowledgeBase] = None) -> int:
+    """
+    Eagerly ranks every reachable (target_level, tag set) key so the first
+    requests after startup hit the cache. Levels whose key space exceeds
+    PRECOMPUTE_MAX_KEYS_PER_LEVEL are left to fill lazily.
+    """
+    kb = kb or load_knowledge_base()
+    if not kb:
+        return 0
+
+    reachable = set(FAULT_TO_TAG_MAP.values()) | set(TEST_PATTERN_TAGS.values())
+    computed = 0
+    for level in TARGET_LEVELS:
+        level_tag = f"level_{level}"
+        vocab = level_neighbourhood(kb, level)[1]
+        optional = sorted((reachable - {level_tag}) & vocab)
+        if 2 ** len(optional) > PRECOMPUTE_MAX_KEYS_PER_LEVEL:
+            print(f"--- DEBUG: Level {level} has {2 ** len(optional)} keys; skipping eager precompute ---")
+            continue
+        for size in range(len(optional) + 1):
+            for combo in combinations(optional, size):
+                cached_rank(kb, level, {level_tag, *combo})
+                computed += 1
+
+    print(f"✅ Retrieval cache precomputed: {computed} keys for KB {kb.version}")
+    return computed
 
+@traced("retrieve")
 async def get_exercises_by_profile(
     simple_scores: Dict[str, int],
-    detailed_faults: Optional[Dict[str, Any]] = None
+    detailed_faults: Optional[Dict[str, Any]] = None,
+    kb: Optional[KnowledgeBase] = None
 ) -> Dict[str, Any]:
-    call_id = str(uuid.uuid4())[:8]
+    call_id = request_id()
+    span = current_span()
     print(f"--- RETRIEVAL CALL START [{call_id}] ---")
 
     # 1. Analyze
@@ -91,85 +273,56 @@ async def get_exercises_by_profile(
 
     target_level = analysis.get('target_level', 1)
     print(f"--- DEBUG [{call_id}]: Target Level is {target_level} ---")
+    span.set(**{"retrieval.target_level": target_level})
 
-    # 2. Load Data
-    kb = fetch_exercises_from_json()
+    # 2. Load Data (callers such as the offline harness may pass a specific KB;
+    # a profile with a tenant_id uses that tenant's library)
+    tenant = (detailed_faults or {}).get("tenant_id")
+    if kb is None and KB_SOURCE == "db":
+        from src.rag.catalog import refresh_catalog
+        await refresh_catalog(tenant)
+    kb = kb or load_knowledge_base(tenant=tenant)
+    span.set(**{"kb.tenant": tenant})
     
     if not kb:
         print(f"--- RETRIEVAL CALL END [{call_id}] | ERROR: No data ---")
         return {"status": "ERROR_NO_DATA", "analysis": analysis, "data": []}
 
     # 3. Build Search Tags
-    search_tags = set()
-    search_tags.add(f"level_{target_level}")
-
-    if detailed_faults:
-        for test, data in detailed_faults.items():
-            if test == 'use_manual_scores': continue
-            if not isinstance(data, dict): continue
-            
-            # Add pattern tags for low scores in each major test
-            if test == 'overhead_squat' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_squat")
-            elif test == 'hurdle_step' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_step")
-            elif test == 'inline_lunge' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_lunge")
-            elif test == 'shoulder_mobility' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_shoulder")
-            elif test == 'active_straight_leg_raise' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_leg_raise")
-            elif test == 'trunk_stability_pushup' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_pushup")
-            elif test == 'rotary_stability' and data.get('score', 3) <= 2:
-                search_tags.add("pattern_rotary")
-
-            # Fault-specific tags (binary > 0)
-            for category in data.values():
-                if isinstance(category, dict):
-                    for fault, severity in category.items():
-                        if isinstance(severity, (int, float)) and severity > 0:
-                            if fault in FAULT_TO_TAG_MAP:
-                                search_tags.add(FAULT_TO_TAG_MAP[fault])
-    
+    search_tags = build_search_tags(target_level, detailed_faults)
     print(f"--- DEBUG [{call_id}]: Searching for tags: {search_tags} ---")
 
-    # 4. Filter & Score exercises
-    scored_exercises = []
-    for ex in kb:
-        ex_tags = [str(t).lower() for t in ex.get('tags', [])]
-        ex_level = ex.get('difficulty_level', 1)
-        
-        # Strict level matching
-        if ex_level == target_level:
-            match_count = sum(1 for t in search_tags if t.lower() in ex_tags)
-            
-            # Boost for specific corrective tags
-            if match_count > 0:
-                if any("fix_" in t for t in search_tags if t.lower() in ex_tags):
-                    match_count += 5
-            scored_exercises.append({"ex": ex, "score": match_count})
-
-    # 5. Sort by relevance
-    scored_exercises.sort(key=lambda x: x['score'], reverse=True)
-    top_exercises = [x['ex'] for x in scored_exercises[:6]]  # increased to 6 for better selection pool
+    # 4-5. Filter, score and sort (memoized per KB version / level / effective tag set)
+    if isinstance(kb, CatalogKnowledgeBase):
+        top_exercises, cache_hit = await cached_rank_in_catalog(kb, target_level, search_tags)
+    else:
+        top_exercises, cache_hit = cached_rank(kb, target_level, search_tags)
+    top_exercises = list(top_exercises)
+    print(f"--- DEBUG [{call_id}]: Retrieval cache {'HIT' if cache_hit else 'MISS'} ---")
+    candidates = len(level_neighbourhood(kb, target_level)[0])
+    span.set(**{"retrieval.tags": len(search_tags), "retrieval.candidates": candidates,
+                "retrieval.scanned": 0 if cache_hit else candidates, "retrieval.cache_hit": cache_hit,
+                "retrieval.returned": len(top_exercises), "kb.version": kb.version})
 
     # Fallback if no matches
     if not top_exercises:
-        print(f"--- DEBUG [{call_id}]: No specific matches → using general level fallback ---")
-        fallback = [ex for ex in kb if ex.get('difficulty_level') == target_level]
-        top_exercises = fallback[:6]
+        print(f"--- DEBUG [{call_id}]: No exercises at level {target_level} → empty result ---")
+    else:
+        off_level = sum(1 for ex in top_exercises if ex.get('difficulty_level') != target_level)
+        print(f"--- DEBUG [{call_id}]: {off_level} of {len(top_exercises)} from adjacent progression levels ---")
+        span.set(**{"retrieval.off_level": off_level})
 
     # Final debug of returned items
     print(f"--- DEBUG [{call_id}]: RETRIEVED {len(top_exercises)} EXERCISES ---")
     for i, ex in enumerate(top_exercises):
         name = ex.get('exercise_name', 'MISSING_NAME')
-        print(f"  [{i}] {name}")
+        print(f"  [{i}] {name} (L{ex.get('difficulty_level')})")
 
     print(f"--- RETRIEVAL CALL END [{call_id}] | returning {len(top_exercises)} items ---")
 
     return {
         "status": "SUCCESS",
         "analysis": analysis,
-        "data": top_exercises
-    }
\ No newline at end of file
+        "data": top_exercises,
+        "kb_version": kb.version
+    }
@@ -0,0 +1,69 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib json module is the fallback
+    orjson = None
+
+try:
+    from starlette.responses import JSONResponse
+except ImportError:  # ingestion-only installs (KB builds) have no web stack
+    JSONResponse = object
+
+# ── ONE JSON LAYER ──
+# Everything on the hot path encodes/decodes through here: API responses,
+# the engine's JSON columns, KB loading and blobs. orjson when installed
+# (several times faster, returns bytes, native datetime/UUID/dataclass
+# support), stdlib json otherwise. Both produce compact UTF-8 JSON.
+#
+# Non-native values (Decimal, sets, pydantic models, ...) go through _default.
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj: Any):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    try:
+        return float(obj)  # Decimal, numpy scalars
+    except (TypeError, ValueError):
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+if orjson is not None:
+    _OPTS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTS | orjson.OPT_SORT_KEYS if sort_keys else _OPTS)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(",", ":"),
+                          ensure_ascii=False).encode('utf-8')
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    """For APIs that want text (SQLAlchemy's json_serializer)."""
+    return dumps(obj).decode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered by dumps(). Endpoints that return one of these
+    directly also skip FastAPI's jsonable_encoder pass over the payload.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,50 @@
+import argparse
+import asyncio
+import os
+
+import uvicorn
+
+from src.rag.knowledge_base import JSON_KB_PATH, KB_SNAPSHOT_PATH
+from src.rag.kb_snapshot import build_from_json, MappedKnowledgeBase, SnapshotError
+
+# Usage: python -m src.serve --workers 4 [--port 8000]
+#
+# Production launcher: N uvicorn worker processes, no reload. Before forking,
+# the binary KB snapshot is (re)built if the JSON KB is newer, and every worker
+# is pointed at it (FMS_KB_FORMAT=snapshot) so they share one memory-mapped
+# copy instead of parsing the JSON N times. Tables are created once here, so
+# the workers' own create_all calls find them and cannot race each other.
+
+
+def ensure_snapshot(json_path: str = JSON_KB_PATH, snapshot_path: str = KB_SNAPSHOT_PATH) -> str:
+    if not os.path.exists(json_path):
+        raise SystemExit(f"❌ KB not found at {json_path}. Run the ingestion first.")
+    stale = not os.path.exists(snapshot_path) or os.path.getmtime(snapshot_path) < os.path.getmtime(json_path)
+    if not stale:
+        try:
+            MappedKnowledgeBase(snapshot_path)
+        except SnapshotError as e:  # written by an older layout
+            print(f"📦 {e}")
+            stale = True
+    if stale:
+        size = build_from_json(json_path, snapshot_path)
+        print(f"📦 Built KB snapshot {snapshot_path} ({size / 1024:.1f} KiB)")
+    return snapshot_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the FMS API with multiple workers sharing one mmap'd KB.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    os.environ["FMS_KB_FORMAT"] = "snapshot"
+    os.environ["FMS_KB_SNAPSHOT_PATH"] = ensure_snapshot()
+
+    from init_db import init_db
+    asyncio.run(init_db())
+
+    print(f"🚀 Starting {args.workers} workers on {args.host}:{args.port}")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
@@ -0,0 +1,81 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Usage: python -m src.startup_report [--module main] [--top 15]
+#
+# Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+# summarizes where cold-start import time goes, per top-level package and per
+# module, so regressions (e.g. an eager langchain/pandas import) are visible.
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Returns (module, self_us, cumulative_us) for every `import time:` line."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(module: str) -> Dict[str, object]:
+    env = dict(os.environ)
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env
+    )
+    wall_s = time.perf_counter() - started
+
+    rows = parse_importtime(proc.stderr)
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+        "wall_s": wall_s,
+        "import_s": sum(self_us for _, self_us, _ in rows) / 1e6,
+        "modules": len(rows),
+        "by_package": sorted(by_package.items(), key=lambda x: x[1], reverse=True),
+        "by_module": sorted(rows, key=lambda x: x[2], reverse=True),
+    }
+
+
+def print_report(report: Dict[str, object], top: int):
+    print(f"🚀 Startup profile for `import {report['module']}`")
+    if not report["ok"]:
+        print(f"❌ Import failed: {report['error']}")
+    print(f"   Interpreter wall time : {report['wall_s'] * 1000:8.1f} ms")
+    print(f"   Total import time     : {report['import_s'] * 1000:8.1f} ms across {report['modules']} modules")
+
+    print(f"\n   Top {top} packages by self time:")
+    for package, self_us in report["by_package"][:top]:
+        print(f"   {self_us / 1000:8.1f} ms  {package}")
+
+    print(f"\n   Top {top} modules by cumulative time:")
+    for name, _, cumulative_us in report["by_module"][:top]:
+        print(f"   {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize `python -X importtime` for the serving entry point.")
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=15, help="Rows per table")
+    args = parser.parse_args()
+
+    result = measure(args.module)
+    print_report(result, args.top)
+    sys.exit(0 if result["ok"] else 1)
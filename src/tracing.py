@@ -0,0 +1,320 @@
+import asyncio
+import functools
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.serialization import dumps
+
+# ── REQUEST-SCOPED TRACING ──
+# TraceMiddleware opens one trace per HTTP request (job workers open one per
+# item). The trace and the innermost open span live in contextvars, so every
+# stage below it (analyzer, retriever, generator, DB queries) finds them
+# without passing anything around. Each stage records a span (start, duration,
+# attributes); when the request ends the finished trace goes to the exporter.
+#
+# With FMS_TRACE_EXPORTER=none (the default) nothing is recorded; the request
+# id still exists and is what the stage logs print.
+
+# --- CONFIGURATION ---
+TRACE_EXPORTER = os.getenv("FMS_TRACE_EXPORTER", "none")  # "none", "otlp-file" or "log"
+TRACE_FILE = os.getenv("FMS_TRACE_FILE", "logs/traces.otlp.jsonl")
+TRACE_SLOW_MS = float(os.getenv("FMS_TRACE_SLOW_MS", "0"))  # export only traces at least this slow
+SERVICE_NAME = os.getenv("FMS_SERVICE_NAME", "fms-smart-coach")
+
+# OTLP span kinds
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT, KIND_CONSUMER = 1, 2, 3, 5
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    __slots__ = ("name", "kind", "span_id", "parent_id", "start_ns", "end_ns", "_t0", "attributes", "error")
+
+    def __init__(self, name: str, kind: int, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.kind = kind
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self._t0 = time.perf_counter_ns()
+        self.end_ns = self.start_ns
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._t0)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    """Handed out when nothing is recording, so call sites never check."""
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, trace_id: str, request_id: str, recording: bool):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.recording = recording
+        self.spans: List[Span] = []  # in finish order; the root span is last
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("fms_trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("fms_span", default=None)
+_remote_parent: ContextVar[Optional[str]] = ContextVar("fms_remote_parent", default=None)
+
+
+def request_id() -> str:
+    """The current request's id, for log lines ("-" outside a request)."""
+    trace = _trace.get()
+    return trace.request_id if trace is not None else "-"
+
+
+def current_span():
+    """The innermost open span, for adding attributes to it."""
+    span_ = _span.get()
+    return span_ if span_ is not None else NOOP_SPAN
+
+
+def is_recording() -> bool:
+    trace = _trace.get()
+    return trace is not None and trace.recording
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    trace = _trace.get()
+    if trace is None or not trace.recording:
+        yield NOOP_SPAN
+        return
+    parent = _span.get()
+    s = Span(name, kind, parent.span_id if parent is not None else _remote_parent.get(), attributes)
+    token = _span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _span.reset(token)
+        s.finish()
+        trace.spans.append(s)
+
+
+def record_span(name: str, start_ns: int, duration_ns: int, kind: int = KIND_INTERNAL, **attributes):
+    """Adds an already-timed span (for callback-style hooks such as DB cursor events)."""
+    trace = _trace.get()
+    if trace is None or not trace.recording:
+        return
+    parent = _span.get()
+    s = Span(name, kind, parent.span_id if parent is not None else None, attributes)
+    s.start_ns, s.end_ns = start_ns, start_ns + duration_ns
+    trace.spans.append(s)
+
+
+def traced(name: str, kind: int = KIND_INTERNAL, result_attributes: Optional[Callable[[Any], Dict[str, Any]]] = None):
+    """Decorator: runs the (sync or async) function inside a span; `result_attributes` maps its return value to attributes."""
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind) as s:
+                    result = await fn(*args, **kwargs)
+                    if result_attributes is not None and s is not NOOP_SPAN:
+                        s.set(**result_attributes(result))
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind) as s:
+                result = fn(*args, **kwargs)
+                if result_attributes is not None and s is not NOOP_SPAN:
+                    s.set(**result_attributes(result))
+                return result
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def start_trace(name: str, request_id: Optional[str] = None, kind: int = KIND_SERVER,
+                parent: Optional[Tuple[str, str]] = None, **attributes):
+    """
+    Opens a trace and its root span. `parent` is an upstream (trace_id, span_id)
+    from a W3C traceparent header; the trace then continues the caller's trace.
+    """
+    trace_id, remote_parent = parent or (uuid.uuid4().hex, None)
+    trace = Trace(trace_id, request_id or trace_id[:16], _exporter is not None)
+    trace_token = _trace.set(trace)
+    parent_token = _remote_parent.set(remote_parent)
+    try:
+        with span(name, kind, **attributes) as root:
+            yield root
+    finally:
+        _remote_parent.reset(parent_token)
+        _trace.reset(trace_token)
+        if trace.recording and trace.spans and trace.spans[-1].duration_ms >= TRACE_SLOW_MS:
+            try:
+                _exporter.export(trace)
+            except Exception as e:
+                print(f"⚠️ WARNING: Trace export failed: {e}")
+
+
+# ── EXPORTERS ──
+class SpanExporter:
+    def export(self, trace: Trace):
+        raise NotImplementedError
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def otlp_payload(trace: Trace) -> Dict[str, Any]:
+    """One OTLP/JSON ExportTraceServiceRequest holding every span of the trace."""
+    spans = []
+    for s in trace.spans:
+        entry = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": s.kind,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": _otlp_attributes({"request.id": trace.request_id, **s.attributes}),
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            entry["parentSpanId"] = s.parent_id
+        spans.append(entry)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})},
+        "scopeSpans": [{"scope": {"name": "src.tracing"}, "spans": spans}],
+    }]}
+
+
+class OTLPFileExporter(SpanExporter):
+    """
+    Appends one OTLP/JSON line per trace (the OpenTelemetry collector's file
+    exporter format), readable by `otelcol` file receivers or plain jq.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = dumps(otlp_payload(trace)) + b"\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, 'ab')
+            self._file.write(line)  # one write per trace keeps worker lines whole
+            self._file.flush()
+
+
+class LogExporter(SpanExporter):
+    """Prints the root span and its direct children, one line per request."""
+
+    def export(self, trace: Trace):
+        root = trace.spans[-1]
+        stages = " | ".join(f"{s.name} {s.duration_ms:.1f}" for s in trace.spans if s.parent_id == root.span_id)
+        print(f"🧭 TRACE [{trace.request_id}] {root.name} {root.duration_ms:.1f} ms: {stages or '-'}")
+
+
+_exporter: Optional[SpanExporter] = None
+
+
+def set_exporter(exporter: Optional[SpanExporter]):
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    return _exporter
+
+
+def exporter_from_env(name: str = TRACE_EXPORTER) -> Optional[SpanExporter]:
+    if name == "otlp-file":
+        return OTLPFileExporter(TRACE_FILE)
+    if name == "log":
+        return LogExporter()
+    if name not in ("", "none"):
+        print(f"⚠️ WARNING: Unknown FMS_TRACE_EXPORTER '{name}', tracing disabled")
+    return None
+
+
+set_exporter(exporter_from_env())
+
+
+# ── ASGI MIDDLEWARE ──
+def parse_traceparent(value: Optional[bytes]) -> Optional[Tuple[str, str]]:
+    match = _TRACEPARENT_RE.match(value.decode('latin-1')) if value else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+class TraceMiddleware:
+    """
+    Opens the request's trace. Honours an incoming X-Request-ID (and W3C
+    traceparent) and echoes the request id back in X-Request-ID.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = headers.get(b"x-request-id", b"").decode('latin-1')
+        rid = incoming if _REQUEST_ID_RE.match(incoming) else None
+        method, path = scope["method"], scope["path"]
+
+        with start_trace(f"{method} {path}", request_id=rid, parent=parse_traceparent(headers.get(b"traceparent")),
+                         **{"http.method": method, "http.target": path}) as root:
+            rid_header = request_id().encode('latin-1')
+
+            async def send_with_id(message):
+                if message["type"] == "http.response.start":
+                    root.set(**{"http.status_code": message["status"]})
+                    message["headers"] = [*message.get("headers", []), (b"x-request-id", rid_header)]
+                await send(message)
+
+            await self.app(scope, receive, send_with_id)
+            route = scope.get("route")
+            if route is not None and root is not NOOP_SPAN:
+                root.name = f"{method} {getattr(route, 'path', path)}"
+                root.set(**{"http.route": getattr(route, "path", path)})
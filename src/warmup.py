@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from typing import Dict, Any
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from src.database import engine, DB_POOL_MIN, AsyncSessionLocal, AssessmentInput, AssessmentScore
+from src.blobs import encode_blob, store_blobs
+from src.rag.knowledge_base import load_knowledge_base, KB_SOURCE
+from src.rag.retriever import precompute_retrieval_cache, PRECOMPUTE_AT_STARTUP
+from src.rag.generator import preload_llm_stack, prime_llm_connection
+from src.plan_index import warm_plan_index
+from src.cache import shared_cache
+
+# --- CONFIGURATION ---
+WARMUP_ENABLED = os.getenv("FMS_WARMUP", "1") == "1"
+LLM_PRIME_TIMEOUT_S = float(os.getenv("FMS_LLM_PRIME_TIMEOUT_S", "5"))
+
+# Components that must be warm before /readyz reports ready. The LLM is not
+# required: if priming fails, requests still get the deterministic fallback.
+REQUIRED_COMPONENTS = ("knowledge_base", "db_pool")
+
+
+class ReadinessState:
+    def __init__(self):
+        self.components: Dict[str, str] = {"knowledge_base": "pending", "db_pool": "pending", "llm": "pending",
+                                           "plan_index": "pending", "shared_cache": "pending"}
+        self.durations_ms: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.components[c] == "ready" for c in REQUIRED_COMPONENTS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "components": self.components,
+            "durations_ms": self.durations_ms,
+            "errors": self.errors,
+            "warmup_finished_at": self.finished_at,
+        }
+
+
+readiness = ReadinessState()
+
+
+async def _timed(component: str, step):
+    started = time.perf_counter()
+    try:
+        ok = await step()
+        readiness.components[component] = "ready" if ok is not False else "degraded"
+    except Exception as e:
+        readiness.components[component] = "failed"
+        readiness.errors[component] = str(e)
+        print(f"⚠️ Warmup of {component} failed: {e}")
+    readiness.durations_ms[component] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def warm_knowledge_base() -> bool:
+    if KB_SOURCE == "db":
+        from src.rag.catalog import refresh_catalog  # file-backed serving never imports the catalog
+        await refresh_catalog(force=True)
+    # Parsing/indexing runs in a thread; the cache itself is only touched on the loop
+    kb = await asyncio.to_thread(load_knowledge_base)
+    if not kb:
+        raise RuntimeError("Knowledge base could not be loaded")
+    if PRECOMPUTE_AT_STARTUP:
+        precompute_retrieval_cache(kb)
+    return True
+
+
+async def warm_db_pool(connections: int = DB_POOL_MIN) -> bool:
+    """Opens `connections` pooled connections at once, so they stay checked in for the first requests."""
+    conns = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    try:
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in conns))
+
+    # Mapper configuration and INSERT compilation happen on the first flush;
+    # do one inside a transaction that is rolled back so requests don't pay it.
+    configure_mappers()
+    async with AsyncSessionLocal() as db:
+        blob = encode_blob({})
+        await store_blobs(db, [blob])
+        input_entry = AssessmentInput(raw_hash=blob["hash"])
+        db.add(input_entry)
+        await db.flush()
+        db.add(AssessmentScore(input_id=input_entry.id, workout_hash=blob["hash"]))
+        await db.flush()
+        await db.rollback()
+    return True
+
+
+async def warm_llm() -> bool:
+    await asyncio.to_thread(preload_llm_stack)
+    return await prime_llm_connection(timeout_s=LLM_PRIME_TIMEOUT_S)
+
+
+async def run_warmup():
+    if not WARMUP_ENABLED:
+        for component in readiness.components:
+            readiness.components[component] = "ready"
+        readiness.finished_at = time.time()
+        return
+
+    print("🔥 Warmup: loading KB, opening DB pool, priming LLM connection...")
+    await asyncio.gather(
+        _timed("knowledge_base", warm_knowledge_base),
+        _timed("db_pool", warm_db_pool),
+        _timed("llm", warm_llm),
+        # Opens the L2 connection/file; "degraded" means L1 only, which still serves
+        _timed("shared_cache", shared_cache.ping),
+    )
+    # Needs the KB and the pool; not required for readiness, requests just miss until it is done
+    await _timed("plan_index", warm_plan_index)
+    readiness.finished_at = time.time()
+    print(f"✅ Warmup finished: {readiness.components} in {readiness.durations_ms} ms")
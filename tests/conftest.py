@@ -0,0 +1,35 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Every test process gets its own SQLite DB and shared-cache file: set before
+# src.database / src.cache are imported, so a developer's .env is never touched
+_workdir = tempfile.mkdtemp(prefix="fms-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_workdir, 'tests.db')}"
+os.environ["FMS_CACHE_PATH"] = os.path.join(_workdir, "shared_cache.sqlite")
+os.environ["FMS_LLM_BACKEND"] = "stub"
+
+
+@pytest.fixture
+def run_db():
+    """Runs a coroutine on a fresh event loop against freshly created, empty tables."""
+    from src import blobs
+    from src.database import engine, Base
+
+    def run(coro):
+        blobs._known.clear()  # hashes committed to an earlier test's tables
+
+        async def scenario():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+            try:
+                return await coro
+            finally:
+                await engine.dispose()  # pooled connections belong to this loop
+
+        return asyncio.run(scenario())
+
+    return run
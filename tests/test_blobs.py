@@ -0,0 +1,143 @@
+import copy
+
+import pytest
+from sqlalchemy import select, func
+
+from src import blobs
+from src.blobs import encode_blob, profile_blob, store_blobs, remember_blobs, with_blob, read_blob, read_profile
+from src.database import AsyncSessionLocal, AssessmentInput, AssessmentScore, ContentBlob
+from src.logic.fms_analyzer import analyze_fms_profile
+from src.pipeline import save_assessment
+from benchmarks.first_request import SAMPLE_PROFILE
+
+# Content-addressed storage of raw profiles and plans: what is written must
+# read back unchanged, identical content must share one row, and rows from
+# before content_blobs must still read.
+
+PLAN = {"session_title": "Level 5 Squat Patterning", "difficulty_color": "Yellow",
+        "exercises": [{"name": "Goblet Squat", "sets_reps": "3 x 10"}]}
+
+
+def athlete(athlete_id: str):
+    return {**copy.deepcopy(SAMPLE_PROFILE), "athlete_id": athlete_id}
+
+
+async def stored_inputs():
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            with_blob(select(AssessmentInput.id, AssessmentInput.athlete_id, AssessmentInput.raw_hash,
+                             AssessmentInput.raw_json_data), AssessmentInput.raw_hash, "raw")
+            .order_by(AssessmentInput.id)
+        )).all()
+
+
+async def blob_count():
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(ContentBlob))).scalar()
+
+
+@pytest.mark.parametrize("codec", ["zstd", "zlib"])
+def test_encode_store_read_round_trip(run_db, monkeypatch, codec):
+    if codec == "zstd" and blobs.zstandard is None:
+        pytest.skip("zstandard not installed")
+    monkeypatch.setattr(blobs, "BLOB_CODEC", codec)
+
+    async def scenario():
+        blob = encode_blob(PLAN)
+        async with AsyncSessionLocal() as db:
+            await store_blobs(db, [blob])
+            await db.commit()
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                with_blob(select(ContentBlob.raw_size), ContentBlob.hash, "plan").where(ContentBlob.hash == blob["hash"])
+            )).one()
+        assert row.plan_codec == codec
+        assert row.raw_size == len(blob["raw"])
+        assert read_blob(row, "plan") == PLAN
+
+    run_db(scenario())
+
+
+def test_saved_assessment_reads_back_unchanged(run_db):
+    async def scenario():
+        full_data = athlete("ath-1")
+        async with AsyncSessionLocal() as db:
+            score = await save_assessment(db, full_data, analyze_fms_profile(full_data), PLAN)
+
+        [row] = await stored_inputs()
+        assert row.raw_json_data is None  # new rows never write the legacy column
+        assert read_profile(row, "raw", row.raw_json_data, row.athlete_id) == full_data
+        async with AsyncSessionLocal() as db:
+            plan_row = (await db.execute(
+                with_blob(select(AssessmentScore.generated_workout), AssessmentScore.workout_hash, "plan")
+                .where(AssessmentScore.id == score.id)
+            )).one()
+        assert read_blob(plan_row, "plan", plan_row.generated_workout) == PLAN
+
+    run_db(scenario())
+
+
+def test_identical_content_shares_one_hash_and_row(run_db):
+    async def scenario():
+        for athlete_id in ("ath-1", "ath-2", "ath-1"):
+            full_data = athlete(athlete_id)
+            async with AsyncSessionLocal() as db:
+                await save_assessment(db, full_data, analyze_fms_profile(full_data), PLAN)
+
+        rows = await stored_inputs()
+        assert len({row.raw_hash for row in rows}) == 1  # athlete_id lives in its own column
+        assert [read_profile(row, "raw", None, row.athlete_id)["athlete_id"] for row in rows] == ["ath-1", "ath-2", "ath-1"]
+        assert await blob_count() == 2  # one profile, one plan
+
+        # Key order does not matter, and a process that never saw the hash still stores no duplicate
+        reordered = dict(reversed(list(profile_blob(athlete("ath-3")).items())))
+        assert encode_blob(reordered)["hash"] == rows[0].raw_hash
+        blobs._known.clear()
+        async with AsyncSessionLocal() as db:
+            await store_blobs(db, [encode_blob(reordered), encode_blob(reordered)])
+            await db.commit()
+        assert await blob_count() == 2
+
+        other = athlete("ath-4")
+        other["overhead_squat"]["score"] = 1
+        assert encode_blob(profile_blob(other))["hash"] != rows[0].raw_hash
+
+    run_db(scenario())
+
+
+def test_rolled_back_blob_is_written_again(run_db):
+    async def scenario():
+        blob = encode_blob(PLAN)
+        async with AsyncSessionLocal() as db:
+            await store_blobs(db, [blob])
+            await db.rollback()
+        async with AsyncSessionLocal() as db:
+            await store_blobs(db, [blob])
+            await db.commit()
+        remember_blobs([blob])
+        assert await blob_count() == 1
+
+    run_db(scenario())
+
+
+@pytest.mark.parametrize("legacy", ["dict", "json string"])
+def test_legacy_row_without_raw_hash_still_reads(run_db, legacy):
+    async def scenario():
+        profile = profile_blob(athlete("ath-legacy"))
+        value = profile if legacy == "dict" else blobs.dumps(profile).decode()
+        async with AsyncSessionLocal() as db:
+            db.add(AssessmentInput(athlete_id="ath-legacy", raw_json_data=value, raw_hash=None))
+            await db.commit()
+
+        [row] = await stored_inputs()
+        assert row.raw_hash is None and row.raw_data is None
+        assert read_profile(row, "raw", row.raw_json_data, row.athlete_id) == {**profile, "athlete_id": "ath-legacy"}
+
+        # ... and reads the same once migrated into content_blobs
+        moved = await blobs.migrate_legacy()
+        assert moved["inputs"] == 1
+        [row] = await stored_inputs()
+        assert row.raw_hash is not None and row.raw_json_data is None
+        assert read_profile(row, "raw", row.raw_json_data, row.athlete_id) == {**profile, "athlete_id": "ath-legacy"}
+
+    run_db(scenario())
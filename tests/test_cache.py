@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from src import cache as cache_module, pipeline
+from src.cache import SQLiteBackend, TwoLevelCache
+from src.pipeline import plan_cache_key, plan_cacheable
+from src.rag.generator import build_fallback_plan
+
+# The shared cache on its offline backend: a SQLite file under tmp_path, opened
+# by several TwoLevelCache instances the way several workers would open it.
+
+PLAN = {"session_title": "Level 1 Corrective Session", "exercises": [{"name": "Deep Squat Hold"}]}
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """Returns new_worker(**kwargs): a TwoLevelCache with its own connection to one shared L2 file."""
+    path = str(tmp_path / "shared_cache.sqlite")
+    monkeypatch.setattr(cache_module, "open_backend", lambda backend: SQLiteBackend(path))
+    opened = []
+
+    def new_worker(**kwargs):
+        opened.append(TwoLevelCache(backend="sqlite", **kwargs))
+        return opened[-1]
+
+    yield new_worker
+    for worker in opened:
+        asyncio.run(worker.close())
+
+
+class Compute:
+    """Counts calls; optionally slow, and returns `value`."""
+
+    def __init__(self, value=PLAN, delay_s: float = 0.0):
+        self.value, self.delay_s, self.calls = value, delay_s, 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay_s)
+        return self.value
+
+
+def test_sqlite_backend_expires_entries(tmp_path):
+    async def scenario():
+        backend = SQLiteBackend(str(tmp_path / "kv.sqlite"))
+        await backend.set("fms:plan:v1:a", b"short", 0.05)
+        await backend.set("fms:plan:v1:b", b"long", 60)
+        assert await backend.get("fms:plan:v1:a") == b"short"
+        await asyncio.sleep(0.1)
+        assert await backend.get("fms:plan:v1:a") is None
+        assert await backend.get("fms:plan:v1:b") == b"long"
+        assert await backend.purge() == 1
+        # An expired lease no longer blocks add()
+        assert await backend.add("fms:lease", b"one", 0.05)
+        assert not await backend.add("fms:lease", b"two", 60)
+        await asyncio.sleep(0.1)
+        assert await backend.add("fms:lease", b"two", 60)
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_l1_expires_and_falls_through_to_l2(workers):
+    async def scenario():
+        first, second = workers(l1_ttl_s=0.05), workers()
+        compute = Compute()
+        key = plan_cache_key("fingerprint", "kb-1")
+        assert await first.get_or_compute(key, compute, ttl_s=60) == (PLAN, "computed")
+        assert (await first.get_or_compute(key, compute, ttl_s=60))[1] == "l1"
+        assert (await second.get_or_compute(key, compute, ttl_s=60))[1] == "l2"  # another worker's value
+        assert (await second.get_or_compute(key, compute, ttl_s=60))[1] == "l1"
+        await asyncio.sleep(0.1)  # first's L1 entry is capped at l1_ttl_s, L2 still has it
+        assert (await first.get_or_compute(key, compute, ttl_s=60))[1] == "l2"
+        assert compute.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_l2_ttl_expiry_recomputes(workers):
+    async def scenario():
+        worker = workers()
+        compute = Compute()
+        key = plan_cache_key("fingerprint", "kb-1")
+        await worker.get_or_compute(key, compute, ttl_s=0.05)
+        await asyncio.sleep(0.1)
+        assert (await worker.get_or_compute(key, compute, ttl_s=0.05))[1] == "computed"
+        assert compute.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_kb_or_prompt_version_bump_misses(workers, monkeypatch):
+    async def scenario():
+        worker = workers()
+        compute = Compute()
+        await worker.get_or_compute(plan_cache_key("fingerprint", "kb-1"), compute, ttl_s=60)
+        assert (await worker.get_or_compute(plan_cache_key("fingerprint", "kb-1"), compute, ttl_s=60))[1] == "l1"
+        assert (await worker.get_or_compute(plan_cache_key("fingerprint", "kb-2"), compute, ttl_s=60))[1] == "computed"
+        monkeypatch.setattr(pipeline, "GENERATOR_ID", "stub:llama-3.3-70b-versatile:prompt-v2")
+        assert (await worker.get_or_compute(plan_cache_key("fingerprint", "kb-1"), compute, ttl_s=60))[1] == "computed"
+        assert compute.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_callers_in_one_worker_compute_once(workers):
+    async def scenario():
+        worker = workers()
+        compute = Compute(delay_s=0.05)
+        key = plan_cache_key("fingerprint", "kb-1")
+        results = await asyncio.gather(*(worker.get_or_compute(key, compute, ttl_s=60) for _ in range(5)))
+        assert compute.calls == 1
+        assert sorted(source for _, source in results) == ["computed"] + ["shared"] * 4
+        assert all(value == PLAN for value, _ in results)
+
+    asyncio.run(scenario())
+
+
+def test_lease_makes_other_workers_wait_for_the_holder(workers):
+    async def scenario():
+        holder, waiter = workers(), workers()
+        slow, fast = Compute(delay_s=0.2), Compute()
+        key = plan_cache_key("fingerprint", "kb-1")
+        held = asyncio.create_task(holder.get_or_compute(key, slow, ttl_s=60))
+        await asyncio.sleep(0.05)  # holder has taken the lease
+        assert await waiter.get_or_compute(key, fast, ttl_s=60) == (PLAN, "l2")
+        assert (await held)[1] == "computed"
+        assert (slow.calls, fast.calls) == (1, 0)
+        assert waiter.counters["lease_waits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiter_takes_the_lease_over_when_the_holder_stores_nothing(workers):
+    async def scenario():
+        holder, waiter = workers(), workers()
+        fallback = build_fallback_plan([], "llm_error")
+        failing, healthy = Compute(value=fallback, delay_s=0.1), Compute()
+        key = plan_cache_key("fingerprint", "kb-1")
+        held = asyncio.create_task(holder.get_or_compute(key, failing, ttl_s=60, cacheable=plan_cacheable))
+        await asyncio.sleep(0.02)
+        value, source = await waiter.get_or_compute(key, healthy, ttl_s=60, cacheable=plan_cacheable,
+                                                    max_wait_s=5)
+        assert (value, source) == (PLAN, "computed")
+        assert (await held)[0]["fallback_reason"] == "llm_error"
+        assert waiter.counters["lease_waits"] == 1 and waiter.counters["lease_timeouts"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_computes_after_max_wait_when_the_holder_died(workers):
+    async def scenario():
+        waiter = workers()
+        key = plan_cache_key("fingerprint", "kb-1")
+        l2 = waiter.l2()
+        await l2.add(f"{key}:lease", b"dead worker", 60)  # never released
+        assert (await waiter.get_or_compute(key, Compute(), ttl_s=60, max_wait_s=0.1))[1] == "computed"
+        assert waiter.counters["lease_timeouts"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_fallback_plans_are_not_stored(workers):
+    async def scenario():
+        first, second = workers(), workers()
+        fallback = Compute(value=build_fallback_plan([{"exercise_name": "Deep Squat Hold"}], "circuit_open"))
+        key = plan_cache_key("fingerprint", "kb-1")
+        for worker in (first, first, second):
+            value, source = await worker.get_or_compute(key, fallback, ttl_s=60, cacheable=plan_cacheable)
+            assert source == "computed" and value["fallback_reason"] == "circuit_open"
+        assert fallback.calls == 3
+        assert first.counters["not_stored"] == 2
+        assert not await first.contains(key)
+
+    asyncio.run(scenario())
@@ -0,0 +1,104 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from src.database import AsyncSessionLocal, AssessmentScore
+from src.pipeline import fetch_athlete_history, encode_cursor, decode_cursor
+
+# Keyset pagination of athlete history on (created_at, id), over a temporary
+# SQLite DB. Ties on created_at are the case OFFSET-free paging gets wrong.
+
+T0 = datetime(2024, 3, 1, 9, 0, tzinfo=timezone.utc)
+
+
+async def add_scores(athlete_id: str, timestamps):
+    async with AsyncSessionLocal() as db:
+        rows = [AssessmentScore(athlete_id=athlete_id, created_at=ts, overhead_squat=2, total_score=14)
+                for ts in timestamps]
+        db.add_all(rows)
+        await db.commit()
+        return [(row.created_at, row.id) for row in rows]
+
+
+async def all_pages(athlete_id: str, limit: int):
+    pages, cursor = [], None
+    async with AsyncSessionLocal() as db:
+        while True:
+            page = await fetch_athlete_history(db, athlete_id, limit, cursor)
+            pages.append(page)
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+
+def test_pages_neither_overlap_nor_skip_on_timestamp_ties(run_db):
+    async def scenario():
+        # 3 rows share T0, 4 share T0 + 1 min; another athlete's rows interleave
+        rows = await add_scores("ath-1", [T0] * 3 + [T0 + timedelta(minutes=1)] * 4)
+        await add_scores("ath-2", [T0] * 2)
+        expected = [score_id for _, score_id in sorted(rows, key=lambda r: (r[0], r[1]), reverse=True)]
+
+        for limit in (1, 2, 3, 5, 7, 20):
+            pages = await all_pages("ath-1", limit)
+            ids = [item["id"] for page in pages for item in page["items"]]
+            assert ids == expected, f"limit={limit}"
+            assert all(len(page["items"]) == limit for page in pages[:-1])
+            assert pages[-1]["next_cursor"] is None
+
+    run_db(scenario())
+
+
+def test_exactly_full_last_page_has_no_next_cursor(run_db):
+    async def scenario():
+        await add_scores("ath-1", [T0 + timedelta(seconds=i) for i in range(6)])
+        pages = await all_pages("ath-1", 3)
+        assert [len(page["items"]) for page in pages] == [3, 3]
+        assert pages[0]["next_cursor"] is not None and pages[1]["next_cursor"] is None
+
+    run_db(scenario())
+
+
+def test_unknown_athlete_gets_an_empty_page(run_db):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            assert await fetch_athlete_history(db, "nobody", 20) == {"athlete_id": "nobody", "items": [],
+                                                                      "next_cursor": None}
+
+    run_db(scenario())
+
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor(T0, 42)) == (T0, 42)
+
+
+def b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",                         # not base64
+    b64(b"\xff\xfe"),                        # not UTF-8 JSON
+    b64(b"{broken"),                         # not JSON
+    b64(b"null"),                            # not a pair
+    b64(b"[1, 2, 3]"),                       # wrong arity
+    b64(b"[12, 3]"),                         # timestamp not a string
+    b64(b'["yesterday", 3]'),                # not an ISO timestamp
+    b64(b'["2024-03-01T09:00:00+00:00", "x"]'),  # id not an integer
+    b64(b'["2024-03-01T09:00:00+00:00", null]'),
+])
+def test_malformed_cursor_is_a_400(run_db, cursor):
+    import main
+
+    async def scenario():
+        await add_scores("ath-1", [T0])
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            response = await client.get("/athletes/ath-1/assessments", params={"cursor": cursor})
+            assert response.status_code == 400, response.text
+            assert response.json()["detail"].startswith("Invalid cursor")
+
+            ok = await client.get("/athletes/ath-1/assessments", params={"limit": 1})
+            assert ok.status_code == 200 and len(ok.json()["items"]) == 1
+
+    run_db(scenario())
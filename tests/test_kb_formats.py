@@ -0,0 +1,96 @@
+import json
+import random
+
+import pytest
+
+from src.database import AsyncSessionLocal
+from src.eval.retrieval_harness import load_golden, GOLDEN_PATH
+from src.rag import catalog, retriever
+from src.rag.catalog import import_catalog, read_catalog, CatalogKnowledgeBase
+from src.rag.kb_snapshot import build_from_json, MappedKnowledgeBase
+from src.rag.knowledge_base import JSON_KB_PATH, KnowledgeBase, read_knowledge_base
+from src.rag.progression import link_progressions
+from benchmarks.kb_memory import synthetic_kb
+
+# One source, three KB formats: the JSON file, its mmap snapshot and the
+# database catalog it is imported into must rank every query identically,
+# ties included (the synthetic KB has many equal scores at each level).
+
+VOCAB = sorted(set(retriever.FAULT_TO_TAG_MAP.values()) | set(retriever.TEST_PATTERN_TAGS.values()))
+
+
+def source_json(tmp_path, source: str) -> str:
+    if source == "workbook":
+        return JSON_KB_PATH
+    exercises = synthetic_kb(400)
+    link_progressions(exercises)
+    path = tmp_path / "synthetic.json"
+    path.write_text(json.dumps(exercises))
+    return str(path)
+
+
+def tag_sets(count: int, seed: int = 3):
+    rng = random.Random(seed)
+    for _ in range(count):
+        level = rng.choice(retriever.TARGET_LEVELS)
+        yield level, frozenset({f"level_{level}", *rng.sample(VOCAB, rng.randint(0, 5))})
+
+
+async def ranked_ids(kb, level, tags):
+    retriever.clear_retrieval_cache()  # the JSON and snapshot KBs share a version, so a hit would hide a difference
+    if isinstance(kb, CatalogKnowledgeBase):
+        top, hit = await retriever.cached_rank_in_catalog(kb, level, tags)
+    else:
+        top, hit = retriever.cached_rank(kb, level, tags)
+    assert not hit
+    return [ex["id"] for ex in top]
+
+
+async def profile_ids(kb, profile):
+    retriever.clear_retrieval_cache()
+    result = await retriever.get_exercises_by_profile(simple_scores={}, detailed_faults=profile, kb=kb)
+    assert result["status"] == "SUCCESS"
+    return [ex["id"] for ex in result["data"]]
+
+
+@pytest.mark.parametrize("hops", [0, 1, 2])
+@pytest.mark.parametrize("source", ["workbook", "synthetic"])
+def test_file_snapshot_and_catalog_retrieve_identically(run_db, tmp_path, monkeypatch, source, hops):
+    monkeypatch.setattr(catalog, "RANK_IN_DB", True)  # misses run the pushed-down SQL ranking
+    monkeypatch.setattr(retriever, "PROGRESSION_HOPS", hops)
+    fallbacks = []
+    rank_in_db = catalog.rank_in_catalog
+
+    async def answered_in_db(*args):
+        top = await rank_in_db(*args)
+        fallbacks.append(top is None)
+        return top
+
+    monkeypatch.setattr(catalog, "rank_in_catalog", answered_in_db)
+    json_path = source_json(tmp_path, source)
+    snapshot_path = str(tmp_path / "kb.kbs")
+    build_from_json(json_path, snapshot_path)
+
+    async def scenario():
+        file_kb, snapshot_kb = read_knowledge_base(json_path), read_knowledge_base(snapshot_path)
+        assert isinstance(file_kb, KnowledgeBase) and isinstance(snapshot_kb, MappedKnowledgeBase)
+        await import_catalog(list(file_kb.exercises))
+        async with AsyncSessionLocal() as db:
+            catalog_kb = await read_catalog(db, "")
+        assert len(file_kb) == len(snapshot_kb) == len(catalog_kb)
+
+        for case in load_golden(GOLDEN_PATH):
+            expected = await profile_ids(file_kb, case["profile"])
+            assert await profile_ids(snapshot_kb, case["profile"]) == expected, case["id"]
+            assert await profile_ids(catalog_kb, case["profile"]) == expected, case["id"]
+
+        for level, tags in tag_sets(150):
+            expected = await ranked_ids(file_kb, level, tags)
+            assert await ranked_ids(snapshot_kb, level, tags) == expected, (level, sorted(tags))
+            assert await ranked_ids(catalog_kb, level, tags) == expected, (level, sorted(tags))
+        assert fallbacks and not any(fallbacks)  # every catalog answer came from the SQL ranking
+
+    try:
+        run_db(scenario())
+    finally:
+        retriever.clear_retrieval_cache()
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+from src.rag import retriever
+from src.rag.kb_snapshot import build_from_json, MappedKnowledgeBase
+from src.rag.knowledge_base import KBRegistry, UnknownTenant
+from benchmarks.kb_memory import synthetic_kb
+
+# Per-tenant KBs in an LRU bounded by entry count and heap bytes: the least
+# recently used tenant goes first, and its ranking caches go with it.
+
+UNBOUNDED = 2**40
+
+
+def write_tenant(directory, tenant: str, seed: int, snapshot: bool = False):
+    path = directory / f"{tenant}.json"
+    path.write_text(json.dumps(synthetic_kb(60, seed=seed)))
+    if snapshot:
+        build_from_json(str(path), str(directory / f"{tenant}.kbs"))
+        os.remove(path)
+
+
+@pytest.fixture
+def tenants(tmp_path):
+    for seed, tenant in enumerate(["gym-a", "gym-b", "gym-c"]):
+        write_tenant(tmp_path, tenant, seed, snapshot=(tenant == "gym-b"))
+    yield tmp_path
+    retriever.clear_retrieval_cache()
+
+
+def resident(registry):
+    return list(registry.snapshot()["tenants"])
+
+
+def test_least_recently_used_tenant_is_evicted_at_capacity(tenants):
+    registry = KBRegistry(directory=str(tenants), max_bytes=UNBOUNDED, max_entries=2)
+    a, b = registry.get("gym-a"), registry.get("gym-b")
+    assert isinstance(b, MappedKnowledgeBase)
+    retriever.cached_rank(b, 5, {"level_5"})
+    assert registry.get("gym-a") is a  # a hit makes gym-a the most recent
+    assert resident(registry) == ["gym-b", "gym-a"]
+
+    registry.get("gym-c")
+    assert resident(registry) == ["gym-a", "gym-c"]
+    assert registry.counters["evictions"] == 1
+    assert (registry.counters["loads"], registry.counters["hits"]) == (3, 1)
+    assert retriever.retrieval_cache_stats()["entries"] == 0  # gym-b's rankings went with it
+
+    # An evicted tenant loads again, pushing out the now least recent gym-a
+    assert registry.get("gym-b") is not b
+    assert resident(registry) == ["gym-c", "gym-b"]
+    assert (registry.counters["loads"], registry.counters["evictions"]) == (4, 2)
+
+
+def test_byte_budget_evicts_but_keeps_the_tenant_just_loaded(tenants):
+    probe = KBRegistry(directory=str(tenants), max_bytes=UNBOUNDED)
+    sizes = {tenant: probe.get(tenant).heap_bytes() for tenant in ("gym-a", "gym-c")}
+
+    registry = KBRegistry(directory=str(tenants), max_bytes=sizes["gym-a"] + sizes["gym-c"] - 1, max_entries=10)
+    registry.get("gym-a")
+    registry.get("gym-c")
+    assert resident(registry) == ["gym-c"]
+
+    tight = KBRegistry(directory=str(tenants), max_bytes=1, max_entries=10)
+    tight.get("gym-a")
+    assert resident(tight) == ["gym-a"]  # alone over budget, still served
+
+
+def test_changed_file_reloads_in_place(tenants):
+    registry = KBRegistry(directory=str(tenants), max_bytes=UNBOUNDED, max_entries=2)
+    before = registry.get("gym-a")
+    registry.get("gym-c")
+    write_tenant(tenants, "gym-a", seed=9)
+    after = registry.get("gym-a")
+    assert after.version != before.version
+    assert registry.counters["reloads"] == 1 and registry.counters["evictions"] == 0
+    assert resident(registry) == ["gym-c", "gym-a"]
+
+
+@pytest.mark.parametrize("tenant", ["gym-z", "../gym-a", "gym a", ""])
+def test_unknown_or_invalid_tenant_raises(tenants, tenant):
+    registry = KBRegistry(directory=str(tenants), max_bytes=UNBOUNDED)
+    with pytest.raises(UnknownTenant):
+        registry.get(tenant)
+    assert registry.counters["unknown"] == 1 and resident(registry) == []
@@ -0,0 +1,162 @@
+import pytest
+
+from src import plan_index as plan_index_module
+from src.database import AsyncSessionLocal
+from src.pipeline import save_assessment, plan_fingerprint, plan_cacheable
+from src.plan_index import PlanIndex, find_similar_plan, remember_plan, plan_tokens, jaccard
+from src.rag.generator import build_fallback_plan
+
+# Near-duplicate plan reuse: which stored plan (if any) an athlete is served.
+# Tokens are the active faults plus one "test=score" per FMS test, so with the
+# seven score tokens below a profile carries 7 + len(faults) tokens.
+
+SCORES = {"overhead_squat": 1, "hurdle_step": 2, "inline_lunge": 2, "shoulder_mobility": 3,
+          "active_straight_leg_raise": 3, "trunk_stability_pushup": 3, "rotary_stability": 2}
+FAULTS = ["overhead_squat.feet.heels_lift", "overhead_squat.lower_limb.knee_valgus",
+          "overhead_squat.trunk_torso.excessive_forward_lean", "hurdle_step.stepping_leg.toe_drag",
+          "inline_lunge.balance_stability.loss_of_balance", "rotary_stability.spinal_control.lumbar_flexion"]
+EXERCISES = [{"id": "ex-goblet-squat"}, {"id": "ex-ankle-rocks"}, {"id": "ex-dead-bug"}]
+PLAN = {"session_title": "Level 5 Squat Patterning", "exercises": [{"name": "Goblet Squat"}]}
+
+
+@pytest.fixture(autouse=True)
+def empty_index(monkeypatch):
+    index = PlanIndex()
+    monkeypatch.setattr(plan_index_module, "plan_index", index)
+    monkeypatch.setattr(plan_index_module, "SIMILAR_REUSE", True)
+    return index
+
+
+def profile(faults, athlete_id="ath-1"):
+    data = {"athlete_id": athlete_id}
+    for fault in faults:
+        test, category, field = fault.split(".")
+        data.setdefault(test, {}).setdefault(category, {})[field] = 1
+    # A normal-movement marker is not a fault token
+    data.setdefault("overhead_squat", {}).setdefault("trunk_torso", {})["upright_torso"] = 1
+    return data
+
+
+def analysis(target_level=5, **scores):
+    return {"status": "PATTERN", "target_level": target_level, "effective_scores": {**SCORES, **scores}}
+
+
+async def generate_and_save(full_data, plan=PLAN, analysis_=None, exercises=EXERCISES):
+    """What /generate-workout does on a miss: save the generated plan, then index it."""
+    analysis_ = analysis_ or analysis()
+    async with AsyncSessionLocal() as db:
+        score = await save_assessment(db, full_data, analysis_, plan,
+                                      fingerprint=plan_fingerprint(full_data, analysis_, exercises))
+    remember_plan(full_data, analysis_, exercises, score)
+    return score
+
+
+async def similar(full_data, analysis_=None, exercises=EXERCISES):
+    async with AsyncSessionLocal() as db:
+        return await find_similar_plan(db, full_data, analysis_ or analysis(), exercises)
+
+
+def similarity(faults_a, faults_b, **scores_b):
+    a = plan_tokens(profile(faults_a), analysis())
+    b = plan_tokens(profile(faults_b), analysis(**scores_b))
+    index = PlanIndex()
+    return jaccard(index.mask(a), index.mask(b))
+
+
+def test_near_duplicate_above_threshold_reuses_the_plan(run_db, empty_index):
+    async def scenario():
+        score = await generate_and_save(profile(FAULTS))
+        near = FAULTS[:-1]  # one fault fewer: 12/13 tokens shared
+        assert similarity(FAULTS, near) == pytest.approx(12 / 13)
+
+        found = await similar(profile(near, athlete_id="ath-2"))
+        assert found is not None
+        assessment_id, plan = found
+        assert assessment_id == score.id
+        assert plan == {**PLAN, "reuse_similarity": round(12 / 13, 3)}
+        assert empty_index.counters["similar_hits"] == 1
+
+    run_db(scenario())
+
+
+def test_identical_tokens_are_an_exact_hit(run_db, empty_index):
+    async def scenario():
+        await generate_and_save(profile(FAULTS))
+        _, plan = await similar(profile(FAULTS, athlete_id="ath-2"))
+        assert plan["reuse_similarity"] == 1.0
+        assert empty_index.counters["exact_hits"] == 1
+
+    run_db(scenario())
+
+
+def test_below_threshold_is_not_reused(run_db):
+    async def scenario():
+        await generate_and_save(profile(FAULTS))
+        far = FAULTS[:3] + ["trunk_stability_pushup.body_alignment.sagging_hips"]
+        assert similarity(FAULTS, far) < plan_index_module.SIMILARITY_THRESHOLD
+        assert await similar(profile(far)) is None
+        # Same faults, two scores changed: also below
+        assert similarity(FAULTS, FAULTS, hurdle_step=1, inline_lunge=1) < plan_index_module.SIMILARITY_THRESHOLD
+        assert await similar(profile(FAULTS), analysis(hurdle_step=1, inline_lunge=1)) is None
+
+    run_db(scenario())
+
+
+def test_other_target_level_or_exercises_are_not_reused(run_db):
+    async def scenario():
+        await generate_and_save(profile(FAULTS))
+        # Identical tokens, but the LLM would have been asked for another level or other exercises
+        assert await similar(profile(FAULTS), analysis(target_level=7)) is None
+        assert await similar(profile(FAULTS), exercises=list(reversed(EXERCISES))) is None
+        assert await similar(profile(FAULTS), exercises=EXERCISES[:2]) is None
+        assert await similar({**profile(FAULTS), "tenant_id": "gym42"}) is None
+
+    run_db(scenario())
+
+
+def test_fallback_and_reused_plans_are_never_indexed(run_db, empty_index):
+    async def scenario():
+        await generate_and_save(profile(FAULTS), plan=build_fallback_plan([], "circuit_open"))
+        await generate_and_save(profile(FAULTS), plan=build_fallback_plan([], "config_error"))
+        await generate_and_save(profile(FAULTS), plan={**PLAN, "reuse_similarity": 0.9})
+        assert len(empty_index) == 0
+        assert await similar(profile(FAULTS)) is None
+
+    run_db(scenario())
+
+
+@pytest.mark.parametrize("error_plan", [
+    build_fallback_plan([], "llm_error"),
+    {"session_title": "Config Error", "exercises": []},  # stored before it became a config_error fallback
+])
+def test_error_plan_is_evicted_on_lookup(run_db, empty_index, error_plan):
+    async def scenario():
+        assert not plan_cacheable(error_plan)
+        # A row saved before fallbacks were excluded: fingerprinted, so warm_plan_index indexes it
+        async with AsyncSessionLocal() as db:
+            score = await save_assessment(db, profile(FAULTS), analysis(), error_plan)
+        tokens = plan_tokens(profile(FAULTS), analysis())
+        empty_index.add(plan_index_module.plan_partition(profile(FAULTS), analysis(), EXERCISES), tokens,
+                        score.workout_hash, score.id)
+        assert len(empty_index) == 1
+
+        assert await similar(profile(FAULTS[:-1])) is None
+        assert len(empty_index) == 0  # discarded, not just skipped
+        assert await similar(profile(FAULTS[:-1])) is None
+        assert empty_index.counters["misses"] == 1
+
+        # A real plan generated afterwards is served again
+        await generate_and_save(profile(FAULTS))
+        assert (await similar(profile(FAULTS[:-1])))[1]["session_title"] == PLAN["session_title"]
+
+    run_db(scenario())
+
+
+def test_index_stays_bounded():
+    index = PlanIndex(max_entries=2)
+    partition = ("", 5, ("ex-goblet-squat",))
+    for i in range(3):
+        index.add(partition, frozenset({f"overhead_squat={i}"}), f"hash-{i}")
+    assert len(index) == 2
+    assert index.lookup(partition, frozenset({"overhead_squat=0"})) is None  # oldest evicted
+    assert index.lookup(partition, frozenset({"overhead_squat=2"}))[0].workout_hash == "hash-2"
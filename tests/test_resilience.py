@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pytest
+
+from src.rag import generator
+from src.rag.llm_stub import StubPlanChain
+from src.rag.resilience import CircuitBreaker, Deadline, hedged_call
+
+# Usage: python -m pytest tests
+#
+# The LLM stage against the stub provider: circuit breaker, hedging and the
+# per-request deadline. No network, no database.
+
+EXERCISES = [{"exercise_name": f"Exercise {i}", "difficulty_level": 1, "tags": ["level_1"]} for i in range(3)]
+ANALYSIS = {"status": "MOBILITY", "target_level": 1}
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Stub provider with a fresh breaker; `llm.use(...)` sets the StubPlanChain the next calls get."""
+
+    class Provider:
+        chain = StubPlanChain(EXERCISES, latency_ms=1)
+
+        def use(self, **knobs):
+            self.chain = StubPlanChain(EXERCISES, **knobs)
+
+    provider = Provider()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=0.05)
+    monkeypatch.setattr(generator, "LLM_BACKEND", "stub")
+    monkeypatch.setattr(generator, "LLM_RESERVE_S", 0.0)
+    monkeypatch.setattr(generator, "LLM_MIN_TIMEOUT_S", 0.05)
+    monkeypatch.setattr(generator, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(generator, "llm_breaker", breaker)
+    monkeypatch.setattr(generator, "build_chain", lambda api_key, exercises: provider.chain)
+    provider.breaker = breaker
+    return provider
+
+
+def generate(budget_s: float = 5.0):
+    return generator.generate_workout_plan(ANALYSIS, EXERCISES, deadline=Deadline(budget_s))
+
+
+def test_breaker_opens_half_opens_and_recovers(llm):
+    async def scenario():
+        llm.use(latency_ms=1, failure_rate=1.0)
+        for _ in range(2):
+            assert (await generate())["fallback_reason"] == "llm_error"
+        assert llm.breaker.state == CircuitBreaker.OPEN
+
+        llm.use(latency_ms=1)
+        assert (await generate())["fallback_reason"] == "circuit_open"  # healthy, but not tried yet
+
+        await asyncio.sleep(0.06)
+        plan = await generate()
+        assert "fallback_reason" not in plan
+        assert llm.breaker.snapshot() == {"state": CircuitBreaker.CLOSED, "consecutive_failures": 0}
+
+    asyncio.run(scenario())
+
+
+def test_failed_half_open_probe_reopens(llm):
+    async def scenario():
+        llm.use(latency_ms=1, failure_rate=1.0)
+        for _ in range(2):
+            await generate()
+        await asyncio.sleep(0.06)
+        assert (await generate())["fallback_reason"] == "llm_error"
+        assert llm.breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(scenario())
+
+
+def test_half_open_admits_one_probe_at_a_time():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0.0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_deadline_falls_back_and_counts_as_failure(llm):
+    async def scenario():
+        llm.use(hang_rate=1.0)
+        started = time.monotonic()
+        plan = await generate(budget_s=0.2)
+        assert plan["fallback_reason"] == "deadline_exceeded"
+        assert time.monotonic() - started < 1.0
+        assert llm.breaker.consecutive_failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_spent_budget_skips_the_call(llm):
+    async def scenario():
+        assert (await generate(budget_s=0.01))["fallback_reason"] == "budget_exhausted"
+        assert llm.breaker.consecutive_failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_half_open_probe_releases_its_slot(llm):
+    async def scenario():
+        llm.use(latency_ms=1, failure_rate=1.0)
+        for _ in range(2):
+            await generate()
+        await asyncio.sleep(0.06)
+
+        llm.use(hang_rate=1.0)
+        probe = asyncio.create_task(generate())
+        await asyncio.sleep(0.02)
+        assert llm.breaker.state == CircuitBreaker.HALF_OPEN
+        assert llm.breaker.half_open_in_flight == 1
+        probe.cancel()  # client disconnected mid-call
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert llm.breaker.half_open_in_flight == 0
+
+        # The next request may probe again and closes the circuit
+        llm.use(latency_ms=1)
+        assert "fallback_reason" not in await generate()
+        assert llm.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_hedge_returns_the_fast_call_and_cancels_the_slow_one():
+    async def scenario():
+        hanging, fast = StubPlanChain(EXERCISES, hang_rate=1.0), StubPlanChain(EXERCISES, latency_ms=1)
+        calls = []
+
+        async def make_call():
+            chain = hanging if not calls else fast
+            calls.append(asyncio.current_task())
+            return await chain.ainvoke({"level": "1"})
+
+        plan = await hedged_call(make_call, hedge_after_s=0.02)
+        assert plan["session_title"] == "Level 1 Corrective Session"
+        assert len(calls) == 2
+        await asyncio.sleep(0)  # let the cancellation land
+        assert calls[0].cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_when_the_primary_is_fast():
+    async def scenario():
+        calls = []
+
+        async def make_call():
+            calls.append(1)
+            return await StubPlanChain(EXERCISES, latency_ms=1).ainvoke({"level": "1"})
+
+        await hedged_call(make_call, hedge_after_s=0.5)
+        assert calls == [1]
+
+    asyncio.run(scenario())
+
+
+def test_caller_cancellation_cancels_every_hedge():
+    async def scenario():
+        calls = []
+
+        async def make_call():
+            calls.append(asyncio.current_task())
+            return await StubPlanChain(EXERCISES, hang_rate=1.0).ainvoke({})
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged_call(make_call, hedge_after_s=0.01), timeout=0.1)
+        await asyncio.sleep(0)
+        assert len(calls) == 2 and all(task.cancelled() for task in calls)
+
+    asyncio.run(scenario())